@@ -31,19 +31,28 @@ UBOOT_DEFAULT_HEADER_LENGTH = 64
 RAMDISK_FNAME = "ramdisk.cpio"
 
 # Size of the chunks when copying file
-FILE_DOWNLOAD_CHUNK_SIZE = 32768
+FILE_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 # Size of the chunks when downloading over http
-HTTP_DOWNLOAD_CHUNK_SIZE = 32768
+HTTP_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 # Size of the chunks when downloading over scp
-SCP_DOWNLOAD_CHUNK_SIZE = 32768
+SCP_DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
 # dispatcher temporary directory
 # This is distinct from the TFTP daemon directory
 # Files here are for download using the Apache /tmp alias.
 DISPATCHER_DOWNLOAD_DIR = "/var/lib/lava/dispatcher/tmp"
 
+# Default size limit of the git mirrors cache (git_cache_path) in bytes
+GIT_CACHE_SIZE_LIMIT = 10 * 1024 * 1024 * 1024
+
+# Default size limit of the downloads cache (download_cache_path) in bytes
+DOWNLOAD_CACHE_SIZE_LIMIT = 50 * 1024 * 1024 * 1024
+
+# Default size limit of the test definitions cache (overlay_cache_path) in bytes
+OVERLAY_CACHE_SIZE_LIMIT = 10 * 1024 * 1024 * 1024
+
 # Distinctive prompt characters which can
 # help distinguish status messages from shell prompts.
 DISTINCTIVE_PROMPT_CHARACTERS = "\\:"
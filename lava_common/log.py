@@ -20,16 +20,136 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 import datetime
+import json
 import logging
+import re
+import threading
+import time
 import zmq
 import zmq.auth
 from zmq.utils.strtypes import b
 
 from lava_common.compat import yaml_dump
 
+# Versions of the log format:
+# 1: [job_id, YAML dictionary]
+# 2: [job_id, "2", JSON dictionary]
+# 3: [job_id, "3", JSON dictionary, JSON dictionary, ...]
+# The version is announced by the master in the HELLO_OK message.
+LOG_PROTOCOL_VERSION = 3
+
+# Limit the size of a log line. Keep this reasonable because the logs will be
+# loaded by CLoader that is limited to around 10**7 chars
+LOG_LINE_LIMIT = 10 ** 6
+
+# Characters that should be escaped to use a JSON string as a YAML line. The
+# escaped backslashes are matched first to keep the scan aligned.
+YAML_UNSAFE_JSON = re.compile(
+    r"\\\\|\\u(d[89ab][0-9a-f]{2})\\u(d[c-f][0-9a-f]{2})|\\u(d[89a-f][0-9a-f]{2})|\x7f"
+)
+
+# Floats that are not valid YAML 1.1 floats: the strings are matched first to
+# leave them untouched.
+YAML_UNSAFE_FLOAT = re.compile(
+    r'("(?:[^"\\]|\\.)*")|(-?)(NaN|Infinity)|(?<![0-9.])(-?[0-9]+)(e[-+][0-9]+)'
+)
+YAML_UNSAFE_FLOAT_HINT = re.compile(r"[0-9]e[-+]|NaN|Infinity")
+
+
+def _yaml_escape(match):
+    if match.group(0) == "\x7f":
+        return "\\x7f"
+    if match.group(0) == "\\\\":
+        return match.group(0)
+    if match.group(3):
+        # Lone surrogates can't be represented in YAML: keep the escape sequence
+        return "\\\\u" + match.group(3)
+    # Surrogate pairs are not supported in YAML double-quoted strings
+    high = int(match.group(1), 16) - 0xD800
+    low = int(match.group(2), 16) - 0xDC00
+    return "\\U%08x" % (0x10000 + (high << 10) + low)
+
+
+def _yaml_float(match):
+    if match.group(1):
+        return match.group(1)
+    if match.group(3):
+        return match.group(2) + (".nan" if match.group(3) == "NaN" else ".inf")
+    # YAML 1.1 floats should have a dot in the mantissa
+    return match.group(4) + ".0" + match.group(5)
+
+
+def json_to_yaml(data):
+    """
+    Dump the log line as a YAML line.
+
+    The JSON encoder is a lot faster than the YAML dumper and, with only ASCII
+    characters, a JSON dictionary is a valid YAML flow mapping. The only
+    exceptions are the surrogates and DEL that should be escaped, and the
+    floats without a dot in the mantissa, NaN and infinities.
+    """
+    message = json.dumps(data, ensure_ascii=True)
+    if "\\ud" in message or "\x7f" in message:
+        message = YAML_UNSAFE_JSON.sub(_yaml_escape, message)
+    if YAML_UNSAFE_FLOAT_HINT.search(message):
+        message = YAML_UNSAFE_FLOAT.sub(_yaml_float, message)
+    return message
+
+
+class LogMessage:
+    """
+    Log message that is only formatted when (and how) it's needed.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.yaml()
+
+    def _limit(self, dump):
+        data_str = dump(self.data)
+        # Test the limit and skip if the line is too long
+        if len(data_str) >= LOG_LINE_LIMIT:
+            data = dict(self.data)
+            if isinstance(data["msg"], str):
+                data["msg"] = "<line way too long ...>"
+            else:
+                data["msg"] = {"skip": "line way too long ..."}
+            data_str = dump(data)
+        return data_str
+
+    def json(self):
+        return self._limit(lambda d: json.dumps(d, ensure_ascii=True, default=str))
+
+    def yaml(self):
+        # Set width to a really large value in order to always get one line.
+        return self._limit(
+            lambda d: yaml_dump(
+                d, default_flow_style=True, default_style='"', width=LOG_LINE_LIMIT
+            )[:-1]
+        )
+
 
 class ZMQPushHandler(logging.Handler):
-    def __init__(self, logging_url, master_cert, slave_cert, job_id, socks_proxy, ipv6):
+    # When batching (log format version 3), the lines are sent when the batch
+    # is large or old enough, or right after a line with one of the
+    # BATCH_FLUSH_LEVELS as lava-logs should act upon them without delay.
+    BATCH_SIZE = 64 * 1024
+    BATCH_TIMEOUT = 0.05
+    BATCH_FLUSH_LEVELS = ["results", "marker", "event"]
+
+    def __init__(
+        self,
+        logging_url,
+        master_cert,
+        slave_cert,
+        job_id,
+        socks_proxy,
+        ipv6,
+        version=1,
+        batch=False,
+    ):
         super().__init__()
 
         # Keep track of the parameters
@@ -38,6 +158,7 @@ class ZMQPushHandler(logging.Handler):
         self.slave_cert = slave_cert
         self.socks_proxy = socks_proxy
         self.ipv6 = ipv6
+        self.version = version
 
         # Create the PUSH socket
 
@@ -64,14 +185,74 @@ class ZMQPushHandler(logging.Handler):
         self.job_id = str(job_id)
         self.formatter = logging.Formatter("%(message)s")
 
+        # Batching
+        self.batch = batch and version >= 3
+        self.lines = []
+        self.lines_size = 0
+        self.first_line = 0
+        self.flusher = None
+        self.closing = threading.Event()
+        if self.batch:
+            # Send the old batches, even when the job is not logging anymore
+            self.flusher = threading.Thread(target=self._flusher, daemon=True)
+            self.flusher.start()
+
+    def _flusher(self):
+        while not self.closing.wait(self.BATCH_TIMEOUT):
+            self.acquire()
+            try:
+                if (
+                    self.lines
+                    and time.monotonic() - self.first_line >= self.BATCH_TIMEOUT
+                ):
+                    self.flush()
+            finally:
+                self.release()
+
     def emit(self, record):
-        msg = [b(self.job_id), b(self.formatter.format(record))]
-        self.socket.send_multipart(msg)
+        if self.version < 2 or not isinstance(record.msg, LogMessage):
+            # Keep the lines in order
+            self.flush()
+            msg = [b(self.job_id), b(self.formatter.format(record))]
+            self.socket.send_multipart(msg)
+            return
+
+        line = b(record.msg.json())
+        if self.version == 2:
+            self.socket.send_multipart([b(self.job_id), b"2", line])
+            return
+
+        if not self.lines:
+            self.first_line = time.monotonic()
+        self.lines.append(line)
+        self.lines_size += len(line)
+        if (
+            not self.batch
+            or self.lines_size >= self.BATCH_SIZE
+            or time.monotonic() - self.first_line >= self.BATCH_TIMEOUT
+            or record.msg.data["lvl"] in self.BATCH_FLUSH_LEVELS
+        ):
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.lines:
+                self.socket.send_multipart([b(self.job_id), b"3"] + self.lines)
+                self.lines = []
+                self.lines_size = 0
+        finally:
+            self.release()
 
     def close(self, linger=-1):
         # If the process crashes really early, the handler will be closed
         # directly by the logging module. In this case, close is called without
         # any arguments.
+        if self.flusher is not None:
+            self.closing.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
         super().close()
         self.context.destroy(linger=linger)
 
@@ -82,10 +263,25 @@ class YAMLLogger(logging.Logger):
         self.handler = None
 
     def addZMQHandler(
-        self, logging_url, master_cert, slave_cert, job_id, socks_proxy, ipv6
+        self,
+        logging_url,
+        master_cert,
+        slave_cert,
+        job_id,
+        socks_proxy,
+        ipv6,
+        version=1,
+        batch=False,
     ):
         self.handler = ZMQPushHandler(
-            logging_url, master_cert, slave_cert, job_id, socks_proxy, ipv6
+            logging_url,
+            master_cert,
+            slave_cert,
+            job_id,
+            socks_proxy,
+            ipv6,
+            version,
+            batch,
         )
         self.addHandler(self.handler)
         return self.handler
@@ -105,22 +301,8 @@ class YAMLLogger(logging.Logger):
         else:
             data["msg"] = message
 
-        # Set width to a really large value in order to always get one line.
-        # But keep this reasonable because the logs will be loaded by CLoader
-        # that is limited to around 10**7 chars
-        data_str = yaml_dump(
-            data, default_flow_style=True, default_style='"', width=10 ** 6
-        )[:-1]
-        # Test the limit and skip if the line is too long
-        if len(data_str) >= 10 ** 6:
-            if isinstance(message, str):
-                data["msg"] = "<line way too long ...>"
-            else:
-                data["msg"] = {"skip": "line way too long ..."}
-            data_str = yaml_dump(
-                data, default_flow_style=True, default_style='"', width=10 ** 6
-            )[:-1]
-        self._log(level, data_str, ())
+        # The message is serialized by the handlers, in the format they need
+        self._log(level, LogMessage(data), ())
 
     def exception(self, exc, *args, **kwargs):
         self.log_message(logging.ERROR, "exception", exc, *args, **kwargs)
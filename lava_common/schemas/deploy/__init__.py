@@ -44,6 +44,7 @@ def url(extra=None):
             **extra,
             Required("format"): Any("cpio.newc", "ext4"),
             Optional("partition"): int,
+            Optional("append_overlay"): bool,
             Required("overlays"): {
                 Optional("lava"): bool,
                 str: {
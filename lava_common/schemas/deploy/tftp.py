@@ -40,6 +40,7 @@ def schema():
             {
                 Optional("install_modules"): bool,
                 Optional("install_overlay"): bool,
+                Optional("append_overlay"): bool,
                 Optional("header"): "u-boot",
             }
         ),
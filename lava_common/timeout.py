@@ -21,9 +21,10 @@
 import datetime
 import time
 import signal
+import threading
 from contextlib import contextmanager
 from lava_common.constants import ACTION_TIMEOUT
-from lava_common.exceptions import JobError, ConfigurationError
+from lava_common.exceptions import JobCanceled, JobError, ConfigurationError
 
 
 class Timeout:
@@ -36,8 +37,13 @@ class Timeout:
     the timeout.
     If a connection is set, this timeout is used per pexpect operation on that connection.
     If a connection is not set, this timeout applies for the entire run function of the action.
+
+    Signals are only delivered to the main thread. For the actions running in another thread,
+    the deadlines are kept in a thread local and enforced by calling Timeout.check().
     """
 
+    local = threading.local()
+
     def __init__(self, name, duration=ACTION_TIMEOUT, exception=JobError):
         self.name = name
         self.start = 0
@@ -74,6 +80,30 @@ class Timeout:
         duration = int(time.time() - self.start)
         raise self.exception("%s timed out after %s seconds" % (self.name, duration))
 
+    @classmethod
+    def check(cls):
+        """
+        Raise if a timeout of the current thread expired or if the thread was
+        cancelled. In the main thread, SIGALRM is used instead.
+        """
+        cancel = getattr(cls.local, "cancel", None)
+        if cancel is not None and cancel.is_set():
+            raise JobCanceled("Cancelled as a parallel action failed or timed out")
+        now = time.time()
+        for (timeout, max_end_time) in getattr(cls.local, "deadlines", []):
+            if now >= max_end_time:
+                timeout._timed_out(None, None)
+
+    def _threaded(self, max_end_time):
+        deadlines = self.local.__dict__.setdefault("deadlines", [])
+        deadlines.append((self, max_end_time))
+        try:
+            self.check()
+            yield max_end_time
+        finally:
+            deadlines.pop()
+            self.elapsed_time = time.time() - self.start
+
     @contextmanager
     def __call__(self, parent, action_max_end_time):
         self.start = time.time()
@@ -83,6 +113,10 @@ class Timeout:
             # action_max_end_time is None when called by the job class directly
             max_end_time = min(action_max_end_time, max_end_time)
 
+        if threading.current_thread() is not threading.main_thread():
+            yield from self._threaded(max_end_time)
+            return
+
         duration = round(max_end_time - self.start)
         if duration <= 0:
             # If duration is lower than 0, then the timeout should be raised now.
@@ -19,6 +19,7 @@
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
 from collections import OrderedDict
+import concurrent.futures
 import logging
 import copy
 from functools import reduce
@@ -28,6 +29,7 @@ import types
 import traceback
 import shlex
 import subprocess  # nosec - internal
+import threading
 import warnings
 
 from lava_common.decorators import nottest
@@ -220,78 +222,141 @@ class Pipeline:
         # Diagnosis is not allowed to alter the connection, do not use the return value.
         return None
 
-    def run_actions(self, connection, max_end_time):
+    def _groups(self):
+        """
+        Split the actions into groups of consecutive actions that can run in
+        parallel (like the downloads). Without parallel_downloads in the
+        dispatcher configuration, each action is alone in its group.
+        """
+        workers = 1
+        if self.job is not None:
+            workers = self.job.parameters.get("dispatcher", {}).get(
+                "parallel_downloads", 1
+            )
+        groups = []
         for action in self.actions:
-            failed = False
-            namespace = action.parameters.get("namespace", "common")
-            # Begin the action
+            if workers > 1 and action.parallel and groups and groups[-1][0].parallel:
+                groups[-1].append(action)
+            else:
+                groups.append([action])
+        return (groups, workers)
+
+    def run_actions(self, connection, max_end_time):
+        (groups, workers) = self._groups()
+        for actions in groups:
+            if len(actions) == 1:
+                new_connection = self.run_action(actions[0], connection, max_end_time)
+            else:
+                new_connection = self.run_parallel(
+                    actions, workers, connection, max_end_time
+                )
+            if new_connection:
+                connection = new_connection
+        return connection
+
+    def run_parallel(self, actions, workers, connection, max_end_time):
+        """
+        Run the actions in a pool of threads. When an action fails, the others
+        are cancelled and the first error is raised once every thread has
+        stopped.
+        """
+        cancel = threading.Event()
+
+        def run(action):
+            Timeout.local.cancel = cancel
             try:
-                parent = self.parent if self.parent else self.job
-                with action.timeout(parent, max_end_time) as action_max_end_time:
-                    # Add action start timestamp to the log message
-                    # Log in INFO for root actions and in DEBUG for the other actions
-                    timeout = seconds_to_str(action_max_end_time - action.timeout.start)
-                    msg = "start: %s %s (timeout %s) [%s]" % (
-                        action.level,
-                        action.name,
-                        timeout,
-                        namespace,
-                    )
-                    if self.parent is None:
-                        action.logger.info(msg)
-                    else:
-                        action.logger.debug(msg)
-
-                    new_connection = action.run(connection, action_max_end_time)
-            except LAVATimeoutError as exc:
-                action.logger.exception(str(exc))
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                if action.timeout.can_skip(action.parameters):
-                    if self.parent is None:
-                        action.logger.warning(
-                            "skip_timeout is set for %s - continuing to next action block."
-                            % (action.name)
-                        )
-                    else:
-                        raise
-                    new_connection = None
-                else:
-                    raise TestError(str(exc))
-            except LAVAError as exc:
-                action.logger.exception(str(exc))
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                self._diagnose(connection)
-                raise
-            except Exception as exc:
-                action.logger.exception(traceback.format_exc())
-                # allows retries without setting errors, which make the job incomplete.
-                failed = True
-                action.results = {"fail": str(exc)}
-                # Raise a LAVABug that will be correctly classified later
-                raise LAVABug(str(exc))
+                return self.run_action(action, connection, max_end_time)
             finally:
-                # Add action end timestamp to the log message
-                duration = round(action.timeout.elapsed_time)
-                msg = "end: %s %s (duration %s) [%s]" % (
+                Timeout.local.cancel = None
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, action) for action in actions]
+            try:
+                (done, _) = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_EXCEPTION
+                )
+                for future in futures:
+                    if future in done and future.exception() is not None:
+                        raise future.exception()
+            except BaseException:
+                # Raised by a thread or by the parent timeout (SIGALRM)
+                cancel.set()
+                concurrent.futures.wait(futures)
+                raise
+        new_connection = None
+        for future in futures:
+            new_connection = future.result() or new_connection
+        return new_connection
+
+    def run_action(self, action, connection, max_end_time):
+        failed = False
+        namespace = action.parameters.get("namespace", "common")
+        # Begin the action
+        try:
+            parent = self.parent if self.parent else self.job
+            with action.timeout(parent, max_end_time) as action_max_end_time:
+                # Add action start timestamp to the log message
+                # Log in INFO for root actions and in DEBUG for the other actions
+                timeout = seconds_to_str(action_max_end_time - action.timeout.start)
+                msg = "start: %s %s (timeout %s) [%s]" % (
                     action.level,
                     action.name,
-                    seconds_to_str(duration),
+                    timeout,
                     namespace,
                 )
                 if self.parent is None:
                     action.logger.info(msg)
                 else:
                     action.logger.debug(msg)
-                # set results including retries and failed actions
-                action.log_action_results(fail=failed)
 
-            if new_connection:
-                connection = new_connection
-        return connection
+                new_connection = action.run(connection, action_max_end_time)
+        except LAVATimeoutError as exc:
+            action.logger.exception(str(exc))
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            if action.timeout.can_skip(action.parameters):
+                if self.parent is None:
+                    action.logger.warning(
+                        "skip_timeout is set for %s - continuing to next action block."
+                        % (action.name)
+                    )
+                else:
+                    raise
+                new_connection = None
+            else:
+                raise TestError(str(exc))
+        except LAVAError as exc:
+            action.logger.exception(str(exc))
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            self._diagnose(connection)
+            raise
+        except Exception as exc:
+            action.logger.exception(traceback.format_exc())
+            # allows retries without setting errors, which make the job incomplete.
+            failed = True
+            action.results = {"fail": str(exc)}
+            # Raise a LAVABug that will be correctly classified later
+            raise LAVABug(str(exc))
+        finally:
+            # Add action end timestamp to the log message
+            duration = round(action.timeout.elapsed_time)
+            msg = "end: %s %s (duration %s) [%s]" % (
+                action.level,
+                action.name,
+                seconds_to_str(duration),
+                namespace,
+            )
+            if self.parent is None:
+                action.logger.info(msg)
+            else:
+                action.logger.debug(msg)
+            # set results including retries and failed actions
+            action.log_action_results(fail=failed)
+
+        return new_connection
 
 
 class CommandLogger:
@@ -370,6 +435,8 @@ class Action:
     timeout_exception = JobError
     # Exception to raise when a command run by the action fails
     command_exception = JobError
+    # Can consecutive instances run in parallel (see Pipeline.run_actions)
+    parallel = False
 
     @property
     def data(self):
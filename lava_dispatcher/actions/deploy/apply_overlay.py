@@ -40,6 +40,7 @@ from lava_dispatcher.utils.shell import which
 from lava_dispatcher.utils.compression import (
     compress_file,
     cpio,
+    cpio_append,
     decompress_file,
     untar_file,
     uncpio,
@@ -542,6 +543,11 @@ class ExtractRamdisk(Action):
     applies the overlay and then leaves the ramdisk open
     for other actions to modify. Needs CompressRamdisk to
     recreate the ramdisk with modifications.
+
+    Unless the ramdisk has a uboot header or append_overlay is
+    false, the ramdisk is not extracted: other actions get an
+    empty directory that CompressRamdisk appends to the
+    original ramdisk.
     """
 
     name = "extract-overlay-ramdisk"
@@ -552,6 +558,7 @@ class ExtractRamdisk(Action):
     def __init__(self):
         super().__init__()
         self.skip = False
+        self.append = False
 
     def validate(self):
         super().validate()
@@ -561,6 +568,10 @@ class ExtractRamdisk(Action):
             "install_modules", True
         ) and not self.parameters["ramdisk"].get("install_overlay", True):
             self.skip = True
+        self.append = (
+            self.parameters["ramdisk"].get("append_overlay", True)
+            and self.parameters["ramdisk"].get("header") != "u-boot"
+        )
 
     def run(self, connection, max_end_time):
         if not self.parameters.get("ramdisk"):  # idempotency
@@ -600,8 +611,12 @@ class ExtractRamdisk(Action):
         else:
             # give the file a predictable name
             shutil.move(ramdisk, ramdisk_compressed_data)
-        ramdisk_data = decompress_file(ramdisk_compressed_data, compression)
-        uncpio(ramdisk_data, extracted_ramdisk)
+        if self.append:
+            self.logger.debug("Not extracting ramdisk, the overlay will be appended")
+            ramdisk_data = ramdisk_compressed_data
+        else:
+            ramdisk_data = decompress_file(ramdisk_compressed_data, compression)
+            uncpio(ramdisk_data, extracted_ramdisk)
 
         # tell other actions where the unpacked ramdisk can be found
         self.set_namespace_data(
@@ -613,6 +628,9 @@ class ExtractRamdisk(Action):
         self.set_namespace_data(
             action=self.name, label="ramdisk_file", key="file", value=ramdisk_data
         )
+        self.set_namespace_data(
+            action=self.name, label="ramdisk_file", key="append", value=self.append
+        )
         return connection
 
 
@@ -694,12 +712,21 @@ class CompressRamdisk(Action):
                     action=self.name, label="file", key="preseed_local", value=filename
                 )
 
-        self.logger.info("Building ramdisk %s containing %s", ramdisk_data, ramdisk_dir)
-        self.logger.debug(">> %s", cpio(ramdisk_dir, ramdisk_data))
-
         # we need to compress the ramdisk with the same method is was submitted with
         compression = self.parameters["ramdisk"].get("compression")
-        final_file = compress_file(ramdisk_data, compression)
+        threads = self.job.parameters.get("dispatcher", {}).get("compression_threads")
+        if self.get_namespace_data(
+            action="extract-overlay-ramdisk", label="ramdisk_file", key="append"
+        ):
+            self.logger.info("Appending %s to ramdisk %s", ramdisk_dir, ramdisk_data)
+            cpio_append(ramdisk_dir, ramdisk_data, compression, threads)
+            final_file = ramdisk_data
+        else:
+            self.logger.info(
+                "Building ramdisk %s containing %s", ramdisk_data, ramdisk_dir
+            )
+            self.logger.debug(">> %s", cpio(ramdisk_dir, ramdisk_data))
+            final_file = compress_file(ramdisk_data, compression, threads)
 
         tftp_dir = os.path.dirname(
             self.get_namespace_data(
@@ -908,16 +935,22 @@ class AppendOverlays(Action):
         decompressed = self.get_namespace_data(
             action="download-action", label=self.key, key="decompressed"
         )
+        # Some images are kept compressed
+        if not compression or decompressed:
+            compression = None
+        append = self.params.get("append_overlay", True)
+        threads = self.job.parameters.get("dispatcher", {}).get("compression_threads")
         self.logger.info("Modifying %r", image)
         tempdir = self.mkdtemp()
-        # Some images are kept compressed. We should decompress first
-        if compression and not decompressed:
-            self.logger.debug("* decompressing (%s)", compression)
-            image = decompress_file(image, compression)
-        # extract the archive
-        self.logger.debug("* extracting %r", image)
-        uncpio(image, tempdir)
-        os.unlink(image)
+        if not append:
+            # The image should be decompressed first
+            if compression:
+                self.logger.debug("* decompressing (%s)", compression)
+                image = decompress_file(image, compression)
+            # extract the archive
+            self.logger.debug("* extracting %r", image)
+            uncpio(image, tempdir)
+            os.unlink(image)
 
         # Add overlays
         self.logger.debug("Overlays:")
@@ -942,12 +975,18 @@ class AppendOverlays(Action):
             # and does not contains '..'
             untar_file(overlay_image, extract_path)
 
+        if append:
+            # Only the overlays are archived and compressed
+            self.logger.debug("* appending to %r", image)
+            cpio_append(tempdir, image, compression, threads)
+            return
+
         # Recreating the archive
         self.logger.debug("* archiving %r", image)
         cpio(tempdir, image)
-        if compression and not decompressed:
+        if compression:
             self.logger.debug("* compressing (%s)", compression)
-            image = compress_file(image, compression)
+            image = compress_file(image, compression, threads)
 
     def update_guestfs(self):
         image = self.get_namespace_data(
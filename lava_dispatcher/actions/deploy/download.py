@@ -28,7 +28,9 @@ import errno
 import math
 import os
 import pathlib
+import queue
 import shutil
+import threading
 import time
 import hashlib
 import requests
@@ -40,8 +42,10 @@ from lava_dispatcher.actions.deploy.apply_overlay import AppendOverlays
 from lava_dispatcher.actions.deploy.overlay import OverlayAction
 from lava_dispatcher.connections.serial import ConnectDevice
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug
+from lava_common.timeout import Timeout
 from lava_dispatcher.action import Action, Pipeline
 from lava_dispatcher.logical import Deployment, RetryAction
+from lava_dispatcher.utils.cache import DownloadCache
 from lava_dispatcher.utils.compression import untar_file
 from lava_dispatcher.utils.filesystem import (
     copy_to_lxc,
@@ -77,6 +81,9 @@ class DownloaderAction(RetryAction):
         self.path = path  # where to download
         self.uniquify = uniquify
         self.params = params
+        # Downloads sharing the same directory cannot run in parallel: the
+        # directory is removed when retrying.
+        self.parallel = uniquify
 
     def populate(self, parameters):
         self.pipeline = Pipeline(parent=self, job=self.job, parameters=parameters)
@@ -122,6 +129,57 @@ class DownloaderAction(RetryAction):
             self.pipeline.add_action(AppendOverlays(self.key, params=self.params))
 
 
+class Checksums:
+    """
+    Compute the checksums of the downloaded chunks in separate threads (one
+    per algorithm), each fed by a bounded queue. hashlib releases the GIL on
+    large buffers, so the checksums are computed while the next chunks are
+    downloaded and written.
+    """
+
+    QUEUE_SIZE = 16
+
+    def __init__(self, algorithms):
+        self.hashes = {
+            algorithm: hashlib.new(algorithm)  # nosec - not used for cryptography.
+            for algorithm in algorithms
+        }
+        self.queues = {
+            algorithm: queue.Queue(self.QUEUE_SIZE) for algorithm in algorithms
+        }
+        self.threads = [
+            threading.Thread(target=self._run, args=[algorithm], daemon=True)
+            for algorithm in algorithms
+        ]
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for pending in self.queues.values():
+            pending.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self, algorithm):
+        hashobj = self.hashes[algorithm]
+        pending = self.queues[algorithm]
+        buff = pending.get()
+        while buff is not None:
+            hashobj.update(buff)
+            buff = pending.get()
+
+    def update(self, buff):
+        # The chunks are immutable bytes, shared by the threads without copy
+        for pending in self.queues.values():
+            pending.put(buff)
+
+    def hexdigests(self):
+        return {k: v.hexdigest() for (k, v) in self.hashes.items()}
+
+
 class DownloadHandler(Action):
     """
     The identification of which downloader and whether to
@@ -137,6 +195,8 @@ class DownloadHandler(Action):
     description = "download action"
     summary = "download-action"
     timeout_exception = InfrastructureError
+    # Can the downloaded files be stored in the download cache
+    cacheable = False
 
     # Supported decompression commands
     decompress_command_map = {
@@ -151,6 +211,8 @@ class DownloadHandler(Action):
         self.url = url
         self.key = key
         self.size = -1
+        # ETag, Last-Modified... used to validate the cached files
+        self.validators = {}
 
         self.path = path
         # Store the files in a sub-directory to keep the path unique.
@@ -282,9 +344,6 @@ class DownloadHandler(Action):
 
         connection = super().run(connection, max_end_time)
         # self.cookies = self.job.context.config.lava_cookies  # FIXME: work out how to restore
-        md5 = hashlib.md5()  # nosec - not being used for cryptography.
-        sha256 = hashlib.sha256()
-        sha512 = hashlib.sha512()
 
         # Create a fresh directory if the old one has been removed by a previous cleanup
         # (when retrying inside a RetryAction)
@@ -310,6 +369,9 @@ class DownloadHandler(Action):
         md5sum = self.params.get("md5sum")
         sha256sum = self.params.get("sha256sum")
         sha512sum = self.params.get("sha512sum")
+        expected = {"md5": md5sum, "sha256": sha256sum, "sha512": sha512sum}
+        # Only compute the requested checksums (sha256 by default)
+        algorithms = [k for (k, v) in expected.items() if v] or ["sha256"]
 
         if os.path.isdir(self.fname):
             raise JobError("Download '%s' is a directory, not a file" % self.fname)
@@ -348,18 +410,54 @@ class DownloadHandler(Action):
         elif not self.params.get("compression", False):
             self.logger.debug("No compression specified")
 
-        def update_progress():
-            nonlocal downloaded_size, last_value, md5, sha256, sha512
+        def update_progress(buff):
+            nonlocal downloaded_size, last_value
+            # Enforce the timeouts when running in parallel
+            Timeout.check()
             downloaded_size += len(buff)
             (printing, new_value, msg) = progress(downloaded_size, last_value)
             if printing:
                 last_value = new_value
                 self.logger.debug(msg)
-            md5.update(buff)
-            sha256.update(buff)
-            sha512.update(buff)
 
-        if compression and decompress_command:
+        def download():
+            with Checksums(algorithms) as checksums:
+
+                def chunks():
+                    for buff in self.reader():
+                        update_progress(buff)
+                        checksums.update(buff)
+                        yield buff
+
+                if compression and decompress_command:
+                    write_decompressed(chunks())
+                else:
+                    with open(self.fname, "wb") as dwnld_file:
+                        for buff in chunks():
+                            dwnld_file.write(buff)
+
+            # Log the download speed
+            ending = time.time()
+            self.logger.info(
+                "%dMB downloaded in %0.2fs (%0.2fMB/s)",
+                downloaded_size / (1024 * 1024),
+                round(ending - beginning, 2),
+                round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
+            )
+
+            # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
+            # because requests will decompress the file on the fly, creating a larger file than
+            # LAVA expects.
+            if self.size > 0 and self.size != downloaded_size:
+                raise InfrastructureError(
+                    "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
+                    % (downloaded_size, self.size)
+                )
+            return checksums.hexdigests()
+
+        def write_decompressed(chunks):
+            # The decompressor runs in another process: the chunks are written
+            # to the pipe directly, without being copied in the pipe buffer.
             try:
                 with open(self.fname, "wb") as dwnld_file:
                     proc = subprocess.Popen(  # nosec - internal.
@@ -371,8 +469,7 @@ class DownloadHandler(Action):
                 raise InfrastructureError(msg)
 
             with proc.stdin as pipe:
-                for buff in self.reader():
-                    update_progress()
+                for buff in chunks:
                     try:
                         pipe.write(buff)
                     except BrokenPipeError as exc:
@@ -385,30 +482,55 @@ class DownloadHandler(Action):
                         self.logger.error(msg)
                         raise JobError(error_message)
             proc.wait()
-        else:
-            with open(self.fname, "wb") as dwnld_file:
-                for buff in self.reader():
-                    update_progress()
-                    dwnld_file.write(buff)
-
-        # Log the download speed
-        ending = time.time()
-        self.logger.info(
-            "%dMB downloaded in %0.2fs (%0.2fMB/s)",
-            downloaded_size / (1024 * 1024),
-            round(ending - beginning, 2),
-            round(downloaded_size / (1024 * 1024 * (ending - beginning)), 2),
-        )
 
-        # If the remote server uses "Content-Encoding: gzip", this calculation will be wrong
-        # because requests will decompress the file on the fly, creating a larger file than
-        # LAVA expects.
-        if self.size > 0 and self.size != downloaded_size:
-            raise InfrastructureError(
-                "Download finished (%i bytes) but was not expected size (%i bytes), check your networking."
-                % (downloaded_size, self.size)
+        cache = None
+        if self.cacheable:
+            cache = DownloadCache.from_config(self.job.parameters.get("dispatcher", {}))
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.key(
+                self.url.geturl(), self.validators, expected, decompress_command or ""
             )
 
+        if cache_key is None:
+            checksums = download()
+        else:
+            with cache.lock(cache_key) as entry:
+                metadata = cache.get(entry)
+                # Entries stored without the requested checksums are ignored
+                if metadata is not None and not all(
+                    k in metadata["checksums"] for k in algorithms
+                ):
+                    metadata = None
+                if metadata is not None:
+                    self.logger.info("Download cache hit for '%s'", self.url.geturl())
+                    cache.retrieve(entry, self.fname)
+                    downloaded_size = metadata["size"]
+                    checksums = metadata["checksums"]
+                else:
+                    self.logger.info("Download cache miss for '%s'", self.url.geturl())
+                    checksums = download()
+                    # Only cache the files matching the expected checksums
+                    if all(checksums[k] == v for (k, v) in expected.items() if v):
+                        try:
+                            cache.add(
+                                entry,
+                                self.fname,
+                                {
+                                    "url": self.url.geturl(),
+                                    "size": downloaded_size,
+                                    "checksums": checksums,
+                                },
+                            )
+                        except OSError as exc:
+                            self.logger.warning(
+                                "Unable to store '%s' in the download cache: %s",
+                                self.url.geturl(),
+                                str(exc),
+                            )
+            self.results = {"download-cache": "miss" if metadata is None else "hit"}
+            cache.evict()
+
         # set the dynamic data into the context
         self.set_namespace_data(
             action="download-action", label=self.key, key="file", value=self.fname
@@ -416,21 +538,10 @@ class DownloadHandler(Action):
         self.set_namespace_data(
             action="download-action", label="file", key=self.key, value=self.fname
         )
-        self.set_namespace_data(
-            action="download-action", label=self.key, key="md5", value=md5.hexdigest()
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha256",
-            value=sha256.hexdigest(),
-        )
-        self.set_namespace_data(
-            action="download-action",
-            label=self.key,
-            key="sha512",
-            value=sha512.hexdigest(),
-        )
+        for (algorithm, value) in checksums.items():
+            self.set_namespace_data(
+                action="download-action", label=self.key, key=algorithm, value=value
+            )
 
         # handle archive files
         archive = self.params.get("archive")
@@ -454,9 +565,8 @@ class DownloadHandler(Action):
                 value=target_fname_path,
             )
 
-        self._check_checksum("md5", md5.hexdigest(), md5sum)
-        self._check_checksum("sha256", sha256.hexdigest(), sha256sum)
-        self._check_checksum("sha512", sha512.hexdigest(), sha512sum)
+        for algorithm in algorithms:
+            self._check_checksum(algorithm, checksums[algorithm], expected[algorithm])
 
         # certain deployments need prefixes set
         if self.parameters["to"] == "tftp" or self.parameters["to"] == "nbd":
@@ -487,25 +597,10 @@ class DownloadHandler(Action):
         if "lava-xnbd" in self.parameters and nbdroot:
             self.parameters["lava-xnbd"]["nbdroot"] = nbdroot
 
-        self.results = {
-            "label": self.key,
-            "size": downloaded_size,
-            "md5sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="md5"
-                )
-            ),
-            "sha256sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha256"
-                )
-            ),
-            "sha512sum": str(
-                self.get_namespace_data(
-                    action="download-action", label=self.key, key="sha512"
-                )
-            ),
-        }
+        results = {"label": self.key, "size": downloaded_size}
+        for (algorithm, value) in checksums.items():
+            results["%ssum" % algorithm] = value
+        self.results = results
         return connection
 
 
@@ -549,6 +644,7 @@ class HttpDownloadAction(DownloadHandler):
     name = "http-download"
     description = "use http to download the file"
     summary = "http download"
+    cacheable = True
 
     def validate(self):
         super().validate()
@@ -590,6 +686,13 @@ class HttpDownloadAction(DownloadHandler):
                     return
 
             self.size = int(res.headers.get("content-length", -1))
+            self.validators = {
+                key: res.headers[key]
+                for key in ["etag", "last-modified"]
+                if res.headers.get(key)
+            }
+            if self.validators:
+                self.validators["size"] = self.size
         except requests.Timeout:
             self.logger.error("Request timed out")
             self.errors = "'%s' timed out" % (self.url.geturl())
@@ -633,6 +736,7 @@ class ScpDownloadAction(DownloadHandler):
     name = "scp-download"
     description = "Use scp to copy the file"
     summary = "scp download"
+    cacheable = True
 
     def validate(self):
         super().validate()
@@ -27,6 +27,7 @@ from lava_dispatcher.action import Action, Pipeline
 from lava_common.exceptions import InfrastructureError, LAVABug
 from lava_dispatcher.actions.deploy.testdef import TestDefinitionAction
 from lava_dispatcher.logical import Deployment
+from lava_dispatcher.utils.compression import compress_file
 from lava_dispatcher.utils.contextmanager import chdir
 from lava_dispatcher.utils.filesystem import check_ssh_identity_file
 from lava_dispatcher.utils.shell import which
@@ -581,7 +582,8 @@ class CompressOverlay(Action):
         connection = super().run(connection, max_end_time)
         with chdir(location):
             try:
-                with tarfile.open(output, "w:gz") as tar:
+                # Compressed afterwards, using every cpu
+                with tarfile.open(output[: -len(".gz")], "w") as tar:
                     tar.add(".%s" % lava_test_results_dir)
                     # ssh authorization support
                     if os.path.exists("./root/"):
@@ -590,6 +592,11 @@ class CompressOverlay(Action):
                 raise InfrastructureError(
                     "Unable to create lava overlay tarball: %s" % exc
                 )
+        compress_file(
+            output[: -len(".gz")],
+            "gz",
+            self.job.parameters.get("dispatcher", {}).get("compression_threads"),
+        )
 
         self.set_namespace_data(
             action=self.name, label="output", key="file", value=output
@@ -30,8 +30,9 @@ from lava_common.compat import yaml_safe_dump, yaml_safe_load
 from lava_common.decorators import nottest
 from lava_common.exceptions import InfrastructureError, JobError, LAVABug, TestError
 from lava_dispatcher.action import Action, Pipeline
+from lava_dispatcher.utils.cache import OverlayCache
 from lava_dispatcher.utils.strings import indices
-from lava_dispatcher.utils.vcs import GitHelper
+from lava_dispatcher.utils.vcs import GitCache, GitHelper
 from lava_common.constants import DEFAULT_TESTDEF_NAME_CLASS, DISPATCHER_DOWNLOAD_DIR
 
 
@@ -253,7 +254,10 @@ class GitRepoAction(RepoAction):
             self.errors = "Path to YAML file not specified in the job definition"
         if not self.valid:
             return
-        self.vcs = GitHelper(self.parameters["repository"])
+        self.vcs = GitHelper(
+            self.parameters["repository"],
+            cache=GitCache.from_config(self.job.parameters.get("dispatcher", {})),
+        )
         super().validate()
 
     @classmethod
@@ -296,23 +300,53 @@ class GitRepoAction(RepoAction):
         if not revision:
             shallow = self.parameters.get("shallow", True)
 
-        commit_id = self.vcs.clone(
-            runner_path,
-            shallow=shallow,
-            revision=revision,
-            branch=branch,
-            history=self.parameters.get("history", True),
-        )
-        if commit_id is None:
-            raise InfrastructureError(
-                "Unable to get test definition from %s (%s)"
-                % (self.vcs.binary, self.parameters)
+        history = self.parameters.get("history", True)
+
+        # The checkouts of the pinned commits are kept in the overlay cache
+        cache = OverlayCache.from_config(self.job.parameters.get("dispatcher", {}))
+        overlay_hit = None
+        if cache is not None and revision and re.match("^[0-9a-f]{40}$", revision):
+            key = cache.key(
+                self.parameters["repository"],
+                revision,
+                {"branch": branch, "history": history},
             )
+            with cache.lock(key) as entry:
+                overlay_hit = cache.get(entry) is not None
+                if overlay_hit:
+                    self.logger.info("Using the cached checkout of %s", revision)
+                    cache.extract(entry, runner_path)
+                    commit_id = revision
+                else:
+                    commit_id = self.clone(runner_path, shallow, revision, branch)
+                    try:
+                        cache.store(
+                            entry,
+                            runner_path,
+                            {
+                                "url": "%s@%s"
+                                % (self.parameters["repository"], revision)
+                            },
+                        )
+                    except (OSError, tarfile.TarError) as exc:
+                        self.logger.warning(
+                            "Unable to store '%s' in the overlay cache: %s",
+                            self.parameters["repository"],
+                            str(exc),
+                        )
+            cache.evict()
+        else:
+            commit_id = self.clone(runner_path, shallow, revision, branch)
+
         self.results = {
             "commit": commit_id,
             "repository": self.parameters["repository"],
             "path": self.parameters["path"],
         }
+        if self.vcs.cache_hit is not None:
+            self.results["git-cache"] = "hit" if self.vcs.cache_hit else "miss"
+        if overlay_hit is not None:
+            self.results["overlay-cache"] = "hit" if overlay_hit else "miss"
 
         # now read the YAML to create a testdef dict to retrieve metadata
         yaml_file = os.path.join(runner_path, self.parameters["path"])
@@ -331,6 +365,21 @@ class GitRepoAction(RepoAction):
 
         return connection
 
+    def clone(self, runner_path, shallow, revision, branch):
+        commit_id = self.vcs.clone(
+            runner_path,
+            shallow=shallow,
+            revision=revision,
+            branch=branch,
+            history=self.parameters.get("history", True),
+        )
+        if commit_id is None:
+            raise InfrastructureError(
+                "Unable to get test definition from %s (%s)"
+                % (self.vcs.binary, self.parameters)
+            )
+        return commit_id
+
 
 class InlineRepoAction(RepoAction):
 
@@ -869,6 +918,7 @@ class TestInstallAction(TestOverlayAction):
 
     def install_git_repos(self, testdef, runner_path):
         repos = testdef["install"].get("git-repos", [])
+        cache = GitCache.from_config(self.job.parameters.get("dispatcher", {}))
         for repo in repos:
             commit_id = None
             if isinstance(repo, str):
@@ -877,7 +927,7 @@ class TestInstallAction(TestOverlayAction):
                     ".git", "", len(repo) - 1
                 )  # drop .git from the end, if present
                 dest_path = os.path.join(runner_path, os.path.basename(subdir))
-                commit_id = GitHelper(repo).clone(dest_path)
+                commit_id = GitHelper(repo, cache=cache).clone(dest_path)
             elif isinstance(repo, dict):
                 # TODO: We use 'skip_by_default' to check if this
                 # specific repository should be skipped. The value
@@ -905,7 +955,9 @@ class TestInstallAction(TestOverlayAction):
                         raise TestError(
                             "Cannot mix string and url forms for the same repository."
                         )
-                    commit_id = GitHelper(url).clone(dest_path, branch=branch)
+                    commit_id = GitHelper(url, cache=cache).clone(
+                        dest_path, branch=branch
+                    )
             else:
                 raise TestError("Unrecognised git-repos block.")
             if commit_id is None:
@@ -47,6 +47,10 @@ class ZMQConfig:
         self.slave_cert = slave_cert
         self.socks_proxy = socks_proxy
         self.ipv6 = ipv6
+        # Version of the log format, negotiated with the master
+        self.log_version = 1
+        # Send the logs by batches (when supported by the log format)
+        self.log_batch = False
 
 
 class Job:
@@ -0,0 +1,275 @@
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA Dispatcher.
+#
+# LAVA Dispatcher is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# LAVA Dispatcher is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along
+# with this program; if not, see <http://www.gnu.org/licenses>.
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+
+from lava_common.constants import DOWNLOAD_CACHE_SIZE_LIMIT, OVERLAY_CACHE_SIZE_LIMIT
+from lava_common.exceptions import InfrastructureError
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """
+    Copy src to dst, sharing the blocks when the filesystem supports it.
+    Return True if the file was reflinked.
+    """
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            return True
+        except OSError:
+            shutil.copyfileobj(f_src, f_dst, 1024 * 1024)
+            return False
+
+
+class DownloadCache:
+    """
+    Cache of the downloaded files, shared by the jobs running on the worker.
+
+    The entries are addressed by the checksum given in the job definition or,
+    without checksum, by the url and the validators returned by the server
+    (ETag, Last-Modified and size). Files that cannot be validated are not
+    cached.
+
+    Each entry is protected by a lock file, so concurrent jobs downloading the
+    same file wait for each other and only one download happens. When the size
+    of the cache exceeds the limit, the least recently used entries are
+    removed.
+
+    The files are reflinked (or copied) into the job directory and never
+    hardlinked: the deploy actions are allowed to modify the downloaded files.
+    """
+
+    # Prefix of the keys in the dispatcher configuration
+    config_prefix = "download_cache"
+    default_size_limit = DOWNLOAD_CACHE_SIZE_LIMIT
+
+    def __init__(self, path, size_limit=None):
+        self.path = path
+        self.size_limit = size_limit or self.default_size_limit
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the cache configured in the dispatcher configuration, if any.
+        """
+        path = config.get(cls.config_prefix + "_path")
+        if not path:
+            return None
+        return cls(path, config.get(cls.config_prefix + "_size_limit"))
+
+    @staticmethod
+    def key(url, validators, checksums, variant=""):
+        """
+        Return the key of the entry or None if the file cannot be cached.
+
+        variant describes how the file is stored (like the decompression
+        command), so the same artefact can be cached in different forms.
+        """
+        for algorithm in ["sha512", "sha256", "md5"]:
+            if checksums.get(algorithm):
+                data = [algorithm, checksums[algorithm].lower(), variant]
+                break
+        else:
+            if not (validators.get("etag") or validators.get("last-modified")):
+                return None
+            data = [url, validators, variant]
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """
+        Lock the entry and return its path (without extension).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, key + ".lock"), "w") as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_EX)
+            yield os.path.join(self.path, key)
+
+    def get(self, entry):
+        """
+        Return the metadata of the (locked) entry or None if the entry is
+        missing or incomplete.
+        """
+        try:
+            with open(entry + ".json", "r") as f_meta:
+                metadata = json.load(f_meta)
+            if os.stat(entry + ".data").st_size != metadata["stored_size"]:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        # The modification time is used to find the least recently used
+        os.utime(entry + ".data")
+        return metadata
+
+    def retrieve(self, entry, filename):
+        """
+        Copy the (locked) entry to filename. Return True if reflinked.
+        """
+        return clone_file(entry + ".data", filename)
+
+    def add(self, entry, filename, metadata):
+        """
+        Store filename in the (locked) entry, along with its metadata.
+        """
+        metadata = dict(metadata, stored_size=os.stat(filename).st_size)
+        try:
+            clone_file(filename, entry + ".tmp")
+            os.rename(entry + ".tmp", entry + ".data")
+            with open(entry + ".json.tmp", "w") as f_meta:
+                json.dump(metadata, f_meta)
+            os.rename(entry + ".json.tmp", entry + ".json")
+        finally:
+            for suffix in [".tmp", ".json.tmp"]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry + suffix)
+
+    def entries(self):
+        """
+        Return the metadata of every entry, the least recently used first.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            entry = os.path.join(self.path, name[: -len(".json")])
+            with contextlib.suppress(OSError, ValueError):
+                with open(entry + ".json", "r") as f_meta:
+                    metadata = json.load(f_meta)
+                stat = os.stat(entry + ".data")
+                metadata.update(
+                    {
+                        "key": os.path.basename(entry),
+                        "last_used": stat.st_mtime,
+                        "stored_size": stat.st_size,
+                    }
+                )
+                entries.append(metadata)
+        return sorted(entries, key=lambda e: e["last_used"])
+
+    def _remove(self, key):
+        """
+        Remove the entry if it's not used by another job.
+        """
+        with open(os.path.join(self.path, key + ".lock"), "w") as f_lock:
+            try:
+                fcntl.flock(f_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            for suffix in [".json", ".data"]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(os.path.join(self.path, key + suffix))
+        return True
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in the
+        size limit. The entries used by other jobs are kept.
+        """
+        entries = self.entries()
+        total = sum(e["stored_size"] for e in entries)
+
+        logger = logging.getLogger("dispatcher")
+        for entry in entries:
+            if total <= self.size_limit:
+                break
+            if self._remove(entry["key"]):
+                logger.debug(
+                    "Removing %s %s (%d bytes)",
+                    self.config_prefix.replace("_", " "),
+                    entry["key"],
+                    entry["stored_size"],
+                )
+                total -= entry["stored_size"]
+
+    def purge(self):
+        """
+        Remove every entry not used by another job. Return the number of
+        entries removed.
+        """
+        return sum(self._remove(entry["key"]) for entry in self.entries())
+
+
+class OverlayCache(DownloadCache):
+    """
+    Cache of the test definitions checked out in the overlays, shared by the
+    jobs running on the worker.
+
+    Only the repositories pinned to a commit are cached: the entries are
+    addressed by the content hash of the repository, the commit and the
+    clone options, so they never have to be validated against the remote.
+    The files generated for each job (uuid, run.sh, install.sh...) are
+    written on top of the checkout afterwards.
+
+    Each entry is a tarball of the checkout, including the git history when
+    requested.
+    """
+
+    config_prefix = "overlay_cache"
+    default_size_limit = OVERLAY_CACHE_SIZE_LIMIT
+
+    @staticmethod
+    def key(repository, commit, options):
+        """
+        Return the key of the checkout of the repository at the given commit.
+        """
+        data = [repository, commit, options]
+        return hashlib.sha256(
+            json.dumps(data, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def extract(self, entry, directory):
+        """
+        Extract the (locked) entry into directory.
+        """
+        try:
+            with tarfile.open(entry + ".data", "r") as tar:
+                tar.extractall(directory)
+        except (OSError, tarfile.TarError) as exc:
+            raise InfrastructureError("Unable to extract %s: %s" % (entry, exc))
+
+    def store(self, entry, directory, metadata):
+        """
+        Store the content of directory in the (locked) entry, along with its
+        metadata. Raise OSError or tarfile.TarError on failure.
+        """
+        try:
+            with tarfile.open(entry + ".tmp", "w") as tar:
+                tar.add(directory, arcname=".")
+            metadata = dict(metadata, stored_size=os.stat(entry + ".tmp").st_size)
+            os.rename(entry + ".tmp", entry + ".data")
+            with open(entry + ".json.tmp", "w") as f_meta:
+                json.dump(metadata, f_meta)
+            os.rename(entry + ".json.tmp", entry + ".json")
+        finally:
+            for suffix in [".tmp", ".json.tmp"]:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(entry + suffix)
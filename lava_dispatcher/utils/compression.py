@@ -24,9 +24,21 @@
 # android images: tar + xz,bz2,gz, or just gz,xz,bzip2
 # vexpress recovery images: any compression though usually zip
 
+import bz2
+import collections
+import concurrent.futures
+import contextlib
+import gzip
+import logging
+import lzma
 import os
+import shutil
+import stat
+import struct
 import subprocess  # nosec - internal use.
 import tarfile
+import time
+import zlib
 
 from lava_common.exceptions import InfrastructureError, JobError
 
@@ -34,8 +46,28 @@ from lava_dispatcher.utils.contextmanager import chdir
 from lava_dispatcher.utils.shell import which
 
 
+# Multithreaded commands, used when installed
 # https://www.kernel.org/doc/Documentation/xz.txt
-compress_command_map = {"xz": ["xz", "--check=crc32"], "gz": ["gzip"], "bz2": ["bzip2"]}
+compress_command_map = {
+    "xz": ["xz", "--check=crc32", "--threads={threads}"],
+    "gz": ["pigz", "--processes", "{threads}"],
+    "bz2": ["pbzip2", "-p{threads}"],
+    "zstd": ["zstd", "--quiet", "--rm", "-T{threads}"],
+}
+# Size of the blocks compressed in parallel by python
+parallel_compress_block_size = {
+    "xz": 8 * 1024 * 1024,
+    "gz": 1024 * 1024,
+    "bz2": 900 * 1024,
+}
+decompress_open_map = {"xz": lzma.open, "gz": gzip.open, "bz2": bz2.open}
+# Multithreaded commands decompressing to stdout, used when installed
+decompress_stream_command_map = {
+    "xz": ["xz", "--decompress", "--stdout", "--threads={threads}"],
+    "gz": ["pigz", "--decompress", "--stdout", "--processes", "{threads}"],
+    "bz2": ["pbzip2", "--decompress", "--stdout", "-p{threads}"],
+    "zstd": ["zstd", "--decompress", "--stdout", "--quiet", "-T{threads}"],
+}
 decompress_command_map = {
     "xz": ["unxz"],
     "gz": ["gunzip"],
@@ -44,24 +76,103 @@ decompress_command_map = {
 }
 
 
-def compress_file(infile, compression):
+def _deflate(data, zdict, last):
+    # Raw deflate, primed with the end of the previous block like pigz
+    if zdict:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+def _compress_block(compression, data, previous, last):
+    if compression == "gz":
+        return _deflate(data, previous[-32 * 1024 :], last)
+    if compression == "bz2":
+        return bz2.compress(data)
+    return lzma.compress(data, check=lzma.CHECK_CRC32)
+
+
+def parallel_compress(infile, outfile, compression, threads):
+    """
+    Compress infile by blocks, in threads.
+
+    gz files are a single gzip member, like the ones created by pigz. xz and
+    bz2 files are a concatenation of streams, like the ones created by
+    pbzip2.
+    """
+    block_size = parallel_compress_block_size[compression]
+    (crc, size) = (0, 0)
+    pending = collections.deque()
+    with open(infile, "rb") as f_in, open(outfile, "wb") as f_out:
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            if compression == "gz":
+                # magic, deflate, no flags, no mtime, no extra flags, unix
+                f_out.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03")
+            (previous, data) = (b"", f_in.read(block_size))
+            while True:
+                following = f_in.read(block_size)
+                last = not following
+                if compression == "gz":
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                pending.append(
+                    executor.submit(_compress_block, compression, data, previous, last)
+                )
+                # Limit the memory usage
+                while pending and (last or len(pending) > 2 * threads):
+                    f_out.write(pending.popleft().result())
+                if last:
+                    break
+                (previous, data) = (data, following)
+            if compression == "gz":
+                f_out.write(struct.pack("<II", crc, size & 0xFFFFFFFF))
+
+
+def compress_file(infile, compression, threads=None):
+    """
+    Compress infile into infile.<compression> and remove infile.
+
+    The multithreaded commands (xz, pigz, pbzip2 or zstd) are used when
+    installed. Otherwise, gz, bz2 and xz files are compressed by blocks in
+    python threads. threads defaults to the number of cpus.
+    """
     if not compression:
         return infile
-    if compression not in compress_command_map.keys():
+    if compression not in compress_command_map:
         raise JobError("Cannot find shell command to compress: %s" % compression)
 
-    # Check that the command does exists
-    which(compress_command_map[compression][0])
-
-    with chdir(os.path.dirname(infile)):
-        # local copy for idempotency
-        cmd = compress_command_map[compression][:]
-        cmd.append(infile)
+    threads = threads or os.cpu_count() or 1
+    outfile = "%s.%s" % (infile, compression)
+    cmd = [arg.format(threads=threads) for arg in compress_command_map[compression]]
+    start = time.monotonic()
+    if shutil.which(cmd[0]) is None and compression in parallel_compress_block_size:
+        method = "python"
         try:
-            subprocess.check_output(cmd)  # nosec - internal use.
-            return "%s.%s" % (infile, compression)
+            parallel_compress(infile, outfile, compression, threads)
+            os.unlink(infile)
+        except (OSError, lzma.LZMAError, zlib.error) as exc:
+            raise InfrastructureError("unable to compress file %s: %s" % (infile, exc))
+    else:
+        # Check that the command does exists
+        which(cmd[0])
+        method = cmd[0]
+        # zstd does not use the same suffix
+        cmd.extend([infile, "-o", outfile] if compression == "zstd" else [infile])
+        try:
+            subprocess.check_output(cmd, stderr=subprocess.STDOUT)  # nosec
         except (OSError, subprocess.CalledProcessError) as exc:
             raise InfrastructureError("unable to compress file %s: %s" % (infile, exc))
+    logging.getLogger("dispatcher").debug(
+        "Compressed %s with %s (%d threads) in %.3fs",
+        os.path.basename(outfile),
+        method,
+        threads,
+        time.monotonic() - start,
+    )
+    return outfile
 
 
 def decompress_file(infile, compression):
@@ -135,3 +246,168 @@ def uncpio(filename, directory):
             raise InfrastructureError(
                 "Unable to extract cpio archive %r: %s" % (filename, exc)
             )
+
+
+NEWC_MAGIC = b"070701"
+NEWC_TRAILER = "TRAILER!!!"
+
+
+def _newc_pad(size):
+    return b"\0" * (-size % 4)
+
+
+def _newc_header(name, ino=0, st=None, size=0):
+    name = name.encode("utf-8") + b"\0"
+    fields = [ino, 0, 0, 0, 1, 0, size, 0, 0, 0, 0, len(name), 0]
+    if st is not None:
+        fields[1:6] = [st.st_mode, st.st_uid, st.st_gid, 1, int(st.st_mtime)]
+        fields[9:11] = [os.major(st.st_rdev), os.minor(st.st_rdev)]
+    header = NEWC_MAGIC + b"".join(b"%08X" % f for f in fields) + name
+    return header + _newc_pad(len(header))
+
+
+def cpio_newc(directory, filename, skip=()):
+    """
+    Create a newc cpio archive with the content of directory, without
+    shelling out to find and cpio.
+
+    The directory itself is not archived, so extracting the archive over an
+    existing tree does not change the permissions of its root. The
+    directories listed in skip (relative paths) are not archived either but
+    their content is.
+    """
+    ino = 0
+    with open(filename, "wb") as f_out:
+        for (root, dirs, files) in os.walk(directory):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, directory)
+                st = os.lstat(path)
+                if stat.S_ISDIR(st.st_mode) and relpath in skip:
+                    continue
+                ino += 1
+                if stat.S_ISREG(st.st_mode):
+                    f_out.write(_newc_header(relpath, ino, st, st.st_size))
+                    with open(path, "rb") as f_in:
+                        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                    f_out.write(_newc_pad(st.st_size))
+                elif stat.S_ISLNK(st.st_mode):
+                    target = os.readlink(path).encode("utf-8")
+                    f_out.write(_newc_header(relpath, ino, st, len(target)))
+                    f_out.write(target + _newc_pad(len(target)))
+                else:
+                    f_out.write(_newc_header(relpath, ino, st, 0))
+        f_out.write(_newc_header(NEWC_TRAILER))
+
+
+@contextlib.contextmanager
+def _decompress_stream(filename, compression, threads):
+    """
+    Open the (compressed) file for reading. The multithreaded commands are
+    used when installed, otherwise the file is decompressed by python.
+    """
+    if not compression:
+        with open(filename, "rb") as f_in:
+            yield f_in
+        return
+
+    cmd = decompress_stream_command_map.get(compression)
+    if cmd is None or shutil.which(cmd[0]) is None:
+        if compression not in decompress_open_map:
+            raise JobError("Cannot decompress %s with python" % compression)
+        with decompress_open_map[compression](filename, "rb") as f_in:
+            yield f_in
+        return
+
+    cmd = [arg.format(threads=threads) for arg in cmd] + [filename]
+    proc = subprocess.Popen(  # nosec - internal use.
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        yield proc.stdout
+    finally:
+        # The archive is usually not read until the end
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+
+
+def _skip(f_in, size):
+    if f_in.seekable():
+        f_in.seek(size, os.SEEK_CUR)
+        return
+    while size:
+        data = f_in.read(min(size, 1024 * 1024))
+        if not data:
+            raise EOFError("unexpected end of data")
+        size -= len(data)
+
+
+def cpio_symlinks(filename, compression, wanted=None, threads=None):
+    """
+    Return the paths of the symlinks stored in the (compressed) newc cpio
+    archive. Only the first archive of a concatenation is read.
+
+    When wanted is given (normalized relative paths), only these paths are
+    returned and the archive is only read until they have all been found.
+    """
+    threads = threads or os.cpu_count() or 1
+    symlinks = set()
+    missing = None if wanted is None else set(wanted)
+    try:
+        with _decompress_stream(filename, compression, threads) as f_in:
+            while missing is None or missing:
+                header = f_in.read(110)
+                if len(header) < 110:
+                    raise EOFError("unexpected end of data")
+                if header[:6] != NEWC_MAGIC:
+                    break
+                mode = int(header[14:22], 16)
+                size = int(header[54:62], 16)
+                namesize = int(header[94:102], 16)
+                name = f_in.read(namesize + (-(110 + namesize) % 4))
+                name = name[: namesize - 1].decode("utf-8", errors="replace")
+                if name == NEWC_TRAILER:
+                    break
+                name = os.path.normpath(name)
+                if missing is None or name in missing:
+                    if stat.S_ISLNK(mode):
+                        symlinks.add(name)
+                    if missing is not None:
+                        missing.remove(name)
+                _skip(f_in, size + (-size % 4))
+    except (OSError, EOFError, ValueError, lzma.LZMAError) as exc:
+        raise InfrastructureError(
+            "Unable to read cpio archive %r: %s" % (filename, exc)
+        )
+    return symlinks
+
+
+def cpio_append(directory, filename, compression, threads=None):
+    """
+    Append the content of directory to the (compressed) cpio archive, as a
+    separate archive compressed with the same method. The kernel extracts the
+    concatenated archives in order, so the original archive does not have to
+    be extracted and recompressed.
+
+    Directories that are symlinks in the original archive are not archived:
+    the kernel would replace the symlinks. The original archive is only read
+    to find the directories of the overlay.
+    """
+    directories = set()
+    for (root, dirs, _) in os.walk(directory):
+        directories.update(
+            os.path.normpath(os.path.relpath(os.path.join(root, name), directory))
+            for name in dirs
+        )
+    symlinks = cpio_symlinks(filename, compression, directories, threads)
+    cpio_newc(directory, filename + ".append", skip=symlinks)
+    appended = compress_file(filename + ".append", compression, threads)
+    try:
+        with open(filename, "ab") as f_out, open(appended, "rb") as f_in:
+            # Each archive should start on a 4 bytes boundary
+            f_out.write(_newc_pad(f_out.tell()))
+            shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    finally:
+        os.unlink(appended)
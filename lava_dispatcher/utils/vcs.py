@@ -18,11 +18,15 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import contextlib
+import fcntl
+import hashlib
 import logging
 import os
 import shutil
 import subprocess  # nosec - internal use.
 
+from lava_common.constants import GIT_CACHE_SIZE_LIMIT
 from lava_common.exceptions import InfrastructureError
 
 
@@ -34,6 +38,103 @@ class VCSHelper:
         raise NotImplementedError
 
 
+class GitCache:
+    """
+    Bare mirrors of the git repositories, shared by the jobs running on the
+    worker.
+
+    Each mirror is protected by a lock file, so concurrent jobs cloning the
+    same repository wait for each other. When the size of the cache exceeds
+    the limit, the least recently used mirrors are removed.
+    """
+
+    def __init__(self, path, size_limit=GIT_CACHE_SIZE_LIMIT):
+        self.path = path
+        self.size_limit = size_limit
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the cache configured in the dispatcher configuration, if any.
+        """
+        path = config.get("git_cache_path")
+        if not path:
+            return None
+        return cls(path, config.get("git_cache_size_limit", GIT_CACHE_SIZE_LIMIT))
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    @contextlib.contextmanager
+    def lock(self, url):
+        """
+        Lock the mirror of the given url and return its path.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        key = self._key(url)
+        with open(os.path.join(self.path, key + ".lock"), "w") as f_lock:
+            fcntl.flock(f_lock, fcntl.LOCK_EX)
+            yield os.path.join(self.path, key + ".git")
+
+    def update(self, binary, url, mirror):
+        """
+        Create or update the (locked) mirror. Return True if the mirror
+        already existed.
+        """
+        hit = os.path.isdir(mirror)
+        if hit:
+            subprocess.check_output(  # nosec - internal use.
+                [binary, "-C", mirror, "fetch", "--prune", "--quiet", "origin"],
+                stderr=subprocess.STDOUT,
+            )
+        else:
+            tmp_mirror = mirror + ".tmp"
+            shutil.rmtree(tmp_mirror, ignore_errors=True)
+            subprocess.check_output(  # nosec - internal use.
+                [binary, "clone", "--mirror", "--quiet", url, tmp_mirror],
+                stderr=subprocess.STDOUT,
+            )
+            os.rename(tmp_mirror, mirror)
+        # The modification time is used to find the least recently used
+        os.utime(mirror)
+        return hit
+
+    def _size(self, mirror):
+        size = 0
+        for (root, _, files) in os.walk(mirror):
+            for filename in files:
+                with contextlib.suppress(OSError):
+                    size += os.lstat(os.path.join(root, filename)).st_size
+        return size
+
+    def evict(self):
+        """
+        Remove the least recently used mirrors until the cache fits in the
+        size limit. The mirrors used by other jobs are kept.
+        """
+        mirrors = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".git"):
+                continue
+            mirror = os.path.join(self.path, name)
+            with contextlib.suppress(OSError):
+                mirrors.append((os.stat(mirror).st_mtime, mirror, self._size(mirror)))
+        total = sum(m[2] for m in mirrors)
+
+        logger = logging.getLogger("dispatcher")
+        for (_, mirror, size) in sorted(mirrors):
+            if total <= self.size_limit:
+                break
+            with open(mirror[: -len(".git")] + ".lock", "w") as f_lock:
+                try:
+                    fcntl.flock(f_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                logger.debug("Removing git cache %s (%d bytes)", mirror, size)
+                shutil.rmtree(mirror, ignore_errors=True)
+                total -= size
+
+
 class GitHelper(VCSHelper):
     """
     Helper to clone a git repository.
@@ -43,20 +144,53 @@ class GitHelper(VCSHelper):
       commit_id = git.clone('destination')
       commit_id = git.clone('destination2, 'hash')
 
+    When a GitCache is given, the repository is cloned from a local mirror,
+    updated first. cache_hit is then set to True if the mirror already
+    existed.
+
     This helper will raise a InfrastructureError for any error encountered.
     """
 
-    def __init__(self, url):
+    def __init__(self, url, cache=None):
         super().__init__(url)
         self.binary = "/usr/bin/git"
+        self.cache = cache
+        self.cache_hit = None
 
     def clone(self, dest_path, shallow=False, revision=None, branch=None, history=True):
+        if self.cache is None:
+            return self._clone(self.url, dest_path, shallow, revision, branch, history)
+
+        logger = logging.getLogger("dispatcher")
+        with self.cache.lock(self.url) as mirror:
+            try:
+                self.cache_hit = self.cache.update(self.binary, self.url, mirror)
+            except (subprocess.CalledProcessError, OSError) as exc:
+                logger.warning("Unable to update the git cache of '%s'", self.url)
+                if isinstance(exc, subprocess.CalledProcessError) and exc.stdout:
+                    logger.warning(exc.stdout.decode("utf-8", errors="replace"))
+                return self._clone(
+                    self.url, dest_path, shallow, revision, branch, history
+                )
+
+            logger.info(
+                "Git cache %s for '%s'", "hit" if self.cache_hit else "miss", self.url
+            )
+            # --depth is ignored by local clones, unless using file://
+            source = "file://" + mirror if shallow else mirror
+            commit_id = self._clone(
+                source, dest_path, shallow, revision, branch, history
+            )
+        self.cache.evict()
+        return commit_id
+
+    def _clone(self, source, dest_path, shallow, revision, branch, history):
         logger = logging.getLogger("dispatcher")
         try:
             if branch is not None:
-                cmd_args = [self.binary, "clone", "-b", branch, self.url, dest_path]
+                cmd_args = [self.binary, "clone", "-b", branch, source, dest_path]
             else:
-                cmd_args = [self.binary, "clone", self.url, dest_path]
+                cmd_args = [self.binary, "clone", source, dest_path]
 
             if shallow:
                 cmd_args.append("--depth=1")
@@ -66,6 +200,21 @@ class GitHelper(VCSHelper):
                 cmd_args, stderr=subprocess.STDOUT
             )
 
+            if source != self.url:
+                # Point to the original repository, not to the mirror
+                subprocess.check_output(  # nosec - internal use.
+                    [
+                        self.binary,
+                        "-C",
+                        dest_path,
+                        "remote",
+                        "set-url",
+                        "origin",
+                        self.url,
+                    ],
+                    stderr=subprocess.STDOUT,
+                )
+
             if revision is not None:
                 logger.debug("Running '%s checkout %s", self.binary, str(revision))
                 subprocess.check_output(  # nosec - internal use.
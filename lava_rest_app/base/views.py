@@ -17,10 +17,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
-import io
-import junit_xml
-import tap
-
 from lava_scheduler_app.models import (
     Device,
     DeviceType,
@@ -30,11 +26,12 @@ from lava_scheduler_app.models import (
 )
 from lava_scheduler_app.dbutils import testjob_submission
 from lava_scheduler_app.schema import SubmissionException
+from lava_results_app.export import export_junit, export_tap13
 from lava_results_app.models import TestCase
 from lava_scheduler_app.logutils import logs_instance
 from linaro_django_xmlrpc.models import AuthToken
 
-from django.http.response import FileResponse, HttpResponse
+from django.http.response import FileResponse, HttpResponse, StreamingHttpResponse
 
 from rest_framework import status, viewsets
 from rest_framework.permissions import BasePermission
@@ -151,43 +148,9 @@ class TestJobViewSet(viewsets.ModelViewSet):
 
     @detail_route(methods=["get"], suffix="junit")
     def junit(self, request, **kwargs):
-        suites = []
-        for suite in self.get_object().testsuite_set.all().order_by("id"):
-            cases = []
-            for case in suite.testcase_set.all().order_by("id"):
-                # Grab the duration
-                md = case.action_metadata
-                duration = None
-                if md is not None:
-                    duration = md.get("duration")
-                    if duration is not None:
-                        duration = float(duration)
-
-                # Build the test case junit object
-                tc = junit_xml.TestCase(
-                    case.name,
-                    elapsed_sec=duration,
-                    classname=case.suite.name,
-                    timestamp=case.logged,
-                )
-                if case.result == TestCase.RESULT_FAIL:
-                    logs = None
-                    # TODO: is this of any use? (yaml inside xml!)
-                    if (
-                        case.start_log_line is not None
-                        and case.end_log_line is not None
-                    ):
-                        logs = logs_instance.read(
-                            self.get_object(), case.start_log_line, case.end_log_line
-                        )
-                    tc.add_error_info("failed", output=logs)
-                elif case.result == TestCase.RESULT_SKIP:
-                    tc.add_skipped_info("skipped")
-                cases.append(tc)
-            suites.append(junit_xml.TestSuite(suite.name, test_cases=cases))
-
-        data = junit_xml.TestSuite.to_xml_string(suites, encoding="utf-8")
-        response = HttpResponse(data, content_type="application/xml")
+        response = StreamingHttpResponse(
+            export_junit(self.get_object()), content_type="application/xml"
+        )
         response["Content-Disposition"] = (
             "attachment; filename=job_%d.xml" % self.get_object().id
         )
@@ -225,37 +188,9 @@ class TestJobViewSet(viewsets.ModelViewSet):
 
     @detail_route(methods=["get"], suffix="tap13")
     def tap13(self, request, **kwargs):
-        stream = io.StringIO()
-        count = TestCase.objects.filter(suite__job=self.get_object()).count()
-        tracker = tap.tracker.Tracker(plan=count, streaming=True, stream=stream)
-
-        # Loop on all test cases
-        for suite in self.get_object().testsuite_set.all().order_by("id"):
-            for case in suite.testcase_set.all().order_by("id"):
-                if case.result == TestCase.RESULT_FAIL:
-                    if (
-                        case.start_log_line is not None
-                        and case.end_log_line is not None
-                    ):
-                        logs = logs_instance.read(
-                            self.get_object(), case.start_log_line, case.end_log_line
-                        )
-                        logs = "\n ".join(logs.split("\n"))
-                        tracker.add_not_ok(
-                            suite.name, case.name, diagnostics=" ---\n " + logs + "..."
-                        )
-                    else:
-                        tracker.add_not_ok(suite.name, case.name)
-                elif case.result == TestCase.RESULT_SKIP:
-                    tracker.add_skip(suite.name, case.name, "test skipped")
-                elif case.result == TestCase.RESULT_UNKNOWN:
-                    tracker.add_not_ok(suite.name, case.name, "TODO unknow result")
-                else:
-                    tracker.add_ok(suite.name, case.name)
-
-        # Send back the stream
-        stream.seek(0)
-        response = HttpResponse(stream, content_type="application/yaml")
+        response = StreamingHttpResponse(
+            export_tap13(self.get_object()), content_type="application/yaml"
+        )
         response["Content-Disposition"] = (
             "attachment; filename=job_%d.yaml" % self.get_object().id
         )
@@ -437,7 +437,8 @@ class TestCaseFilter(filters.FilterSet):
 
     class Meta:
         model = TestCase
-        exclude = {}
+        # django-filter has no filter for the JSON fields
+        exclude = ["metadata"]
 
 
 class GroupDeviceTypePermissionFilter(filters.FilterSet):
@@ -17,8 +17,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
-import io
 import os
 import pathlib
 import voluptuous
@@ -26,20 +24,18 @@ import yaml
 import lava_common.schemas as schemas
 
 from django.conf import settings
-from django.http.response import HttpResponse
+from django.http.response import HttpResponse, StreamingHttpResponse
 from django.http import Http404
 
 from lava_common.version import __version__
-from lava_common.compat import yaml_dump, yaml_safe_load
+from lava_common.compat import yaml_safe_load
 from lava_results_app.models import TestSuite, TestCase
-from lava_results_app.utils import (
-    export_testcase,
-    get_testcases_with_limit,
-    testcase_export_fields,
-)
+from lava_results_app.export import export_csv, export_yaml, job_testcases
+from lava_results_app.utils import get_testcases_with_limit
 from lava_rest_app.base import views as base_views
 from lava_rest_app import filters
 from lava_scheduler_app.dbutils import testjob_submission
+from lava_scheduler_app.logutils import compute_timing, read_timing
 from lava_scheduler_app.schema import SubmissionException
 from lava_server.files import File
 
@@ -51,7 +47,12 @@ from rest_framework.permissions import (
 )
 from rest_framework_extensions.mixins import NestedViewSetMixin
 from rest_framework.response import Response
-from rest_framework.exceptions import ParseError, PermissionDenied, ValidationError
+from rest_framework.exceptions import (
+    NotFound,
+    ParseError,
+    PermissionDenied,
+    ValidationError,
+)
 from rest_framework.utils import formatting
 from lava_scheduler_app.models import (
     Alias,
@@ -61,6 +62,7 @@ from lava_scheduler_app.models import (
     GroupDeviceTypePermission,
     GroupDevicePermission,
     Tag,
+    TestJob,
 )
 
 from . import serializers
@@ -90,6 +92,10 @@ class TestJobViewSet(base_views.TestJobViewSet):
 
     * `/jobs/<job_id>/logs/`
 
+    The duration and timeout of each action are available at:
+
+    * `/jobs/<job_id>/timing/`
+
     Test suites present in the job are available at:
 
     * `/jobs/<job_id>/suites/`
@@ -114,22 +120,10 @@ class TestJobViewSet(base_views.TestJobViewSet):
 
     @detail_route(methods=["get"], suffix="csv")
     def csv(self, request, **kwargs):
-        limit = request.query_params.get("limit", None)
-        offset = request.query_params.get("offset", None)
-
-        output = io.StringIO()
-        writer = csv.DictWriter(
-            output,
-            quoting=csv.QUOTE_ALL,
-            extrasaction="ignore",
-            fieldnames=testcase_export_fields(),
+        response = StreamingHttpResponse(
+            export_csv(job_testcases(self.get_object())),
+            content_type="application/csv",
         )
-        writer.writeheader()
-        for test_suite in self.get_object().testsuite_set.all():
-            for row in test_suite.testcase_set.all():
-                writer.writerow(export_testcase(row))
-
-        response = HttpResponse(output.getvalue(), content_type="application/csv")
         response["Content-Disposition"] = (
             "attachment; filename=job_%d.csv" % self.get_object().id
         )
@@ -137,15 +131,10 @@ class TestJobViewSet(base_views.TestJobViewSet):
 
     @detail_route(methods=["get"], suffix="yaml")
     def yaml(self, request, **kwargs):
-        limit = request.query_params.get("limit", None)
-        offset = request.query_params.get("offset", None)
-
-        yaml_list = []
-        for test_suite in self.get_object().testsuite_set.all():
-            for test_case in test_suite.testcase_set.all():
-                yaml_list.append(export_testcase(test_case))
-
-        response = HttpResponse(yaml_dump(yaml_list), content_type="application/yaml")
+        response = StreamingHttpResponse(
+            export_yaml(job_testcases(self.get_object())),
+            content_type="application/yaml",
+        )
         response["Content-Disposition"] = (
             "attachment; filename=job_%d.yaml" % self.get_object().id
         )
@@ -155,6 +144,24 @@ class TestJobViewSet(base_views.TestJobViewSet):
     def metadata(self, request, **kwargs):
         return Response({"metadata": self.get_object().get_metadata_dict()})
 
+    @detail_route(methods=["get"], suffix="timing")
+    def timing(self, request, **kwargs):
+        job = self.get_object()
+        try:
+            timings = compute_timing(
+                read_timing(job, save=job.state == TestJob.STATE_FINISHED)
+            )
+        except OSError:
+            raise NotFound()
+        keys = ["level", "name", "duration", "timeout", "near_timeout", "line"]
+        return Response(
+            {
+                "pipeline": [dict(zip(keys, action)) for action in timings["pipeline"]],
+                "total_duration": timings["total_duration"],
+                "max_duration": timings["max_duration"],
+            }
+        )
+
     @action(methods=["post"], detail=False, suffix="validate")
     def validate(self, request, **kwargs):
         definition = request.data.get("definition", None)
@@ -234,18 +241,10 @@ class TestSuiteViewSet(NestedViewSetMixin, viewsets.ReadOnlyModelViewSet):
         limit = request.query_params.get("limit", None)
         offset = request.query_params.get("offset", None)
 
-        output = io.StringIO()
-        writer = csv.DictWriter(
-            output,
-            quoting=csv.QUOTE_ALL,
-            extrasaction="ignore",
-            fieldnames=testcase_export_fields(),
+        response = StreamingHttpResponse(
+            export_csv(get_testcases_with_limit(self.get_object(), limit, offset)),
+            content_type="application/csv",
         )
-        writer.writeheader()
-        for row in get_testcases_with_limit(self.get_object(), limit, offset):
-            writer.writerow(export_testcase(row))
-
-        response = HttpResponse(output.getvalue(), content_type="application/csv")
         response["Content-Disposition"] = (
             "attachment; filename=suite_%s.csv" % self.get_object().name
         )
@@ -256,11 +255,10 @@ class TestSuiteViewSet(NestedViewSetMixin, viewsets.ReadOnlyModelViewSet):
         limit = request.query_params.get("limit", None)
         offset = request.query_params.get("offset", None)
 
-        yaml_list = []
-        for test_case in get_testcases_with_limit(self.get_object(), limit, offset):
-            yaml_list.append(export_testcase(test_case))
-
-        response = HttpResponse(yaml_dump(yaml_list), content_type="application/yaml")
+        response = StreamingHttpResponse(
+            export_yaml(get_testcases_with_limit(self.get_object(), limit, offset)),
+            content_type="application/yaml",
+        )
         response["Content-Disposition"] = (
             "attachment; filename=suite_%s.yaml" % self.get_object().name
         )
@@ -738,6 +736,47 @@ class SystemViewSet(viewsets.ViewSet):
         }
         return Response(data=ret_dict)
 
+    @action(detail=False, methods=["get"], suffix="logs_stats")
+    def logs_stats(self, request, **kwargs):
+        """
+        Name
+        ----
+        `logs_stats` ()
+
+        Description
+        -----------
+        Return the statistics of the lava-logs shards.
+
+        Arguments
+        ---------
+        None
+
+        Return value
+        ------------
+        Returns a dictionary containing the following keys:
+        {
+          "time": 1586217600.0,
+          "shards": [
+            {"shard": 0, "pid": 1234, "forwarded": 100, "handled": 90,
+             "lag": 10, "jobs": 2},
+          ]
+        }
+
+        The list of shards is empty when lava-logs is not sharded.
+        """
+        data = {"time": None, "shards": []}
+        filename = os.path.join(settings.MEDIA_ROOT, "lava-logs-stats.yaml")
+        if os.path.exists(filename):
+            try:
+                with open(filename, "r") as output:
+                    data = yaml_safe_load(output)
+            except yaml.YAMLError:
+                return Response(
+                    data={"ERROR": "invalid logs statistics"},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                )
+        return Response(data=data)
+
     @action(detail=False, methods=["get"], suffix="version")
     def version(self, request, **kwargs):
         return Response(data={"version": __version__})
@@ -23,10 +23,12 @@ import xmlrpc.client
 
 from linaro_django_xmlrpc.models import ExposedAPI
 
+from django.conf import settings
 from django.db.models.fields import FieldDoesNotExist
 
 from lava_common.compat import yaml_dump
 from lava_results_app.dbutils import export_testsuite, testsuite_export_fields
+from lava_results_app.export import export_csv, export_yaml, job_testcases
 from lava_results_app.models import (
     Query,
     QueryCondition,
@@ -245,6 +247,8 @@ class ResultsAPI(ExposedAPI):
         Description
         -----------
         Refreshes all queries in the system. Available only for superusers.
+        The queries whose results did not change since the last refresh are
+        skipped. Several queries are refreshed in parallel.
 
         Arguments
         ---------
@@ -263,21 +267,30 @@ class ResultsAPI(ExposedAPI):
                 "refresh all queries." % self.user.username,
             )
 
-        for query in Query.objects.all().filter(is_live=False):
-            try:
-                query.refresh_view()
-            except QueryUpdatedError:
+        # Refresh every query before reporting the first error
+        errors = [
+            (query, exc)
+            for (query, _, exc) in Query.refresh_views(
+                Query.objects.filter(is_live=False).select_related(
+                    "owner", "content_type"
+                ),
+                workers=settings.QUERY_REFRESH_WORKERS,
+            )
+            if exc is not None
+        ]
+        if errors:
+            query, exc = errors[0]
+            if isinstance(exc, QueryUpdatedError):
                 raise xmlrpc.client.Fault(
                     400,
                     "Query with name %s owned by user %s was recently refreshed."
                     % (query.name, self.user.username),
                 )
-            except Exception as exc:
-                raise xmlrpc.client.Fault(
-                    401,
-                    "Refresh operation for query with name %s owned by user %s failed. Please contact system administrator. Error: %s"
-                    % (query.name, query.owner.username, str(exc)),
-                )
+            raise xmlrpc.client.Fault(
+                401,
+                "Refresh operation for query with name %s owned by user %s failed. Please contact system administrator. Error: %s"
+                % (query.name, query.owner.username, str(exc)),
+            )
 
     def get_testjob_results_yaml(self, job_id):
         """
@@ -309,15 +322,12 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            yaml_list = []
-            for test_suite in job.testsuite_set.all():
-                for test_case in test_suite.testcase_set.all():
-                    yaml_list.append(export_testcase(test_case))
+            output = "".join(export_yaml(job_testcases(job)))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
 
-        return yaml_dump(yaml_list)
+        return output
 
     def get_testjob_metadata(self, job_id):
         """
@@ -397,22 +407,12 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            output = io.StringIO()
-            writer = csv.DictWriter(
-                output,
-                quoting=csv.QUOTE_ALL,
-                extrasaction="ignore",
-                fieldnames=testcase_export_fields(),
-            )
-            writer.writeheader()
-            for test_suite in job.testsuite_set.all():
-                for row in test_suite.testcase_set.all():
-                    writer.writerow(export_testcase(row))
+            output = "".join(export_csv(job_testcases(job)))
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
 
-        return output.getvalue()
+        return output
 
     def get_testjob_suites_list_csv(self, job_id):
         """
@@ -537,17 +537,17 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            yaml_list = []
             test_suite = job.testsuite_set.get(name=suite_name)
-            for test_case in get_testcases_with_limit(test_suite, limit, offset):
-                yaml_list.append(export_testcase(test_case))
+            output = "".join(
+                export_yaml(get_testcases_with_limit(test_suite, limit, offset))
+            )
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
         except TestSuite.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified test suite not found.")
 
-        return yaml_dump(yaml_list)
+        return output
 
     def get_testsuite_results_csv(self, job_id, suite_name, limit=None, offset=None):
         """
@@ -585,24 +585,17 @@ class ResultsAPI(ExposedAPI):
                 raise xmlrpc.client.Fault(
                     401, "Permission denied for user to job %s" % job_id
                 )
-            output = io.StringIO()
-            writer = csv.DictWriter(
-                output,
-                quoting=csv.QUOTE_ALL,
-                extrasaction="ignore",
-                fieldnames=testcase_export_fields(),
-            )
-            writer.writeheader()
             test_suite = job.testsuite_set.get(name=suite_name)
-            for row in get_testcases_with_limit(test_suite, limit, offset):
-                writer.writerow(export_testcase(row))
+            output = "".join(
+                export_csv(get_testcases_with_limit(test_suite, limit, offset))
+            )
 
         except TestJob.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified job not found.")
         except TestSuite.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Specified test suite not found.")
 
-        return output.getvalue()
+        return output
 
     def get_testsuite_results_count(self, job_id, suite_name):
         """
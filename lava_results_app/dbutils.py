@@ -19,6 +19,7 @@
 
 
 import hashlib
+import json
 import os
 import yaml
 import logging
@@ -27,6 +28,8 @@ from urllib.parse import quote
 
 from collections import OrderedDict  # pylint: disable=unused-import
 
+from django.core.serializers.json import DjangoJSONEncoder
+
 from lava_common.compat import yaml_load, yaml_safe_load
 from lava_common.version import __version__
 from lava_results_app.models import (
@@ -132,12 +135,21 @@ def map_scanned_results(results, job, markers, meta_filename):
     if "extra" in results:
         results["extra"] = meta_filename
 
-    metadata = yaml.dump(results)
-    if len(metadata) > 4096:  # bug 2471 - test_length unit test
-        msg = "[%d] Result metadata is too long. %s" % (job.id, metadata)
+    metadata = dict(results)
+    try:
+        serialized = json.dumps(metadata, cls=DjangoJSONEncoder)
+    except (TypeError, ValueError) as exc:
+        msg = "[%d] Unable to store the result metadata: %s" % (job.id, exc)
+        logger.warning(msg)
+        append_failure_comment(job, msg)
+        metadata = None
+        serialized = ""
+    # bug 2471 - test_length unit test
+    if len(serialized) > TestCase.METADATA_MAX_LENGTH:
+        msg = "[%d] Result metadata is too long. %s" % (job.id, serialized)
         logger.warning(msg)
         append_failure_comment(job, msg)
-        metadata = ""
+        metadata = None
 
     suite, _ = TestSuite.objects.get_or_create(name=results["definition"], job=job)
     testset = _check_for_testset(results, suite)
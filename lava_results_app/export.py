@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Export of the test cases in CSV, YAML, JUnit and TAP13, shared by the web
+views, the XML-RPC and the REST API.
+
+The exports are generators of strings: the test cases are read with a
+server-side cursor and written one after the other, so the memory usage does
+not depend on the number of test cases.
+"""
+
+import csv
+import io
+import re
+from collections import OrderedDict
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+import junit_xml
+from tap.directive import Directive
+from tap.line import Result
+from tap.tracker import Tracker
+
+from django.contrib.postgres.fields.jsonb import KeyTextTransform
+
+from lava_common.compat import yaml_dump
+from lava_results_app.models import TestCase
+from lava_results_app.utils import StreamEcho, export_testcase, testcase_export_fields
+from lava_scheduler_app.logutils import logs_instance
+
+# Characters not allowed in XML 1.0 documents
+ILLEGAL_XML_CHARS = re.compile(
+    "[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x84\x86-\x9f\ud800-\udfff\ufdd0-\ufddf\ufffe\uffff]"
+)
+
+
+def iter_testcases(test_cases):
+    """
+    Iterate over the test cases (a queryset) using a server-side cursor.
+    """
+    return test_cases.select_related("suite").iterator()
+
+
+def job_testcases(job):
+    """
+    Return the test cases of the job, ordered by suite.
+    """
+    return TestCase.objects.filter(suite__job=job).order_by("suite_id", "id")
+
+
+def export_csv(test_cases):
+    fieldnames = testcase_export_fields()
+    writer = csv.DictWriter(
+        StreamEcho(),
+        quoting=csv.QUOTE_ALL,
+        extrasaction="ignore",
+        fieldnames=fieldnames,
+    )
+    # writer.writeheader does not return the string while writer.writerow
+    # does.
+    yield writer.writerow(dict(zip(fieldnames, fieldnames)))
+    for test_case in iter_testcases(test_cases):
+        yield writer.writerow(export_testcase(test_case))
+
+
+def export_yaml(test_cases):
+    # A concatenation of lists is a valid YAML list
+    empty = True
+    for test_case in iter_testcases(test_cases):
+        empty = False
+        yield yaml_dump([export_testcase(test_case)])
+    if empty:
+        yield yaml_dump([])
+
+
+def _junit_tag(name, attributes):
+    return "<%s %s>" % (
+        name,
+        " ".join("%s=%s" % (k, quoteattr(str(v))) for (k, v) in attributes.items()),
+    )
+
+
+def _junit_testcase(job, test_case):
+    # Grab the duration
+    md = test_case.action_metadata
+    duration = None
+    if md is not None:
+        duration = md.get("duration")
+        if duration is not None:
+            duration = float(duration)
+
+    # Build the test case junit object
+    tc = junit_xml.TestCase(
+        test_case.name,
+        elapsed_sec=duration,
+        classname=test_case.suite.name,
+        timestamp=test_case.logged,
+    )
+    if test_case.result == TestCase.RESULT_FAIL:
+        logs = None
+        # TODO: is this of any use? (yaml inside xml!)
+        if test_case.start_log_line is not None and test_case.end_log_line is not None:
+            logs = logs_instance.read(
+                job, test_case.start_log_line, test_case.end_log_line
+            )
+        tc.add_error_info("failed", output=logs)
+    elif test_case.result == TestCase.RESULT_SKIP:
+        tc.add_skipped_info("skipped")
+
+    # Let junit_xml render the test case element
+    element = junit_xml.TestSuite(test_case.suite.name, [tc]).build_xml_doc()[0]
+    return ILLEGAL_XML_CHARS.sub("", ElementTree.tostring(element, encoding="unicode"))
+
+
+def export_junit(job):
+    suites = OrderedDict(
+        (
+            suite.id,
+            OrderedDict(
+                [
+                    ("name", suite.name),
+                    ("disabled", 0),
+                    ("errors", 0),
+                    ("failures", 0),
+                    ("skipped", 0),
+                    ("time", 0),
+                    ("tests", 0),
+                ]
+            ),
+        )
+        for suite in job.testsuite_set.all().order_by("id")
+    )
+    test_cases = job_testcases(job).filter(suite_id__in=list(suites))
+
+    # The counters are attributes of the testsuite elements, written before
+    # the test cases: count them first, without loading the test cases.
+    counters = test_cases.annotate(
+        duration=KeyTextTransform("duration", "metadata")
+    ).values_list("suite_id", "result", "duration")
+    for (suite_id, result, duration) in counters.iterator():
+        suite = suites[suite_id]
+        suite["tests"] += 1
+        if result == TestCase.RESULT_FAIL:
+            suite["errors"] += 1
+        elif result == TestCase.RESULT_SKIP:
+            suite["skipped"] += 1
+        if duration is not None and float(duration):
+            suite["time"] += float(duration)
+
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield _junit_tag(
+        "testsuites",
+        OrderedDict(
+            [
+                ("disabled", 0),
+                ("errors", sum(s["errors"] for s in suites.values())),
+                ("failures", 0),
+                ("tests", sum(s["tests"] for s in suites.values())),
+                ("time", float(sum(s["time"] for s in suites.values()))),
+            ]
+        ),
+    ) + "\n"
+
+    suite_ids = iter(suites)
+    current = None
+    for test_case in iter_testcases(test_cases):
+        # Open the suite of the test case, including the empty suites before
+        while current != test_case.suite_id:
+            if current is not None:
+                yield "\t</testsuite>\n"
+            current = next(suite_ids)
+            yield "\t" + _junit_tag("testsuite", suites[current]) + "\n"
+        yield "\t\t" + _junit_testcase(job, test_case) + "\n"
+    if current is not None:
+        yield "\t</testsuite>\n"
+    for current in suite_ids:
+        yield "\t" + _junit_tag("testsuite", suites[current]) + "</testsuite>\n"
+    yield "</testsuites>\n"
+
+
+def export_tap13(job):
+    test_cases = job_testcases(job)
+
+    # The tracker writes the version and the plan but keeps every result in
+    # memory: the results are written directly.
+    stream = io.StringIO()
+    Tracker(plan=test_cases.count(), streaming=True, stream=stream)
+    yield stream.getvalue()
+
+    suite_name = None
+    for (number, case) in enumerate(iter_testcases(test_cases), start=1):
+        if case.suite.name != suite_name:
+            suite_name = case.suite.name
+            yield "# TAP results for %s\n" % suite_name
+
+        ok = True
+        directive = ""
+        diagnostics = None
+        if case.result == TestCase.RESULT_FAIL:
+            ok = False
+            if case.start_log_line is not None and case.end_log_line is not None:
+                logs = logs_instance.read(job, case.start_log_line, case.end_log_line)
+                logs = "\n ".join(logs.split("\n"))
+                diagnostics = " ---\n " + logs + "..."
+        elif case.result == TestCase.RESULT_SKIP:
+            directive = "SKIP test skipped"
+        elif case.result == TestCase.RESULT_UNKNOWN:
+            ok = False
+            directive = "TODO unknow result"
+        result = Result(
+            ok,
+            number=number,
+            description=case.name,
+            directive=Directive(directive),
+            diagnostics=diagnostics,
+        )
+        yield "%s\n" % result
@@ -18,6 +18,7 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from lava_results_app.models import Query, QueryUpdatedError, RefreshLiveQueryError
 
@@ -37,6 +38,18 @@ class Command(BaseCommand):
         parser.add_argument(
             "--all", dest="all", action="store_true", help="Refresh all queries"
         )
+        parser.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Refresh the queries even if the results did not change",
+        )
+        parser.add_argument(
+            "--workers",
+            default=settings.QUERY_REFRESH_WORKERS,
+            type=int,
+            help="Number of queries refreshed in parallel with --all",
+        )
 
     def handle(self, *args, **options):
         if not options["name"] and not options["all"]:
@@ -59,32 +72,51 @@ class Command(BaseCommand):
                     % (query_name, options["username"])
                 )
                 sys.exit(1)
-            self._refresh_query(query)
+            if query.is_archived:
+                self.stderr.write(
+                    "Query with name %s owned by user %s is archived."
+                    % (query.name, query.owner.username)
+                )
+                return
+            queries = [query]
         else:
-            for query in Query.objects.all().filter(is_live=False, is_archived=False):
-                self._refresh_query(query)
+            queries = Query.objects.filter(
+                is_live=False, is_archived=False
+            ).select_related("owner", "content_type")
 
-    def _refresh_query(self, query):
-        if query.is_archived:
-            self.stderr.write(
-                "Query with name %s owned by user %s is archived."
-                % (query.name, query.owner.username)
-            )
-            return
-        try:
-            query.refresh_view()
-        except QueryUpdatedError as e:
+        for query, refreshed, exc in Query.refresh_views(
+            queries, workers=options["workers"], force=options["force"]
+        ):
+            self._report(query, refreshed, exc)
+
+    def _report(self, query, refreshed, exc):
+        if exc is None:
+            if refreshed:
+                self.stdout.write(
+                    "Query with name %s owned by user %s refreshed in %.3fs."
+                    % (
+                        query.name,
+                        query.owner.username,
+                        query.refresh_duration.total_seconds(),
+                    )
+                )
+            else:
+                self.stdout.write(
+                    "Query with name %s owned by user %s is up to date."
+                    % (query.name, query.owner.username)
+                )
+        elif isinstance(exc, QueryUpdatedError):
             self.stderr.write(
                 "Query with name %s owned by user %s was recently refreshed."
                 % (query.name, query.owner.username)
             )
-        except RefreshLiveQueryError as e:
+        elif isinstance(exc, RefreshLiveQueryError):
             self.stderr.write(
                 "Query with name %s owned by user %s cannot be refreshed since it's a live query."
                 % (query.name, query.owner.username)
             )
-        except Exception as e:
+        else:
             self.stderr.write(
                 "Refresh operation for query with name %s owned by user %s failed: %s"
-                % (query.name, query.owner.username, str(e))
+                % (query.name, query.owner.username, str(exc))
             )
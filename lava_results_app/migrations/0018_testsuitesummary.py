@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-20 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lava_results_app", "0017_testdata_onetoone_field"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TestSuiteSummary",
+            fields=[
+                (
+                    "suite",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="lava_results_app.TestSuite",
+                    ),
+                ),
+                ("passes", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("skips", models.PositiveIntegerField(default=0)),
+                ("unknowns", models.PositiveIntegerField(default=0)),
+                ("measurement_count", models.PositiveIntegerField(default=0)),
+                (
+                    "measurement_sum",
+                    models.DecimalField(decimal_places=10, max_digits=30, null=True),
+                ),
+                (
+                    "measurement_min",
+                    models.DecimalField(decimal_places=10, max_digits=30, null=True),
+                ),
+                (
+                    "measurement_max",
+                    models.DecimalField(decimal_places=10, max_digits=30, null=True),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-04-22 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0018_testsuitesummary")]
+
+    operations = [
+        migrations.AddField(
+            model_name="query",
+            name="refresh_duration",
+            field=models.DurationField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="Last refresh duration",
+            ),
+        )
+    ]
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.28 on 2020-05-04 09:12
+
+import json
+
+import django.contrib.postgres.fields.jsonb
+import django.core.serializers.json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, transaction
+import yaml
+
+from lava_common.compat import yaml_dump, yaml_load
+
+BATCH_SIZE = 1000
+
+
+def update_batch(TestCase, db_alias, batch, field):
+    with transaction.atomic(using=db_alias):
+        for (pk, value) in batch:
+            TestCase.objects.using(db_alias).filter(pk=pk).update(**{field: value})
+
+
+def forwards_func(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    TestCase = apps.get_model("lava_results_app", "TestCase")
+    query = (
+        TestCase.objects.using(db_alias)
+        .exclude(metadata__isnull=True)
+        .exclude(metadata="")
+        .order_by("id")
+        .values_list("id", "metadata")
+    )
+    batch = []
+    for (pk, metadata) in query.iterator():
+        try:
+            metadata = yaml_load(metadata)
+            # Only store data that survives the JSON encoding
+            json.dumps(metadata, cls=DjangoJSONEncoder)
+        except (yaml.YAMLError, TypeError, ValueError):
+            continue
+        if not isinstance(metadata, dict):
+            continue
+        batch.append((pk, metadata))
+        if len(batch) == BATCH_SIZE:
+            update_batch(TestCase, db_alias, batch, "metadata_json")
+            batch = []
+    update_batch(TestCase, db_alias, batch, "metadata_json")
+
+
+def backwards_func(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    TestCase = apps.get_model("lava_results_app", "TestCase")
+    query = (
+        TestCase.objects.using(db_alias)
+        .exclude(metadata_json__isnull=True)
+        .order_by("id")
+        .values_list("id", "metadata_json")
+    )
+    batch = []
+    for (pk, metadata) in query.iterator():
+        batch.append((pk, yaml_dump(metadata)[:4096]))
+        if len(batch) == BATCH_SIZE:
+            update_batch(TestCase, db_alias, batch, "metadata")
+            batch = []
+    update_batch(TestCase, db_alias, batch, "metadata")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_results_app", "0019_query_refresh_duration")]
+
+    operations = [
+        migrations.AddField(
+            model_name="testcase",
+            name="metadata_json",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+                null=True,
+            ),
+        ),
+        migrations.RunPython(forwards_func, backwards_func),
+        migrations.RemoveField(model_name="testcase", name="metadata"),
+        migrations.RenameField(
+            model_name="testcase", old_name="metadata_json", new_name="metadata"
+        ),
+        migrations.AlterField(
+            model_name="testcase",
+            name="metadata",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True,
+                encoder=django.core.serializers.json.DjangoJSONEncoder,
+                help_text="Metadata collected by the pipeline action.",
+                null=True,
+                verbose_name="Action meta data",
+            ),
+        ),
+    ]
@@ -28,10 +28,11 @@ TestSet can be enabled within a test definition run step
 TestCase is a single lava-test-case record or Action result.
 """
 
+import concurrent.futures
 from datetime import timedelta
+import decimal
 import logging
 from urllib.parse import quote
-import yaml
 import contextlib
 
 from django.conf import settings
@@ -39,9 +40,25 @@ from django.contrib.admin.models import LogEntry, ADDITION
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.fields import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models, connection, transaction
-from django.db.models import Case, IntegerField, Lookup, Q, Sum, When
+from django.db import models, connection, transaction, IntegrityError
+from django.db.models import (
+    Case,
+    Count,
+    DecimalField,
+    F,
+    IntegerField,
+    Lookup,
+    Max,
+    Min,
+    Q,
+    Sum,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest, Least
 from django.db.models.fields import Field
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
@@ -49,7 +66,7 @@ from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 
-from lava_common.compat import yaml_load
+from lava_common.compat import yaml_safe_dump
 from lava_common.decorators import nottest
 from lava_server.managers import MaterializedView
 from lava_scheduler_app.models import TestJob, Device
@@ -116,6 +133,9 @@ class QueryMaterializedView(MaterializedView):
     CREATE_VIEW = "CREATE MATERIALIZED VIEW %s%s AS %s;"
     DROP_VIEW = "DROP MATERIALIZED VIEW IF EXISTS %s%s;"
     REFRESH_VIEW = "REFRESH MATERIALIZED VIEW %s%s;"
+    REFRESH_VIEW_CONCURRENTLY = "REFRESH MATERIALIZED VIEW CONCURRENTLY %s%s;"
+    # Needed to refresh the view concurrently
+    CREATE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS %s%s_id ON %s%s (id);"
     VIEW_EXISTS = "SELECT EXISTS(SELECT * FROM pg_class WHERE relname='%s%s');"
     QUERY_VIEW_PREFIX = "query_"
 
@@ -135,10 +155,29 @@ class QueryMaterializedView(MaterializedView):
             # view is not created? - new field update_status?
             query_str = cls.CREATE_VIEW % (cls.QUERY_VIEW_PREFIX, query.id, query_str)
             cursor.execute(query_str)
+            cls.create_index(query.id)
 
     @classmethod
-    def refresh(cls, query_id):
-        refresh_sql = cls.REFRESH_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
+    def create_index(cls, query_id):
+        cursor = connection.cursor()
+        cursor.execute(
+            cls.CREATE_INDEX
+            % (cls.QUERY_VIEW_PREFIX, query_id, cls.QUERY_VIEW_PREFIX, query_id)
+        )
+
+    @classmethod
+    def refresh(cls, query_id, concurrently=True):
+        # A concurrent refresh does not lock the view against the readers but
+        # requires a unique index. The views created by older versions do not
+        # have it.
+        if concurrently:
+            cls.create_index(query_id)
+            refresh_sql = cls.REFRESH_VIEW_CONCURRENTLY % (
+                cls.QUERY_VIEW_PREFIX,
+                query_id,
+            )
+        else:
+            refresh_sql = cls.REFRESH_VIEW % (cls.QUERY_VIEW_PREFIX, query_id)
         cursor = connection.cursor()
         cursor.execute(refresh_sql)
 
@@ -222,7 +261,7 @@ class TestSuite(models.Model, Queryable):
                         output_field=IntegerField(),
                     )
                 ),
-                UNKNOW=Sum(
+                UNKNOWN=Sum(
                     Case(
                         When(result=TestCase.RESULT_UNKNOWN, then=1),
                         default=0,
@@ -359,6 +398,10 @@ class TestCase(models.Model, Queryable):
         (RESULT_UNKNOWN, _(u"Unknown outcome")),
     )
 
+    # Size limit of the metadata once serialized, larger data belongs to the
+    # "extra" file
+    METADATA_MAX_LENGTH = 4096
+
     name = models.TextField(
         blank=True, help_text=help_max_length(100), verbose_name=_(u"Name")
     )
@@ -393,12 +436,12 @@ class TestCase(models.Model, Queryable):
         verbose_name=_(u"Measurement"),
     )
 
-    metadata = models.CharField(
+    metadata = JSONField(
         blank=True,
-        max_length=4096,
-        help_text=_(u"Metadata collected by the pipeline action, stored as YAML."),
+        encoder=DjangoJSONEncoder,
+        help_text=_(u"Metadata collected by the pipeline action."),
         null=True,
-        verbose_name=_(u"Action meta data as a YAML string"),
+        verbose_name=_(u"Action meta data"),
     )
 
     suite = models.ForeignKey(TestSuite, on_delete=models.CASCADE)
@@ -424,13 +467,10 @@ class TestCase(models.Model, Queryable):
 
     @property
     def action_metadata(self):
+        # The metadata is decoded by the database driver when loading the row
         if not self.metadata:
             return None
-        try:
-            ret = yaml_load(self.metadata)
-        except yaml.YAMLError:
-            return None
-        return ret
+        return self.metadata
 
     @property
     def action_data(self):
@@ -483,7 +523,7 @@ class TestCase(models.Model, Queryable):
             if self.units:
                 value = "%s%s" % (self.measurement, self.units)
         elif self.metadata:
-            value = self.metadata
+            value = yaml_safe_dump(self.metadata)
         else:
             value = self.RESULT_REVERSE[self.result]
         return value
@@ -512,6 +552,145 @@ class TestCase(models.Model, Queryable):
         return self.RESULT_REVERSE[self.result]
 
 
+@nottest
+class TestSuiteSummary(models.Model):
+    """
+    Number of test cases by result and measurement statistics of a TestSuite.
+    Updated when the test cases are saved, so the charts do not have to
+    aggregate the test cases.
+    """
+
+    suite = models.OneToOneField(
+        TestSuite, on_delete=models.CASCADE, primary_key=True, related_name="summary"
+    )
+    passes = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    skips = models.PositiveIntegerField(default=0)
+    unknowns = models.PositiveIntegerField(default=0)
+    measurement_count = models.PositiveIntegerField(default=0)
+    measurement_sum = models.DecimalField(decimal_places=10, max_digits=30, null=True)
+    measurement_min = models.DecimalField(decimal_places=10, max_digits=30, null=True)
+    measurement_max = models.DecimalField(decimal_places=10, max_digits=30, null=True)
+
+    RESULT_FIELDS = {
+        TestCase.RESULT_PASS: "passes",
+        TestCase.RESULT_FAIL: "failures",
+        TestCase.RESULT_SKIP: "skips",
+        TestCase.RESULT_UNKNOWN: "unknowns",
+    }
+
+    @classmethod
+    def compute(cls, suite_ids):
+        """
+        Return the summaries of the given suites, aggregated from the test
+        cases stored in the database. The summaries are not saved.
+        """
+        annotations = {
+            field: Sum(
+                Case(
+                    When(result=result, then=1), default=0, output_field=IntegerField(),
+                )
+            )
+            for (result, field) in cls.RESULT_FIELDS.items()
+        }
+        annotations.update(
+            {
+                "measurement_count": Count("measurement"),
+                "measurement_sum": Sum("measurement"),
+                "measurement_min": Min("measurement"),
+                "measurement_max": Max("measurement"),
+            }
+        )
+        aggregates = {
+            row.pop("suite_id"): row
+            for row in TestCase.objects.filter(suite_id__in=suite_ids)
+            .order_by()
+            .values("suite_id")
+            .annotate(**annotations)
+        }
+        return [
+            cls(suite_id=suite_id, **aggregates.get(suite_id, {}))
+            for suite_id in suite_ids
+        ]
+
+    @classmethod
+    def create(cls, suite_ids):
+        """
+        Compute and save the summaries of the given suites. Return the ids of
+        the summaries created by this call: the others already exist, created
+        concurrently.
+        """
+        created = set()
+        for summary in cls.compute(sorted(suite_ids)):
+            try:
+                with transaction.atomic():
+                    summary.save(force_insert=True)
+                created.add(summary.suite_id)
+            except IntegrityError:
+                pass
+        return created
+
+    @classmethod
+    def add(cls, test_cases):
+        """
+        Add the test cases, already saved, to the summaries of their suites.
+        The missing summaries are computed from the database.
+
+        Should be called in the transaction saving the test cases: the
+        summaries computed concurrently then do not include these test
+        cases, which are added to the existing summaries.
+        """
+        deltas = {}
+        for test_case in test_cases:
+            delta = deltas.setdefault(
+                test_case.suite_id,
+                {"passes": 0, "failures": 0, "skips": 0, "unknowns": 0, "values": []},
+            )
+            delta[cls.RESULT_FIELDS[test_case.result]] += 1
+            if test_case.measurement is not None:
+                delta["values"].append(decimal.Decimal(str(test_case.measurement)))
+
+        existing = set(
+            cls.objects.filter(suite_id__in=deltas.keys()).values_list(
+                "suite_id", flat=True
+            )
+        )
+        created = cls.create(
+            [suite_id for suite_id in deltas if suite_id not in existing]
+        )
+
+        field = DecimalField(decimal_places=10, max_digits=30)
+        for suite_id in sorted(deltas):
+            # The summaries created by this call already count the test cases
+            if suite_id in created:
+                continue
+            delta = deltas[suite_id]
+            values = delta.pop("values")
+            updates = {k: F(k) + v for (k, v) in delta.items() if v}
+            if values:
+                updates["measurement_count"] = F("measurement_count") + len(values)
+                updates["measurement_sum"] = Coalesce(
+                    "measurement_sum", Value(0, output_field=field)
+                ) + Value(sum(values), output_field=field)
+                # NULL values are ignored by LEAST and GREATEST
+                updates["measurement_min"] = Least(
+                    "measurement_min", Value(min(values), output_field=field)
+                )
+                updates["measurement_max"] = Greatest(
+                    "measurement_max", Value(max(values), output_field=field)
+                )
+            cls.objects.filter(suite_id=suite_id).update(**updates)
+
+    @property
+    def measurement_avg(self):
+        if not self.measurement_count:
+            return None
+        return self.measurement_sum / self.measurement_count
+
+    def __str__(self):
+        return _("Test Suite Summary {0}").format(self.suite_id)
+
+
 class MetaType(models.Model):
     """
     name will be a label, like a deployment type (NFS) or a boot type (bootz)
@@ -825,6 +1004,10 @@ class Query(models.Model):
 
     last_updated = models.DateTimeField(blank=True, null=True)
 
+    refresh_duration = models.DurationField(
+        blank=True, null=True, editable=False, verbose_name="Last refresh duration"
+    )
+
     group_by_attribute = models.CharField(
         blank=True, null=True, max_length=20, verbose_name="group by attribute"
     )
@@ -982,7 +1165,35 @@ class Query(models.Model):
 
         return query_results
 
-    def refresh_view(self):
+    # Fields set when the objects are created, started or finished: the view
+    # of a query is only outdated when some of its objects changed since the
+    # last update.
+    CHANGED_FIELDS = {
+        TestJob: ["submit_time", "start_time", "end_time"],
+        TestSuite: ["job__end_time", "testcase__logged"],
+        TestCase: ["logged", "suite__job__end_time"],
+    }
+
+    def results_changed(self):
+        """ Return True if some objects matching the conditions were created
+        or modified since the last update. """
+        if self.last_updated is None:
+            return True
+        changed = Q()
+        for field in self.CHANGED_FIELDS[self.content_type.model_class()]:
+            changed |= Q(**{"%s__gt" % field: self.last_updated})
+        return (
+            Query.get_queryset(self.content_type, self.querycondition_set.all())
+            .filter(changed)
+            .exists()
+        )
+
+    def refresh_view(self, force=False):
+        """ Create or refresh the materialized view of the query.
+
+        Unless force is set, the refresh is skipped when the results did not
+        change since the last update. Return True if the view was refreshed.
+        """
 
         if self.is_live:
             raise RefreshLiveQueryError("Refreshing live query not permitted.")
@@ -1001,21 +1212,59 @@ class Query(models.Model):
                 query.is_updating = True
                 query.save()
 
+        refreshed = True
         try:
+            # Objects modified during the refresh will be seen by the next one
+            started = timezone.now()
             if not self.has_view():
                 QueryMaterializedView.create(self)
             elif self.is_changed:
                 QueryMaterializedView.drop(self.id)
                 QueryMaterializedView.create(self)
-            else:
+            elif force or self.results_changed():
                 QueryMaterializedView.refresh(self.id)
+            else:
+                refreshed = False
 
-            self.last_updated = timezone.now()
+            if refreshed:
+                self.refresh_duration = timezone.now() - started
+            self.last_updated = started
             self.is_changed = False
 
         finally:
             self.is_updating = False
             self.save()
+        return refreshed
+
+    @classmethod
+    def refresh_views(cls, queries, workers=1, force=False):
+        """ Refresh the views of the given queries with at most `workers`
+        threads.
+
+        Yield (query, refreshed, exception) as the refreshes finish, the
+        exception being None on success.
+        """
+
+        def refresh(query):
+            try:
+                return (query, query.refresh_view(force=force), None)
+            except Exception as exc:
+                return (query, False, exc)
+            finally:
+                # Each thread has its own database connection
+                if workers > 1:
+                    connection.close()
+
+        queries = list(queries)
+        if workers <= 1:
+            for query in queries:
+                yield refresh(query)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(refresh, query) for query in queries]
+            for future in concurrent.futures.as_completed(futures):
+                yield future.result()
 
     @classmethod
     def parse_conditions(cls, content_type, conditions):
@@ -1520,6 +1769,9 @@ class ChartQuery(models.Model):
                 conditions,
                 order_by=[self.ORDER_BY_MAP[content_type.model_class()]],
             ).visible_by_user(user)
+        # The suite url and end time are those of the job
+        if issubclass(results.model, TestSuite):
+            results = results.select_related("job")
 
         if self.chart_type == "pass/fail":
             chart_data["data"] = self.get_chart_passfail_data(user, results)
@@ -1585,8 +1837,61 @@ class ChartQuery(models.Model):
 
         return data
 
+    def get_summaries(self, query_results):
+        """
+        Return the pass/fail and measurement results of every TestJob or
+        TestSuite of the query results, built from the suite summaries in a
+        single query: {item id: {suite name: results}}.
+        The items with some suites that are not summarized are skipped.
+        """
+        model = query_results.model
+        if issubclass(model, TestJob):
+            (key, suites) = (
+                "job_id",
+                TestSuite.objects.filter(job__in=query_results.values("id")),
+            )
+        elif issubclass(model, TestSuite):
+            (key, suites) = (
+                "id",
+                TestSuite.objects.filter(id__in=query_results.values("id")),
+            )
+        else:
+            return {}
+
+        summaries = {}
+        missing = set()
+        for row in suites.order_by("id").values(
+            key,
+            "name",
+            "summary__passes",
+            "summary__failures",
+            "summary__skips",
+            "summary__unknowns",
+            "summary__measurement_count",
+            "summary__measurement_sum",
+        ):
+            if row["summary__passes"] is None:
+                missing.add(row[key])
+                continue
+            measurement = None
+            if row["summary__measurement_count"]:
+                measurement = (
+                    row["summary__measurement_sum"] / row["summary__measurement_count"]
+                )
+            summaries.setdefault(row[key], {})[row["name"]] = {
+                "pass": row["summary__passes"],
+                "fail": row["summary__failures"],
+                "skip": row["summary__skips"],
+                "unknown": row["summary__unknowns"],
+                "measurement": measurement,
+            }
+        for item_id in missing:
+            summaries.pop(item_id, None)
+        return summaries
+
     def get_chart_passfail_data(self, user, query_results):
 
+        summaries = self.get_summaries(query_results)
         data = []
         for item in query_results:
 
@@ -1600,7 +1905,9 @@ class ChartQuery(models.Model):
             date = str(item.get_end_datetime())
             attribute = attribute if attribute is not None else date
 
-            passfail_results = item.get_passfail_results()
+            passfail_results = summaries.get(item.id)
+            if passfail_results is None:
+                passfail_results = item.get_passfail_results()
             for result in passfail_results:
 
                 if result:
@@ -1628,6 +1935,10 @@ class ChartQuery(models.Model):
 
     def get_chart_measurement_data(self, user, query_results):
 
+        # The measurements of the suites are per test case
+        summaries = {}
+        if issubclass(query_results.model, TestJob):
+            summaries = self.get_summaries(query_results)
         data = []
         for item in query_results:
 
@@ -1641,7 +1952,9 @@ class ChartQuery(models.Model):
             date = str(item.get_end_datetime())
             attribute = attribute if attribute is not None else date
 
-            measurement_results = item.get_measurement_results()
+            measurement_results = summaries.get(item.id)
+            if measurement_results is None:
+                measurement_results = item.get_measurement_results()
             for result in measurement_results:
 
                 if result:
@@ -18,11 +18,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import functools
 import os
 import yaml
 import logging
 
-from django.db import DataError
 from django.core.exceptions import PermissionDenied
 from django.utils.translation import ungettext_lazy
 
@@ -147,23 +148,22 @@ def check_request_auth(request, job):
 
 
 def get_testcases_with_limit(testsuite, limit=None, offset=None):
+    """
+    Return the (lazy) queryset of the test cases of the suite, ordered by id
+    """
     logger = logging.getLogger("lava_results_app")
+    testcases = testsuite.testcase_set.all().order_by("id")
     if limit:
         try:
-            if not offset:
-                testcases = list(testsuite.testcase_set.all().order_by("id")[:limit])
-            else:
-                testcases = list(
-                    testsuite.testcase_set.all().order_by("id")[offset:][:limit]
-                )
-        except ValueError as e:
+            limit = int(limit)
+            offset = int(offset) if offset else 0
+        except (TypeError, ValueError) as e:
             logger.warning("Offset and limit must be integers: %s", str(e))
-            return []
-        except DataError as e:
-            logger.warning("Offset must be positive integer: %s", str(e))
-            return []
-    else:
-        testcases = list(testsuite.testcase_set.all().order_by("id"))
+            return testcases.none()
+        if limit < 0 or offset < 0:
+            logger.warning("Offset and limit must be positive integers")
+            return testcases.none()
+        testcases = testcases[offset : offset + limit]
 
     return testcases
 
@@ -192,6 +192,22 @@ def testcase_export_fields():
     ]
 
 
+@functools.lru_cache(maxsize=1024)
+def _load_extra_metadata(filename, mtime, size):
+    with open(filename, "r") as extra_file:
+        return yaml_load(extra_file)
+
+
+def load_extra_metadata(filename):
+    """
+    Return the content of the "extra" metadata file of a TestCase.
+    The file is only parsed again when modified. The cached content is
+    copied, so the callers can modify it.
+    """
+    stat = os.stat(filename)
+    return copy.deepcopy(_load_extra_metadata(filename, stat.st_mtime_ns, stat.st_size))
+
+
 def export_testcase(testcase, with_buglinks=False):
     """
     Returns string versions of selected elements of a TestCase
@@ -204,9 +220,8 @@ def export_testcase(testcase, with_buglinks=False):
     extra_source = []
     extra_data = metadata.get("extra")
     if isinstance(extra_data, str) and os.path.exists(extra_data):
-        with open(metadata["extra"], "r") as extra_file:
-            # TODO: this can fail!
-            items = yaml_load(extra_file)
+        # TODO: this can fail!
+        items = load_extra_metadata(extra_data)
         # hide the !!python OrderedDict prefix from the output.
         for key, value in items.items():
             extra_source.append({key: value})
@@ -26,8 +26,6 @@ Keep to just the response rendering functions
 
 import contextlib
 import os
-import csv
-import logging
 import simplejson
 import yaml
 from collections import OrderedDict
@@ -41,7 +39,7 @@ from django.http.response import HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.shortcuts import render, loader
 
-from lava_common.compat import yaml_dump, yaml_load
+from lava_common.compat import yaml_dump
 from lava_server.views import index as lava_index
 from lava_server.bread_crumbs import BreadCrumb, BreadCrumbTrail
 from django.shortcuts import get_object_or_404
@@ -51,8 +49,8 @@ from lava_results_app.tables import (
     ResultsIndexTable,
     TestJobResultsTable,
 )
-from lava_results_app.utils import StreamEcho
 from lava_results_app.dbutils import export_testsuite
+from lava_results_app.export import export_csv, export_yaml, job_testcases
 from lava_results_app.models import (
     BugLink,
     QueryCondition,
@@ -65,7 +63,7 @@ from lava_results_app.utils import (
     check_request_auth,
     export_testcase,
     get_testcases_with_limit,
-    testcase_export_fields,
+    load_extra_metadata,
 )
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.tables import pklink
@@ -173,23 +171,8 @@ def testjob_csv(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
 
-    def testjob_stream(suites, pseudo_buffer):
-        fieldnames = testcase_export_fields()
-        writer = csv.DictWriter(pseudo_buffer, fieldnames=fieldnames)
-        # writer.writeheader does not return the string while writer.writerow
-        # does. Copy writeheader code from csv.py and yield the value.
-        yield writer.writerow(dict(zip(fieldnames, fieldnames)))
-
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield writer.writerow(export_testcase(test_case))
-
-    suites = job.testsuite_set.all().prefetch_related(
-        "test_sets__test_cases__actionlevels"
-    )
-    pseudo_buffer = StreamEcho()
     response = StreamingHttpResponse(
-        testjob_stream(suites, pseudo_buffer), content_type="text/csv"
+        export_csv(job_testcases(job)), content_type="text/csv"
     )
     filename = "lava_%s.csv" % job.id
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
@@ -199,16 +182,9 @@ def testjob_csv(request, job):
 def testjob_yaml(request, job):
     job = get_object_or_404(TestJob, pk=job)
     check_request_auth(request, job)
-    suites = job.testsuite_set.all().prefetch_related(
-        "test_sets__test_cases__actionlevels"
+    response = StreamingHttpResponse(
+        export_yaml(job_testcases(job)), content_type="text/yaml"
     )
-
-    def test_case_stream():
-        for test_suite in suites:
-            for test_case in test_suite.testcase_set.all():
-                yield yaml_dump([export_testcase(test_case)])
-
-    response = StreamingHttpResponse(test_case_stream(), content_type="text/yaml")
     filename = "lava_%s.yaml" % job.id
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
     return response
@@ -272,19 +248,10 @@ def suite_csv(request, job, pk):
     querydict = request.GET
     offset = int(querydict.get("offset", default=0))
     limit = int(querydict.get("limit", default=0))
-    response = HttpResponse(content_type="text/csv")
+    testcases = get_testcases_with_limit(test_suite, limit, offset)
+    response = StreamingHttpResponse(export_csv(testcases), content_type="text/csv")
     filename = "lava_%s.csv" % test_suite.name
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
-    writer = csv.DictWriter(
-        response,
-        quoting=csv.QUOTE_ALL,
-        extrasaction="ignore",
-        fieldnames=testcase_export_fields(),
-    )
-    writer.writeheader()
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for row in testcases:
-        writer.writerow(export_testcase(row))
     return response
 
 
@@ -305,13 +272,8 @@ def suite_csv_stream(request, job, pk):
     offset = int(querydict.get("offset", default=0))
     limit = int(querydict.get("limit", default=0))
 
-    pseudo_buffer = StreamEcho()
-    writer = csv.writer(pseudo_buffer)
     testcases = get_testcases_with_limit(test_suite, limit, offset)
-    response = StreamingHttpResponse(
-        (writer.writerow(export_testcase(row)) for row in testcases),
-        content_type="text/csv",
-    )
+    response = StreamingHttpResponse(export_csv(testcases), content_type="text/csv")
     filename = "lava_stream_%s.csv" % test_suite.name
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
     return response
@@ -324,14 +286,10 @@ def suite_yaml(request, job, pk):
     querydict = request.GET
     offset = int(querydict.get("offset", default=0))
     limit = int(querydict.get("limit", default=0))
-    response = HttpResponse(content_type="text/yaml")
+    testcases = get_testcases_with_limit(test_suite, limit, offset)
+    response = StreamingHttpResponse(export_yaml(testcases), content_type="text/yaml")
     filename = "lava_%s.yaml" % test_suite.name
     response["Content-Disposition"] = 'attachment; filename="%s"' % filename
-    yaml_list = []
-    testcases = get_testcases_with_limit(test_suite, limit, offset)
-    for test_case in testcases:
-        yaml_list.append(export_testcase(test_case))
-    yaml_dump(yaml_list, response)
     return response
 
 
@@ -430,20 +388,14 @@ def testcase(request, case_id, job=None, pk=None):
     else:
         test_cases = TestCase.objects.filter(name=case.name, suite=test_suite)
     extra_source = {}
-    logger = logging.getLogger("lava-master")
     for extra_case in test_cases:
-        try:
-            f_metadata = yaml_load(extra_case.metadata)
-            if not f_metadata:
-                continue
-        except TypeError:
-            logger.info("Unable to load extra case metadata for %s", extra_case)
+        f_metadata = extra_case.action_metadata
+        if not isinstance(f_metadata, dict):
             continue
         extra_data = f_metadata.get("extra")
         try:
             if extra_data and os.path.exists(extra_data):
-                with open(f_metadata["extra"], "r") as extra_file:
-                    items = yaml_load(extra_file)
+                items = load_extra_metadata(extra_data)
                 # hide the !!python OrderedDict prefix from the output.
                 for key, value in items.items():
                     extra_source.setdefault(extra_case.id, "")
@@ -26,7 +26,8 @@ from django.forms import ValidationError
 
 from linaro_django_xmlrpc.models import ExposedV2API
 from lava_scheduler_app.api import check_perm
-from lava_scheduler_app.models import Alias, DeviceType
+from lava_scheduler_app.auth import filter_permitted
+from lava_scheduler_app.models import Alias, Device, DeviceType
 from lava_server.files import File
 
 
@@ -354,7 +355,10 @@ class SchedulerDeviceTypesAPI(ExposedV2API):
 
         aliases = [str(alias.name) for alias in dt.aliases.all()]
         devices = [
-            str(d.hostname) for d in dt.device_set.all() if d.can_view(self.user)
+            str(d.hostname)
+            for d in filter_permitted(
+                self.user, Device.VIEW_PERMISSION, dt.device_set.all()
+            )
         ]
         dt_dict = {
             "name": dt.name,
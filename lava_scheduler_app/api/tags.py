@@ -22,7 +22,8 @@ from django.db import IntegrityError
 
 from linaro_django_xmlrpc.models import ExposedV2API
 from lava_scheduler_app.api import check_perm
-from lava_scheduler_app.models import Tag
+from lava_scheduler_app.auth import filter_permitted
+from lava_scheduler_app.models import Device, Tag
 
 
 class SchedulerTagsAPI(ExposedV2API):
@@ -127,5 +128,10 @@ class SchedulerTagsAPI(ExposedV2API):
         except Tag.DoesNotExist:
             raise xmlrpc.client.Fault(404, "Tag '%s' was not found." % name)
 
-        devices = [d.hostname for d in tag.device_set.all() if d.can_view(self.user)]
+        devices = [
+            d.hostname
+            for d in filter_permitted(
+                self.user, Device.VIEW_PERMISSION, tag.device_set.all()
+            )
+        ]
         return {"name": name, "description": tag.description, "devices": devices}
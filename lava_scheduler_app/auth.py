@@ -17,11 +17,127 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
-
+import contextlib
 from itertools import chain
+import threading
 
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import prefetch_related_objects
+
+
+# Permission cache of the current request or scheduling pass
+thread_local = threading.local()
+
+# Method checking each kind of permission, by codename prefix
+PERMISSION_CHECKS = {"view": "can_view", "change": "can_change", "submit": "can_submit"}
+
+
+class PermissionCache:
+    """
+    Group object permissions, loaded for a whole model at once.
+
+    The restrictions (every permission set on each object) are shared by all
+    the users. The group permissions are loaded by user.
+    The cache is only used inside a permission_cache() block, so changes to
+    the permissions are seen by the next request or scheduling pass.
+    """
+
+    def __init__(self):
+        self.perms = {}
+        self.restrictions = {}
+
+    @staticmethod
+    def _query(model):
+        related = model._meta.get_field("permissions").related_model
+        field = related._meta.get_field(model._meta.model_name).attname
+        return (related.objects.all(), field)
+
+    def get_group_perms(self, user, obj):
+        """
+        Codenames of the permissions given to the groups of the user on obj.
+        """
+        model = obj._meta.concrete_model
+        key = (user.pk, model)
+        if key not in self.perms:
+            (query, field) = self._query(model)
+            query = query.filter(
+                group__user=user,
+                permission__content_type=ContentType.objects.get_for_model(model),
+            )
+            perms = {}
+            for (pk, codename) in query.values_list(field, "permission__codename"):
+                perms.setdefault(pk, set()).add(codename)
+            self.perms[key] = perms
+        return set(self.perms[key].get(obj.pk, []))
+
+    def is_permission_restricted(self, obj, perm):
+        """
+        True if perm is given to any group on obj.
+        """
+        model = obj._meta.concrete_model
+        if model not in self.restrictions:
+            (query, field) = self._query(model)
+            restrictions = {}
+            for (pk, app_label, codename) in query.values_list(
+                field, "permission__content_type__app_label", "permission__codename"
+            ):
+                restrictions.setdefault(pk, set()).add("%s.%s" % (app_label, codename))
+            self.restrictions[model] = restrictions
+        return perm in self.restrictions[model].get(obj.pk, [])
+
+
+def get_permission_cache():
+    return getattr(thread_local, "cache", None)
+
+
+@contextlib.contextmanager
+def permission_cache():
+    """
+    Memoise the permissions inside the block. Nested blocks share the same
+    cache.
+    """
+    previous = get_permission_cache()
+    thread_local.cache = previous or PermissionCache()
+    try:
+        yield thread_local.cache
+    finally:
+        thread_local.cache = previous
+
+
+class PermissionCacheMiddleware:
+    """
+    Memoise the permissions for the duration of each request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with permission_cache():
+            return self.get_response(request)
+
+
+def filter_permitted(user, perm, objects):
+    """
+    Return the objects on which the user has the given permission, in order.
+
+    The objects are checked by can_view(), can_change() or can_submit(). The
+    related objects needed by these checks (listed in PERMISSION_RELATIONS)
+    and the permissions are loaded in bulk, so the number of queries does
+    not depend on the number of objects.
+
+    :param perm: permission as string, must contain app_label
+    :param objects: Django model instances, all of the same model
+    """
+    objects = list(objects)
+    if not objects:
+        return []
+    _, codename = perm.split(".", 1)
+    check = PERMISSION_CHECKS[codename.split("_", 1)[0]]
+    prefetch_related_objects(objects, *getattr(objects[0], "PERMISSION_RELATIONS", []))
+    with permission_cache():
+        return [obj for obj in objects if getattr(obj, check)(user)]
 
 
 class PermissionAuth:
@@ -55,6 +171,23 @@ class PermissionAuth:
     def get_group_perms(self, obj):
         content_type = ContentType.objects.get_for_model(obj)
 
+        cache = get_permission_cache()
+        if cache is not None:
+            perms = cache.get_group_perms(self.user, obj)
+        else:
+            perms = self._query_group_perms(obj, content_type)
+
+        # Add lower priority permissions the resulting set.
+        for perm in perms.copy():
+            for idx, lower_perm in enumerate(obj.PERMISSIONS_PRIORITY):
+                if idx > obj.PERMISSIONS_PRIORITY.index(
+                    "%s.%s" % (content_type.app_label, perm)
+                ):
+                    perms.add(lower_perm.split(".", 1)[-1])
+
+        return perms
+
+    def _query_group_perms(self, obj, content_type):
         perms_queryset = Permission.objects.filter(
             content_type=ContentType.objects.get_for_model(obj)
         )
@@ -66,16 +199,7 @@ class PermissionAuth:
         ] = obj
 
         perms_queryset = perms_queryset.filter(**filters)
-        perms = set(perms_queryset.values_list("codename", flat=True))
-        # Add lower priority permissions the resulting set.
-        for perm in perms.copy():
-            for idx, lower_perm in enumerate(obj.PERMISSIONS_PRIORITY):
-                if idx > obj.PERMISSIONS_PRIORITY.index(
-                    "%s.%s" % (content_type.app_label, perm)
-                ):
-                    perms.add(lower_perm.split(".", 1)[-1])
-
-        return perms
+        return set(perms_queryset.values_list("codename", flat=True))
 
     def get_perms(self, obj):
         """
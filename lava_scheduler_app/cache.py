@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+import jinja2
+import jinja2.meta
+
+import lava_scheduler_app.environment as environment
+
+
+def signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def template_paths(name):
+    """
+    Return the files that rendering the given device template depends on:
+    the template itself and every template that it extends, includes or
+    imports (recursively). Every candidate path from the search path is
+    returned, so adding a template with a higher priority is also detected.
+    """
+    env = environment.devices()
+    paths = set()
+    names = [name]
+    seen = set()
+    while names:
+        name = names.pop()
+        if name in seen:
+            continue
+        seen.add(name)
+        for directory in env.loader.searchpath:
+            paths.add(os.path.join(directory, name))
+        try:
+            (source, _, _) = env.loader.get_source(env, name)
+            ast = env.parse(source)
+        except jinja2.TemplateError:
+            continue
+        names.extend(
+            n for n in jinja2.meta.find_referenced_templates(ast) if n is not None
+        )
+    return paths
+
+
+class DeviceCache:
+    """
+    Cache the values computed from the device templates (rendered device
+    dictionaries, extends, health-checks, ...).
+
+    Each value is stored along with the signature (mtime and size) of the files
+    it was computed from. By default, the signatures are checked on every
+    access. When the template directories are watched (see lava-master), the
+    signatures are not checked and the entries are dropped by invalidate().
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.watched = False
+
+    def _key(self, hostname, kind):
+        # The search path is part of the key as it's not the same for every
+        # process (and for every test).
+        return (hostname, kind, tuple(environment.devices().loader.searchpath))
+
+    def get(self, hostname, kind, func):
+        """
+        Return the cached value or call func() that should return the value
+        and the list of files that this value depends on.
+        """
+        key = self._key(hostname, kind)
+        entry = self.entries.get(key)
+        if entry is not None:
+            (value, deps) = entry
+            if self.watched or all(signature(p) == s for (p, s) in deps.items()):
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        (value, paths) = func()
+        paths = [os.path.normpath(str(p)) for p in paths]
+        self.entries[key] = (value, {p: signature(p) for p in paths})
+        return value
+
+    def invalidate(self, paths):
+        """
+        Drop the entries depending on the given files.
+        """
+        paths = set(os.path.normpath(str(p)) for p in paths)
+        for (key, (_, deps)) in list(self.entries.items()):
+            if paths & deps.keys():
+                self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+device_cache = DeviceCache()
@@ -17,16 +17,30 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import concurrent.futures
 import contextlib
+import json
 import lzma
+import os
 import pathlib
+import re
 import struct
+import yaml
 
 from django.conf import settings
 from importlib import import_module
 
+from lava_common.compat import yaml_load
+
 
 class Logs:
+    def compress(self, job, data):
+        raise NotImplementedError("Should implement this method")
+
+    def flush(self, job, output=None, idx=None, sync=False):
+        raise NotImplementedError("Should implement this method")
+
     def line_count(self, job):
         raise NotImplementedError("Should implement this method")
 
@@ -39,7 +53,7 @@ class Logs:
     def size(self, job, start=0, end=None):
         raise NotImplementedError("Should implement this method")
 
-    def write(self, job, line, output=None, idx=None):
+    def write(self, job, line, output=None, idx=None, flush=True):
         raise NotImplementedError("Should implement this method")
 
 
@@ -59,10 +73,12 @@ class LogsFilesystem(Logs):
         directory = pathlib.Path(job.output_dir)
         with self.open(job) as f_log:
             with open(str(directory / self.index_filename), "wb") as f_idx:
-                f_idx.write(struct.pack(self.PACK_FORMAT, 0))
+                # Same format as lava-logs: the offset of the start of each line
+                offset = 0
                 line = f_log.readline()
                 while line:
-                    f_idx.write(struct.pack(self.PACK_FORMAT, f_log.tell()))
+                    f_idx.write(struct.pack(self.PACK_FORMAT, offset))
+                    offset = f_log.tell()
                     line = f_log.readline()
 
     def _get_line_offset(self, f_idx, line):
@@ -74,10 +90,8 @@ class LogsFilesystem(Logs):
             return None
 
     def line_count(self, job):
-        with open(
-            str(pathlib.Path(job.output_dir) / self.index_filename), "rb"
-        ) as f_idx:
-            return int(f_idx.tell() / self.PACK_SIZE)
+        directory = pathlib.Path(job.output_dir)
+        return (directory / self.index_filename).stat().st_size // self.PACK_SIZE
 
     def open(self, job):
         directory = pathlib.Path(job.output_dir)
@@ -120,13 +134,275 @@ class LogsFilesystem(Logs):
             return int((directory / self.log_size_filename).read_text(encoding="utf-8"))
         return None
 
-    def write(self, job, line, output=None, idx=None):
-        idx.write(struct.pack(self.PACK_FORMAT, output.tell()))
+    def compress(self, job, data):
+        directory = pathlib.Path(job.output_dir)
+        with lzma.open(str(directory / self.compressed_log_filename), "wb") as f_out:
+            f_out.write(data)
+        return [self.compressed_log_filename]
+
+    def flush(self, job, output=None, idx=None, sync=False):
+        # Flush the logs before the index, so the index never points after the
+        # end of the logs.
+        output.flush()
         idx.flush()
+        if sync:
+            os.fsync(output.fileno())
+            os.fsync(idx.fileno())
+
+    def write(self, job, line, output=None, idx=None, flush=True):
+        idx.write(struct.pack(self.PACK_FORMAT, output.tell()))
         output.write(line)
-        output.flush()
+        if flush:
+            self.flush(job, output, idx)
+
+
+class LogsBlockCompressed(LogsFilesystem):
+    """
+    Compress the logs by blocks of BLOCK_SIZE bytes.
+
+    Each block is an independent xz stream. As a concatenation of xz streams
+    is a valid xz file, "output.yaml.xz" can still be decompressed as a whole.
+    The offsets of each block are stored in "output.yaml.xz.idx" so reading
+    some lines only requires to decompress the corresponding blocks.
+
+    The blocks are compressed in LOG_COMPRESSION_THREADS threads.
+    """
+
+    BLOCK_FORMAT = "=QQ"
+    BLOCK_SIZE = 1024 * 1024
+    BLOCK_PACK_SIZE = struct.calcsize(BLOCK_FORMAT)
+
+    def __init__(self):
+        super().__init__()
+        self.blocks_filename = "output.yaml.xz.idx"
+
+    def _get_blocks(self, job):
+        # List of (uncompressed offset, compressed offset) for every block and
+        # for the end of the file.
+        data = (pathlib.Path(job.output_dir) / self.blocks_filename).read_bytes()
+        return [
+            struct.unpack_from(self.BLOCK_FORMAT, data, offset)
+            for offset in range(0, len(data), self.BLOCK_PACK_SIZE)
+        ]
+
+    def _read_blocks(self, job, start_offset, end_offset):
+        blocks = self._get_blocks(job)
+        index = bisect.bisect_right(blocks, (start_offset, float("inf"))) - 1
+        base = blocks[index][0]
+        data = []
+        directory = pathlib.Path(job.output_dir)
+        with open(str(directory / self.compressed_log_filename), "rb") as f_xz:
+            while index < len(blocks) - 1:
+                if end_offset is not None and blocks[index][0] >= end_offset:
+                    break
+                (start, end) = (blocks[index][1], blocks[index + 1][1])
+                f_xz.seek(start)
+                data.append(lzma.decompress(f_xz.read(end - start)))
+                index += 1
+        data = b"".join(data)
+        if end_offset is None:
+            return data[start_offset - base :]
+        return data[start_offset - base : end_offset - base]
+
+    def compress(self, job, data):
+        directory = pathlib.Path(job.output_dir)
+        filename = str(directory / self.compressed_log_filename)
+        blocks_filename = str(directory / self.blocks_filename)
+        # Always write one block at least: an empty file is not a valid xz file.
+        offsets = range(0, max(len(data), 1), self.BLOCK_SIZE)
+        threads = settings.LOG_COMPRESSION_THREADS or os.cpu_count() or 1
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            blocks = executor.map(
+                lambda offset: lzma.compress(data[offset : offset + self.BLOCK_SIZE]),
+                offsets,
+            )
+            with open(filename + ".tmp", "wb") as f_xz:
+                with open(blocks_filename + ".tmp", "wb") as f_blocks:
+                    for (offset, block) in zip(offsets, blocks):
+                        f_blocks.write(
+                            struct.pack(self.BLOCK_FORMAT, offset, f_xz.tell())
+                        )
+                        f_xz.write(block)
+                    f_blocks.write(
+                        struct.pack(self.BLOCK_FORMAT, len(data), f_xz.tell())
+                    )
+        # Without the blocks index, the logs are read as a single xz stream.
+        # Replace it last so it always matches the logs.
+        os.replace(filename + ".tmp", filename)
+        os.replace(blocks_filename + ".tmp", blocks_filename)
+        return [self.compressed_log_filename, self.blocks_filename]
+
+    def read(self, job, start=0, end=None):
+        directory = pathlib.Path(job.output_dir)
+        if (
+            (start == 0 and end is None)
+            or (directory / self.log_filename).exists()
+            or not (directory / self.blocks_filename).exists()
+        ):
+            return super().read(job, start, end)
+
+        # Create the index
+        if not (directory / self.index_filename).exists():
+            self._build_index(job)
+        # use it now
+        with open(str(directory / self.index_filename), "rb") as f_idx:
+            start_offset = self._get_line_offset(f_idx, start)
+            if start_offset is None:
+                return ""
+            end_offset = None
+            if end is not None:
+                end_offset = self._get_line_offset(f_idx, end)
+                if end_offset is not None and end_offset <= start_offset:
+                    return ""
+        return self._read_blocks(job, start_offset, end_offset).decode("utf-8")
+
+
+def parse_lines(data):
+    """
+    Parse the logs line by line.
+
+    Each line of the logs is a dictionary in YAML flow style ("- {...}"). Most
+    of them are also valid JSON, which is a lot faster to parse.
+    Yield (line, dictionary) for every complete line. The dictionary is None
+    if the line is invalid.
+    """
+    lines = data.split("\n")
+    # The last line is empty or still being written
+    for line in lines[:-1]:
+        if not line:
+            continue
+        value = None
+        if line.startswith("- "):
+            try:
+                value = json.loads(line[2:])
+            except ValueError:
+                with contextlib.suppress(yaml.YAMLError):
+                    value = yaml_load(line[2:])
+        if not isinstance(value, dict) or "lvl" not in value or "msg" not in value:
+            value = None
+        yield (line, value)
 
 
 logs_backend_str = settings.LAVA_LOG_BACKEND.rsplit(".", 1)
 logs_class = getattr(import_module(logs_backend_str[0]), logs_backend_str[1])
 logs_instance = logs_class()
+
+
+# Action timings
+TIMING_FILENAME = "output.timing"
+TIMING_START = re.compile(
+    r"^start: (?P<level>[\d.]+) (?P<action>[\w_-]+) \(timeout (?P<timeout>\d+:\d+:\d+)\)"
+)
+TIMING_END = re.compile(
+    r"^end: (?P<level>[\d.]+) (?P<action>[\w_-]+) \(duration (?P<duration>\d+:\d+:\d+)\)"
+)
+
+
+def _seconds(value):
+    parts = value.split(":")
+    return float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
+
+
+def timing_entry(line, value):
+    """
+    Return the timing entry [kind, level, action, seconds, line] if the log
+    line (a dictionary) is the start or the end of an action, None otherwise.
+    """
+    # Only parse debug and info levels
+    if value["lvl"] not in ["debug", "info"] or not isinstance(value["msg"], str):
+        return None
+    match = TIMING_START.match(value["msg"])
+    if match is not None:
+        d = match.groupdict()
+        return ["start", d["level"], d["action"], _seconds(d["timeout"]), line]
+    match = TIMING_END.match(value["msg"])
+    if match is not None:
+        d = match.groupdict()
+        return ["end", d["level"], d["action"], _seconds(d["duration"]), line]
+    return None
+
+
+def read_timing(job, save=False):
+    """
+    Return the timing entries of the job.
+
+    The entries are appended to the timing file by lava-logs, that only
+    creates it when starting to receive the logs. For older jobs, and for the
+    jobs that were running when lava-logs started to store the timings, the
+    entries are extracted from the logs and saved if requested and possible.
+    """
+    filename = pathlib.Path(job.output_dir) / TIMING_FILENAME
+    with contextlib.suppress(FileNotFoundError):
+        entries = []
+        with open(str(filename), "r") as f_timing:
+            for data in f_timing:
+                # Skip lines that were partially written
+                with contextlib.suppress(ValueError):
+                    entries.append(json.loads(data))
+        return entries
+
+    entries = []
+    for (index, (_, value)) in enumerate(parse_lines(logs_instance.read(job))):
+        if value is not None:
+            entry = timing_entry(index, value)
+            if entry is not None:
+                entries.append(entry)
+    # The timing file is only a cache: ignore the errors
+    if save:
+        with contextlib.suppress(OSError):
+            with open(str(filename) + ".tmp", "w") as f_timing:
+                f_timing.write("".join(json.dumps(e) + "\n" for e in entries))
+            os.replace(str(filename) + ".tmp", str(filename))
+    return entries
+
+
+def compute_timing(entries):
+    """
+    Compute the duration and timeout of every action.
+    The pipeline is a list of (level, name, duration, timeout, near_timeout,
+    line) sorted by level, line being the start line of the action. The summary
+    is a list of [name, duration, percentage] for the top level actions.
+    """
+    timings = {}
+    total_duration = 0
+    max_duration = 0
+    summary = []
+    for (kind, level, action, seconds, line) in entries:
+        if kind == "start":
+            timings[level] = {"name": action, "timeout": seconds, "line": line}
+            continue
+
+        # TODO: validate does not have a proper start line
+        if action == "validate":
+            continue
+        # We create the entry because with some timeout, the start line
+        # might be missing.
+        timings.setdefault(level, {})["duration"] = seconds
+
+        max_duration = max(max_duration, seconds)
+        if "." not in level:
+            total_duration += seconds
+            summary.append([action, seconds, 0])
+
+    # Construct the report
+    pipeline = []
+    for lvl in sorted(timings.keys()):
+        duration = timings[lvl].get("duration", 0.0)
+        timeout = timings[lvl].get("timeout", 0.0)
+        name = timings[lvl].get("name", "???")
+        line = timings[lvl].get("line")
+        pipeline.append(
+            (lvl, name, duration, timeout, bool(duration >= (timeout * 0.85)), line)
+        )
+
+    # Compute the percentage
+    if total_duration:
+        for index, action in enumerate(summary):
+            summary[index][2] = action[1] / total_duration * 100
+
+    return {
+        "pipeline": pipeline,
+        "summary": summary,
+        "total_duration": total_duration,
+        "max_duration": max_duration,
+    }
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from django.db import migrations, models
+
+from lava_common.compat import yaml_safe_load
+
+
+def forwards_func(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    TestJob = apps.get_model("lava_scheduler_app", "TestJob")
+    # Only the jobs that are still to be scheduled do matter
+    jobs = TestJob.objects.using(db_alias).filter(
+        state__in=[0, 1], definition__contains="lava-vland"
+    )
+    for job in jobs:
+        definition = yaml_safe_load(job.definition)
+        if "lava-vland" in definition.get("protocols", {}):
+            job.requires_vland = True
+            job.save(update_fields=["requires_vland"])
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("lava_scheduler_app", "0050_worker_version")]
+
+    operations = [
+        migrations.AddField(
+            model_name="testjob",
+            name="requires_vland",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(forwards_func, noop),
+    ]
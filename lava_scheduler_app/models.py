@@ -20,6 +20,7 @@
 
 
 import contextlib
+import copy
 import datetime
 import jinja2
 import logging
@@ -52,6 +53,8 @@ from lava_common.compat import yaml_dump, yaml_safe_load, yaml_safe_dump
 from lava_common.decorators import nottest
 from lava_results_app.utils import export_testcase
 from lava_scheduler_app import utils
+from lava_scheduler_app.auth import get_permission_cache
+from lava_scheduler_app.cache import device_cache, template_paths
 from lava_scheduler_app.logutils import logs_instance
 import lava_scheduler_app.environment as environment
 from lava_scheduler_app.managers import (
@@ -215,6 +218,9 @@ class RestrictedObject(models.Model):
         abstract = True
 
     def is_permission_restricted(self, perm):
+        cache = get_permission_cache()
+        if cache is not None:
+            return cache.is_permission_restricted(self, perm)
         app_label, codename = perm.split(".", 1)
         perm_count = self.permissions.filter(
             permission__content_type__app_label=app_label, permission__codename=codename
@@ -516,6 +522,9 @@ class Device(RestrictedObject):
         SUBMIT_PERMISSION: DeviceType.SUBMIT_PERMISSION,
     }
 
+    # Related objects used by the permission checks (see filter_permitted)
+    PERMISSION_RELATIONS = ["device_type"]
+
     # Order of permission importance from most to least.
     PERMISSIONS_PRIORITY = [CHANGE_PERMISSION, SUBMIT_PERMISSION, VIEW_PERMISSION]
 
@@ -716,12 +725,14 @@ class Device(RestrictedObject):
         return False
 
     def is_valid(self):
-        try:
-            rendered = self.load_configuration()
-            validate_device(rendered)
-        except (SubmissionException, yaml.YAMLError):
-            return False
-        return True
+        def compute():
+            try:
+                validate_device(self._configuration())
+            except (SubmissionException, yaml.YAMLError):
+                return (False, self._template_paths())
+            return (True, self._template_paths())
+
+        return device_cache.get(self.hostname, "valid", compute)
 
     def log_admin_entry(self, user, reason):
         if user is None:
@@ -852,16 +863,44 @@ class Device(RestrictedObject):
                 return File("device", self.hostname).read()
             return None
 
+        # Only the default rendering is cached
+        if not job_ctx:
+            if output_format == "yaml":
+                return device_cache.get(
+                    self.hostname,
+                    "yaml",
+                    lambda: (self._render_configuration(), self._template_paths()),
+                )
+            return copy.deepcopy(self._configuration())
+
+        device_template = self._render_configuration(job_ctx)
+        if output_format == "yaml" or device_template is None:
+            return device_template
+        else:
+            return yaml_safe_load(device_template)
+
+    def _render_configuration(self, job_ctx=None):
         try:
             template = environment.devices().get_template("%s.jinja2" % self.hostname)
-            device_template = template.render(**job_ctx)
+            return template.render(**(job_ctx or {}))
         except jinja2.TemplateError:
             return None
 
-        if output_format == "yaml":
-            return device_template
-        else:
-            return yaml_safe_load(device_template)
+    def _template_paths(self):
+        return template_paths("%s.jinja2" % self.hostname)
+
+    def _configuration(self):
+        """
+        Cached device dictionary, should not be modified by the caller.
+        """
+
+        def compute():
+            device_template = self._render_configuration()
+            if device_template is None:
+                return (None, self._template_paths())
+            return (yaml_safe_load(device_template), self._template_paths())
+
+        return device_cache.get(self.hostname, "dict", compute)
 
     def minimise_configuration(self, data):
         """
@@ -896,7 +935,9 @@ class Device(RestrictedObject):
 
     def save_configuration(self, data):
         try:
-            File("device", self.hostname).write(data)
+            device_file = File("device", self.hostname)
+            device_file.write(data)
+            device_cache.invalidate(device_file.files)
             return True
         except OSError as exc:
             logger = logging.getLogger("lava_scheduler_app")
@@ -906,6 +947,13 @@ class Device(RestrictedObject):
             return False
 
     def get_extends(self):
+        return device_cache.get(
+            self.hostname,
+            "extends",
+            lambda: (self._get_extends(), File("device", self.hostname).files),
+        )
+
+    def _get_extends(self):
         jinja_config = self.load_configuration(output_format="raw")
         if not jinja_config:
             return None
@@ -933,15 +981,21 @@ class Device(RestrictedObject):
         if not extends:
             return None
 
-        filename = os.path.join(settings.HEALTH_CHECKS_PATH, "%s.yaml" % extends)
-        # Try if health check file is having a .yml extension
-        if not os.path.exists(filename):
-            filename = os.path.join(settings.HEALTH_CHECKS_PATH, "%s.yml" % extends)
-        try:
-            with open(filename, "r") as f_in:
-                return f_in.read()
-        except OSError:
-            return None
+        filenames = [
+            os.path.join(settings.HEALTH_CHECKS_PATH, "%s.yaml" % extends),
+            # Try if health check file is having a .yml extension
+            os.path.join(settings.HEALTH_CHECKS_PATH, "%s.yml" % extends),
+        ]
+
+        def compute():
+            paths = filenames + File("device", self.hostname).files
+            for filename in filenames:
+                with contextlib.suppress(OSError):
+                    with open(filename, "r") as f_in:
+                        return (f_in.read(), paths)
+            return (None, paths)
+
+        return device_cache.get(self.hostname, "health-check", compute)
 
 
 class JobFailureTag(models.Model):
@@ -1169,6 +1223,7 @@ def _create_pipeline_job(
             health_check=health_check,
             priority=priority,
             is_public=is_public,
+            requires_vland="lava-vland" in job_data.get("protocols", {}),
         )
         job.save()
 
@@ -1331,6 +1386,12 @@ class TestJob(models.Model):
         VIEW_PERMISSION: DeviceType.VIEW_PERMISSION,
         CHANGE_PERMISSION: DeviceType.CHANGE_PERMISSION,
     }
+    # Related objects used by the permission checks (see filter_permitted)
+    PERMISSION_RELATIONS = [
+        "viewing_groups",
+        "actual_device__device_type",
+        "requested_device_type",
+    ]
 
     objects = RestrictedTestJobQuerySet.as_manager()
 
@@ -1404,6 +1465,10 @@ class TestJob(models.Model):
 
     tags = models.ManyToManyField(Tag, blank=True)
 
+    # Computed at submission time, to avoid parsing the definition while
+    # scheduling.
+    requires_vland = models.BooleanField(default=False, editable=False)
+
     # This is set once the job starts or is reserved.
     actual_device = models.ForeignKey(
         Device,
@@ -1801,7 +1866,7 @@ class TestJob(models.Model):
         )
 
     def can_view(self, user):
-        if user == self.submitter or user.is_superuser:
+        if user.pk == self.submitter_id or user.is_superuser:
             return True
         if self.viewing_groups.exists():
             # If viewing_groups is set, user must belong to all the specified
@@ -17,14 +17,28 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import datetime
+import itertools
+import time
 
 from django.contrib.auth.models import User
 from django.db import transaction
-from django.db.models import Case, When, IntegerField, Sum
+from django.db.models import (
+    Case,
+    Count,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    When,
+)
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
 from django.utils import timezone
 
 from lava_common.compat import yaml_safe_load, yaml_safe_dump
+from lava_scheduler_app.auth import filter_permitted, permission_cache
 from lava_scheduler_app.dbutils import match_vlan_interface
 from lava_scheduler_app.models import (
     DeviceType,
@@ -35,6 +49,281 @@ from lava_scheduler_app.models import (
 )
 
 
+class SchedulerState:
+    """
+    In-memory index of the scheduling inputs, kept by lava-master.
+
+    The index holds the available devices of each device-type, the busy
+    devices of each worker and, for each device-type, the queue of pending
+    jobs sorted in scheduling order.
+    The index is loaded by reconcile() and then kept up-to-date incrementally:
+    the state transitions only mark the objects as dirty and refresh() will
+    reload them in bulk before the next scheduling pass. The workers are few
+    and can be updated by other processes (like the job limit): refresh()
+    reloads all of them.
+
+    The database remains the reference: devices are still locked and checked
+    before scheduling a job. A stale index can only delay the scheduling until
+    the next event or reconciliation.
+    """
+
+    WORKER_FIELDS = ["hostname", "state", "job_limit"]
+    DEVICE_FIELDS = ["hostname", "device_type_id", "worker_host_id", "state", "health"]
+    JOB_FIELDS = [
+        "id",
+        "requested_device_type_id",
+        "state",
+        "priority",
+        "submit_time",
+        "target_group",
+    ]
+    # Number of jobs loaded at once by pending_jobs()
+    CHUNK_SIZE = 1000
+
+    def __init__(self):
+        self.workers = {}
+        self.devices = {}
+        self.available = {}
+        self.busy = {}
+        self.jobs = {}
+        self.queues = {}
+        self.dirty_devices = set()
+        self.dirty_jobs = set()
+        self.last_reconcile = None
+
+    def connect(self):
+        """
+        Track the objects saved by the current process.
+        """
+        post_save.connect(
+            self._device_saved,
+            sender=Device,
+            weak=False,
+            dispatch_uid="scheduler_state_device",
+        )
+        post_save.connect(
+            self._job_saved,
+            sender=TestJob,
+            weak=False,
+            dispatch_uid="scheduler_state_testjob",
+        )
+
+    def _device_saved(self, sender, **kwargs):
+        self.device_changed(kwargs["instance"].hostname)
+
+    def _job_saved(self, sender, **kwargs):
+        self.job_changed(kwargs["instance"].id)
+
+    def device_changed(self, hostname):
+        self.dirty_devices.add(hostname)
+
+    def job_changed(self, job_id):
+        self.dirty_jobs.add(job_id)
+
+    @classmethod
+    def _pending_jobs_query(cls):
+        jobs = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+        )
+        jobs = jobs.filter(actual_device__isnull=True)
+        return jobs.filter(requested_device_type__isnull=False)
+
+    def _update_device(self, hostname, device):
+        old = self.devices.pop(hostname, None)
+        if old is not None:
+            self.available.get(old["device_type_id"], set()).discard(hostname)
+            self.busy.get(old["worker_host_id"], set()).discard(hostname)
+        if device is None:
+            return
+
+        self.devices[hostname] = device
+        if device["state"] in [Device.STATE_RESERVED, Device.STATE_RUNNING]:
+            self.busy.setdefault(device["worker_host_id"], set()).add(hostname)
+        elif device["health"] in [
+            Device.HEALTH_GOOD,
+            Device.HEALTH_UNKNOWN,
+            Device.HEALTH_LOOPING,
+        ]:
+            self.available.setdefault(device["device_type_id"], set()).add(hostname)
+
+    def _update_job(self, job_id, job):
+        old = self.jobs.pop(job_id, None)
+        if old is not None:
+            queue = self.queues[old[0]]
+            del queue[bisect.bisect_left(queue, old[1])]
+        if job is None:
+            return
+
+        # Same order as schedule_jobs_for_device: "-state", "-priority",
+        # "submit_time", "target_group", "id" with NULL target_group last
+        key = (
+            -job["state"],
+            -job["priority"],
+            job["submit_time"],
+            job["target_group"] is None,
+            job["target_group"] or "",
+            job["id"],
+        )
+        dt_name = job["requested_device_type_id"]
+        bisect.insort(self.queues.setdefault(dt_name, []), key)
+        self.jobs[job_id] = (dt_name, key)
+
+    def _load_workers(self):
+        self.workers = {
+            w["hostname"]: w for w in Worker.objects.values(*self.WORKER_FIELDS)
+        }
+
+    def reconcile(self):
+        """
+        Reload the whole index from the database.
+        """
+        self.__init__()
+        self._load_workers()
+        for device in Device.objects.values(*self.DEVICE_FIELDS):
+            self._update_device(device["hostname"], device)
+        jobs = self._pending_jobs_query().values(*self.JOB_FIELDS)
+        for job in jobs.iterator():
+            self._update_job(job["id"], job)
+        self.last_reconcile = time.monotonic()
+
+    def refresh(self):
+        """
+        Reload the workers and the objects that changed since the last call.
+        """
+        self._load_workers()
+
+        if self.dirty_devices:
+            query = Device.objects.filter(hostname__in=self.dirty_devices)
+            devices = {d["hostname"]: d for d in query.values(*self.DEVICE_FIELDS)}
+            for hostname in self.dirty_devices:
+                self._update_device(hostname, devices.get(hostname))
+            self.dirty_devices = set()
+
+        if self.dirty_jobs:
+            query = self._pending_jobs_query().filter(id__in=self.dirty_jobs)
+            jobs = {j["id"]: j for j in query.values(*self.JOB_FIELDS)}
+            for job_id in self.dirty_jobs:
+                self._update_job(job_id, jobs.get(job_id))
+            self.dirty_jobs = set()
+
+    def _is_online(self, hostname):
+        worker = self.workers.get(hostname)
+        return worker is not None and worker["state"] == Worker.STATE_ONLINE
+
+    def available_devices(self, dt_name):
+        """
+        Hostnames of the idle devices, attached to an online worker.
+        """
+        return sorted(
+            hostname
+            for hostname in self.available.get(dt_name, [])
+            if self._is_online(self.devices[hostname]["worker_host_id"])
+        )
+
+    def device_types(self):
+        """
+        Names of the device-types with at least one available device.
+        """
+        return {
+            dt_name for dt_name in self.available if self.available_devices(dt_name)
+        }
+
+    def has_pending_jobs(self, dt_name):
+        return bool(self.queues.get(dt_name))
+
+    def pending_jobs(self, dt_name):
+        """
+        Iterate over the pending jobs of the given device-type, in scheduling
+        order. Jobs are loaded by chunks and checked against the database.
+        """
+        queue = self.queues.get(dt_name, [])
+        for index in range(0, len(queue), self.CHUNK_SIZE):
+            ids = [key[-1] for key in queue[index : index + self.CHUNK_SIZE]]
+            jobs = load_jobs(self._pending_jobs_query().filter(id__in=ids))
+            jobs = {job.id: job for job in jobs}
+            for job_id in ids:
+                if job_id in jobs:
+                    yield jobs[job_id]
+
+    def worker_summary(self):
+        """
+        Same as worker_summary() but without querying the database.
+        """
+        return {
+            hostname: {
+                "max": worker["job_limit"],
+                "busy": len(self.busy.get(hostname, [])),
+            }
+            for (hostname, worker) in self.workers.items()
+        }
+
+
+class SubmitPermissions:
+    """
+    Devices of a device-type that each submitter can submit to. The devices
+    are checked all at once, the first time a submitter is seen in a
+    scheduling pass.
+    """
+
+    def __init__(self, devices):
+        self.devices = devices
+        # Permitted devices (hostnames), by submitter
+        self.permitted = {}
+
+    def can_submit(self, device, user):
+        if user.pk not in self.permitted:
+            self.permitted[user.pk] = {
+                d.pk
+                for d in filter_permitted(user, Device.SUBMIT_PERMISSION, self.devices)
+            }
+        return device.pk in self.permitted[user.pk]
+
+
+class PendingJobs:
+    """
+    Pending jobs of a device-type, loaded once per scheduling pass and shared
+    by every device of this device-type.
+    """
+
+    CHUNK_SIZE = 1000
+
+    def __init__(self, jobs):
+        self.iterator = iter(jobs)
+        self.jobs = []
+        self.scheduled = set()
+        # Tags (ids) required by each job
+        self.tags = {}
+
+    def _load(self):
+        jobs = list(itertools.islice(self.iterator, self.CHUNK_SIZE))
+        tags = {job.id: set() for job in jobs}
+        query = TestJob.tags.through.objects.filter(testjob_id__in=tags.keys())
+        for (job_id, tag_id) in query.values_list("testjob_id", "tag_id"):
+            tags[job_id].add(tag_id)
+        self.tags.update(tags)
+        self.jobs.extend(jobs)
+        return bool(jobs)
+
+    def __iter__(self):
+        index = 0
+        while True:
+            if index == len(self.jobs) and not self._load():
+                return
+            job = self.jobs[index]
+            index += 1
+            if job.id not in self.scheduled:
+                yield job
+
+
+def load_jobs(query):
+    """
+    Load the jobs with everything needed to check their eligibility, without
+    the (large) job definitions.
+    """
+    query = query.select_related("submitter")
+    return query.defer("definition", "original_definition", "multinode_definition")
+
+
 def worker_summary():
     query = Worker.objects.all()
     query = query.values("hostname", "job_limit")
@@ -54,13 +343,25 @@ def worker_summary():
     return ret
 
 
-def schedule(logger, available_dt=None):
-    (available_devices, jobs) = schedule_health_checks(logger, available_dt)
-    jobs.extend(schedule_jobs(logger, available_devices))
+def schedule(logger, available_dt=None, state=None):
+    if state is not None:
+        state.refresh()
+        # Only consider the device-types with some available devices
+        device_types = state.device_types()
+        if available_dt:
+            device_types &= set(available_dt)
+        if not device_types:
+            return []
+        available_dt = device_types
+
+    (available_devices, jobs) = schedule_health_checks(logger, available_dt, state)
+    # The permissions are loaded once for the whole pass
+    with permission_cache():
+        jobs.extend(schedule_jobs(logger, available_devices, state))
     return jobs
 
 
-def schedule_health_checks(logger, available_dt=None):
+def schedule_health_checks(logger, available_dt=None, state=None):
     logger.info("scheduling health checks:")
     available_devices = {}
     jobs = []
@@ -88,7 +389,7 @@ def schedule_health_checks(logger, available_dt=None):
                 (
                     available_devices[dt.name],
                     new_jobs,
-                ) = schedule_health_checks_for_device_type(logger, dt)
+                ) = schedule_health_checks_for_device_type(logger, dt, state)
                 jobs.extend(new_jobs)
 
     # Print disabled device types
@@ -98,16 +399,39 @@ def schedule_health_checks(logger, available_dt=None):
     return (available_devices, jobs)
 
 
-def schedule_health_checks_for_device_type(logger, dt):
+def schedule_health_checks_for_device_type(logger, dt, state=None):
     devices = dt.device_set.select_for_update()
     devices = devices.filter(state=Device.STATE_IDLE)
     devices = devices.filter(worker_host__state=Worker.STATE_ONLINE)
     devices = devices.filter(
         health__in=[Device.HEALTH_GOOD, Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]
     )
-    devices = devices.order_by("hostname")
+    if state is not None:
+        # Only lock the devices that the index considers as available
+        devices = devices.filter(hostname__in=state.available_devices(dt.name))
+    devices = devices.select_related("worker_host").order_by("hostname")
+
+    # Compute the submit time of the last health-check (and the number of
+    # jobs since then) for every device in the same query.
+    last_hc = TestJob.objects.filter(pk=OuterRef("last_health_report_job_id"))
+    devices = devices.annotate(
+        last_hc_submit_time=Subquery(last_hc.values("submit_time")[:1])
+    )
+    if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
+        jobs_since_hc = TestJob.objects.filter(
+            actual_device=OuterRef("pk"),
+            health_check=False,
+            start_time__gte=OuterRef("last_hc_submit_time"),
+        )
+        jobs_since_hc = jobs_since_hc.order_by().values("actual_device")
+        jobs_since_hc = jobs_since_hc.annotate(count=Count("id")).values("count")
+        devices = devices.annotate(
+            jobs_since_hc=Coalesce(
+                Subquery(jobs_since_hc, output_field=IntegerField()), 0
+            )
+        )
 
-    workers_limit = worker_summary()
+    workers_limit = worker_summary() if state is None else state.worker_summary()
 
     print_header = True
     available_devices = []
@@ -138,21 +462,16 @@ def schedule_health_checks_for_device_type(logger, dt):
         scheduling = False
         if device.health in [Device.HEALTH_UNKNOWN, Device.HEALTH_LOOPING]:
             scheduling = True
-        elif device.last_health_report_job is None:
+        elif device.last_hc_submit_time is None:
             scheduling = True
         else:
-            submit_time = device.last_health_report_job.submit_time
             if dt.health_denominator == DeviceType.HEALTH_PER_JOB:
-                count = device.testjobs.filter(
-                    health_check=False, start_time__gte=submit_time
-                ).count()
-
-                scheduling = count >= dt.health_frequency
+                scheduling = device.jobs_since_hc >= dt.health_frequency
             else:
                 frequency = datetime.timedelta(hours=dt.health_frequency)
                 now = timezone.now()
 
-                scheduling = submit_time + frequency < now
+                scheduling = device.last_hc_submit_time + frequency < now
 
         if not scheduling:
             available_devices.append(device.hostname)
@@ -187,6 +506,8 @@ def schedule_health_checks_for_device_type(logger, dt):
         try:
             jobs.append(schedule_health_check(device, health_check))
             workers_limit[device.worker_host.hostname]["busy"] += 1
+            if state is not None:
+                state.device_changed(device.hostname)
         except Exception as exc:
             # If the health check cannot be schedule, set health to BAD to exclude the device
             logger.error("  |--> Unable to schedule health check")
@@ -219,16 +540,21 @@ def schedule_health_check(device, definition):
     return job.id
 
 
-def schedule_jobs(logger, available_devices):
+def schedule_jobs(logger, available_devices, state=None):
     logger.info("scheduling jobs:")
     jobs = []
     for dt in DeviceType.objects.all().order_by("name"):
         # Check that some devices are available for this device-type
         if not available_devices.get(dt.name):
             continue
+        # Skip device-types without any pending job
+        if state is not None and not state.has_pending_jobs(dt.name):
+            continue
         with transaction.atomic():
             jobs.extend(
-                schedule_jobs_for_device_type(logger, dt, available_devices[dt.name])
+                schedule_jobs_for_device_type(
+                    logger, dt, available_devices[dt.name], state
+                )
             )
 
     with transaction.atomic():
@@ -237,7 +563,7 @@ def schedule_jobs(logger, available_devices):
     return jobs
 
 
-def schedule_jobs_for_device_type(logger, dt, available_devices):
+def schedule_jobs_for_device_type(logger, dt, available_devices, state=None):
     logger.debug("- %s", dt.name)
 
     devices = dt.device_set.select_for_update()
@@ -249,7 +575,23 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
     # never be used.
     devices = devices.order_by("?")
 
-    workers_limit = worker_summary()
+    workers_limit = worker_summary() if state is None else state.worker_summary()
+
+    if state is None:
+        pending_jobs = TestJob.objects.filter(
+            state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
+        )
+        pending_jobs = pending_jobs.filter(actual_device__isnull=True)
+        pending_jobs = pending_jobs.filter(requested_device_type__pk=dt.pk)
+        pending_jobs = pending_jobs.order_by(
+            "-state", "-priority", "submit_time", "target_group", "id"
+        )
+        pending_jobs = PendingJobs(load_jobs(pending_jobs))
+    else:
+        pending_jobs = PendingJobs(state.pending_jobs(dt.name))
+
+    devices = list(devices)
+    permissions = SubmitPermissions(devices)
 
     jobs = []
     for device in devices:
@@ -290,33 +632,36 @@ def schedule_jobs_for_device_type(logger, dt, available_devices):
             )
             continue
 
-        new_job = schedule_jobs_for_device(logger, device)
+        new_job = schedule_jobs_for_device(logger, device, pending_jobs, permissions)
         if new_job is not None:
             jobs.append(new_job)
             workers_limit[device.worker_host.hostname]["busy"] += 1
+            if state is not None:
+                state.device_changed(device.hostname)
+                state.job_changed(new_job)
     return jobs
 
 
-def schedule_jobs_for_device(logger, device):
-    jobs = TestJob.objects.filter(
-        state__in=[TestJob.STATE_SUBMITTED, TestJob.STATE_SCHEDULING]
-    )
-    jobs = jobs.filter(actual_device__isnull=True)
-    jobs = jobs.filter(requested_device_type__pk=device.device_type.pk)
-    jobs = jobs.select_related("submitter")
-    jobs = jobs.order_by("-state", "-priority", "submit_time", "target_group", "id")
+def schedule_jobs_for_device(logger, device, jobs, permissions=None):
+    """
+    Schedule the first eligible job for this device.
+
+    :param jobs: the PendingJobs of the device-type
+    :param permissions: the SubmitPermissions of the device-type
+    """
+    if permissions is None:
+        permissions = SubmitPermissions([device])
 
-    device_tags = set(device.tags.all())
+    device_tags = set(device.tags.values_list("id", flat=True))
     for job in jobs:
-        if not device.can_submit(job.submitter):
+        if not permissions.can_submit(device, job.submitter):
             continue
 
-        job_tags = set(job.tags.all())
-        if not job_tags.issubset(device_tags):
+        if not device_tags.issuperset(jobs.tags[job.id]):
             continue
 
-        job_dict = yaml_safe_load(job.definition)
-        if "protocols" in job_dict and "lava-vland" in job_dict["protocols"]:
+        if job.requires_vland:
+            job_dict = yaml_safe_load(job.definition)
             if not match_vlan_interface(device, job_dict):
                 continue
 
@@ -333,6 +678,7 @@ def schedule_jobs_for_device(logger, device):
         else:
             job.go_state_scheduled(device)
         job.save()
+        jobs.scheduled.add(job.id)
         return job.id
     return None
 
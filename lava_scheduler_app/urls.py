@@ -53,6 +53,7 @@ from lava_scheduler_app.views import (
     job_errors,
     job_log_file_plain,
     job_log_incremental,
+    job_log_stream,
     job_timing,
     job_resubmit,
     job_status,
@@ -206,6 +207,11 @@ urlpatterns = [
         job_log_incremental,
         name="lava.scheduler.job.log_incremental",
     ),
+    url(
+        r"^job/(?P<pk>[0-9]+|[0-9]+\.[0-9]+)/log_stream$",
+        job_log_stream,
+        name="lava.scheduler.job.log_stream",
+    ),
     url(
         r"^job/(?P<pk>[0-9]+|[0-9]+\.[0-9]+)/job_data$",
         job_fetch_data,
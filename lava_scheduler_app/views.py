@@ -26,7 +26,8 @@ import logging
 import os
 import simplejson
 import tarfile
-import re
+import select
+import time
 import voluptuous
 import yaml
 
@@ -48,6 +49,7 @@ from django.http import (
     HttpResponseForbidden,
     HttpResponseRedirect,
     JsonResponse,
+    StreamingHttpResponse,
 )
 from django.shortcuts import get_object_or_404, redirect, render
 from django.db.models import Q
@@ -56,9 +58,10 @@ from django.utils.timesince import timeuntil
 from django.views.decorators.http import require_POST
 from django_tables2 import RequestConfig
 
-from lava_common.compat import yaml_load, yaml_safe_load
+from lava_common.compat import yaml_safe_load
 from lava_common.schemas import validate
 
+from lava_server.cmdutils import read_inotify_events, watch_directory
 from lava_server.views import index as lava_index
 from lava_server.bread_crumbs import BreadCrumb, BreadCrumbTrail
 from lava_server.compat import djt2_paginator_class
@@ -78,7 +81,12 @@ from lava_scheduler_app.dbutils import (
     testjob_submission,
     validate_job,
 )
-from lava_scheduler_app.logutils import logs_instance
+from lava_scheduler_app.logutils import (
+    compute_timing,
+    logs_instance,
+    parse_lines,
+    read_timing,
+)
 from lava_scheduler_app.templatetags.utils import udecode
 
 from lava_server.lavatable import LavaView
@@ -122,6 +130,10 @@ from lava_scheduler_app.tables import (
 # The only functions which need to go in this file are those directly
 # referenced in urls.py - other support functions can go in tables.py or similar.
 
+# Number of log lines rendered by job_detail and returned by every call to
+# job_log_incremental
+LOG_WINDOW = 2000
+
 
 def _str_to_bool(string):
     return string.lower() in ["1", "true", "yes"]
@@ -1278,31 +1290,21 @@ def job_detail(request, pk):
         "validation_errors": validation_errors,
     }
 
+    # Only render the first lines, the others are loaded by the browser
+    log_data = []
+    log_lines = 0
+    invalid_log_data = False
     try:
         job_file_size = logs_instance.size(job)
         if job_file_size is not None and job_file_size >= job.size_limit:
-            log_data = []
             data["size_warning"] = True
         else:
-            log_data = logs_instance.read(job)
-            log_data = yaml_load(log_data)
+            (log_data, invalid_log_data) = _parse_log_lines(
+                job, logs_instance.read(job, 0, LOG_WINDOW)
+            )
+            log_lines = logs_instance.line_count(job)
     except OSError:
-        log_data = []
-    except yaml.YAMLError:
-        log_data = None
-
-    if log_data:
-        test_case_count = TestCase.objects.filter(suite__job=job).count()
-        if test_case_count <= settings.TESTCASE_COUNT_LIMIT:
-            results = {
-                (t.suite.name, t.name): t.id
-                for t in TestCase.objects.filter(suite__job=job).select_related("suite")
-            }
-            # list all related results
-            for line in [line for line in log_data if line["lvl"] == "results"]:
-                key = (line["msg"].get("definition"), line["msg"].get("case"))
-                if key in results:
-                    line["msg"]["case_id"] = results[key]
+        pass
 
     # Get lava.job result if available
     lava_job_result = None
@@ -1316,8 +1318,11 @@ def job_detail(request, pk):
 
     data.update(
         {
-            "log_data": log_data if log_data else [],
-            "invalid_log_data": log_data is None,
+            "log_data": log_data,
+            "log_lines": log_lines,
+            "log_window": LOG_WINDOW,
+            "log_streaming": settings.LOG_STREAMING,
+            "invalid_log_data": invalid_log_data,
             "lava_job_result": lava_job_result,
         }
     )
@@ -1528,77 +1533,13 @@ def job_status(request, pk):
 def job_timing(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
     try:
-        data = logs_instance.read(job)
-        logs = yaml_load(data)
+        # Save the timings of finished jobs that predate the timing file
+        entries = read_timing(job, save=job.state == TestJob.STATE_FINISHED)
     except OSError:
         raise Http404
 
-    # start and end patterns
-    pattern_start = re.compile(
-        "^start: (?P<level>[\\d.]+) (?P<action>[\\w_-]+) \\(timeout (?P<timeout>\\d+:\\d+:\\d+)\\)"
-    )
-    pattern_end = re.compile(
-        "^end: (?P<level>[\\d.]+) (?P<action>[\\w_-]+) \\(duration (?P<duration>\\d+:\\d+:\\d+)\\)"
-    )
-
-    timings = {}
-    total_duration = 0
-    max_duration = 0
-    summary = []
-    for line in logs:
-        # Only parse debug and info levels
-        if line["lvl"] not in ["debug", "info"]:
-            continue
-
-        # Will raise if the log message is a python object
-        try:
-            match = pattern_start.match(line["msg"])
-        except TypeError:
-            continue
-
-        if match is not None:
-            d = match.groupdict()
-            parts = d["timeout"].split(":")
-            timeout = float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
-            timings[d["level"]] = {"name": d["action"], "timeout": float(timeout)}
-            continue
-
-        # No need to catch TypeError here as we know it's a string
-        match = pattern_end.match(line["msg"])
-        if match is not None:
-            d = match.groupdict()
-            # TODO: validate does not have a proper start line
-            if d["action"] == "validate":
-                continue
-            level = d["level"]
-            parts = d["duration"].split(":")
-            duration = float(parts[0]) * 3600 + float(parts[1]) * 60 + float(parts[2])
-            # We create the entry because with some timeout, the start line
-            # might be missing.
-            timings.setdefault(level, {})["duration"] = duration
-
-            max_duration = max(max_duration, duration)
-            if "." not in level:
-                total_duration += duration
-                summary.append([d["action"], duration, 0])
-
-    levels = sorted(timings.keys())
-
-    # Construct the report
-    pipeline = []
-    for lvl in levels:
-        duration = timings[lvl].get("duration", 0.0)
-        timeout = timings[lvl].get("timeout", 0.0)
-        name = timings[lvl].get("name", "???")
-        pipeline.append(
-            (lvl, name, duration, timeout, bool(duration >= (timeout * 0.85)))
-        )
-
-    # Compute the percentage
-    if total_duration:
-        for index, action in enumerate(summary):
-            summary[index][2] = action[1] / total_duration * 100
-
+    timings = compute_timing(entries)
+    pipeline = timings["pipeline"]
     if not pipeline:
         response_dict = {"timing": "", "graph": []}
     else:
@@ -1607,10 +1548,10 @@ def job_timing(request, pk):
             {
                 "job": job,
                 "pipeline": pipeline,
-                "summary": summary,
-                "total_duration": total_duration,
-                "mean_duration": total_duration / len(pipeline),
-                "max_duration": max_duration,
+                "summary": timings["summary"],
+                "total_duration": timings["total_duration"],
+                "mean_duration": timings["total_duration"] / len(pipeline),
+                "max_duration": timings["max_duration"],
             },
         )
 
@@ -1658,11 +1599,45 @@ def job_log_file_plain(request, pk):
         raise Http404
 
 
+def _parse_log_lines(job, data):
+    """
+    Parse the log lines and add the test case ids to the results.
+    Return the list of lines and True if some lines are invalid.
+    """
+    lines = []
+    invalid = False
+    for (text, line) in parse_lines(data):
+        if line is None:
+            # Keep the line to keep the line numbers
+            invalid = True
+            line = {"dt": "", "lvl": "error", "msg": text}
+        lines.append(line)
+
+    results = [
+        line
+        for line in lines
+        if line["lvl"] == "results" and isinstance(line["msg"], dict)
+    ]
+    if results:
+        names = {line["msg"].get("case") for line in results}
+        case_ids = {
+            (suite, name): case_id
+            for (suite, name, case_id) in TestCase.objects.filter(
+                suite__job=job, name__in=names
+            ).values_list("suite__name", "name", "id")
+        }
+        for line in results:
+            key = (line["msg"].get("definition"), line["msg"].get("case"))
+            if key in case_ids:
+                line["msg"]["case_id"] = case_ids[key]
+    return (lines, invalid)
+
+
 def job_log_incremental(request, pk):
     job = get_restricted_job(request.user, pk, request=request)
     # Start from this line
     try:
-        first_line = int(request.GET.get("line", 0))
+        first_line = max(0, int(request.GET.get("line", 0)))
     except ValueError:
         first_line = 0
 
@@ -1673,24 +1648,12 @@ def job_log_incremental(request, pk):
         return response
 
     try:
-        data = logs_instance.read(job, first_line)
-        data = yaml_load(data)
-        # When reaching EOF, yaml.load does return None instead of []
-        if not data:
-            data = []
-        else:
-            for line in data:
-                line["msg"] = udecode(line["msg"])
-                if line["lvl"] == "results":
-                    case_id = TestCase.objects.filter(
-                        suite__job=job,
-                        suite__name=line["msg"]["definition"],
-                        name=line["msg"]["case"],
-                    ).values_list("id", flat=True)
-                    if case_id:
-                        line["msg"]["case_id"] = case_id[0]
-
-    except (OSError, StopIteration, yaml.YAMLError):
+        (data, _) = _parse_log_lines(
+            job, logs_instance.read(job, first_line, first_line + LOG_WINDOW)
+        )
+        for line in data:
+            line["msg"] = udecode(line["msg"])
+    except OSError:
         data = []
 
     response = HttpResponse(simplejson.dumps(data), content_type="application/json")
@@ -1701,6 +1664,92 @@ def job_log_incremental(request, pk):
     return response
 
 
+def _stream_log_lines(job, first_line):
+    """
+    Generate the server-sent events for the job logs, starting at first_line.
+
+    The log lines are sent by windows of LOG_WINDOW lines ("lines" events).
+    The id of each event is the number of the next line, so the browser
+    resumes at the right line when reconnecting. The generator then waits for
+    lava-logs to append some lines, using inotify when available.
+    """
+    # Reconnect quickly when the server closes the stream
+    yield "retry: 1000\n\n"
+
+    deadline = time.monotonic() + settings.LOG_STREAM_DURATION
+    inotify_fd = watch_directory(job.output_dir)
+    try:
+        while True:
+            # Check the state before reading, so the lines written before
+            # the end of the job are always sent
+            job.refresh_from_db(fields=["state"])
+            finished = job.state == TestJob.STATE_FINISHED
+
+            try:
+                (data, _) = _parse_log_lines(
+                    job, logs_instance.read(job, first_line, first_line + LOG_WINDOW)
+                )
+            except OSError:
+                data = []
+            for line in data:
+                line["msg"] = udecode(line["msg"])
+
+            if data:
+                first_line += len(data)
+                yield "id: %d\nevent: lines\ndata: %s\n\n" % (
+                    first_line,
+                    simplejson.dumps(data),
+                )
+                if len(data) >= LOG_WINDOW:
+                    continue
+            if finished:
+                yield "event: finished\ndata: \n\n"
+                return
+
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return
+            # Wait for lava-logs to write some lines. The job state is only
+            # written to the database, so check it every few seconds.
+            timeout = min(timeout, 5)
+            if inotify_fd is None:
+                time.sleep(timeout)
+            elif select.select([inotify_fd], [], [], timeout)[0]:
+                read_inotify_events(inotify_fd)
+            else:
+                # Keep the connection alive
+                yield ":\n\n"
+    finally:
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+
+def job_log_stream(request, pk):
+    job = get_restricted_job(request.user, pk, request=request)
+    # Start from this line or resume after the last event received
+    try:
+        first_line = int(
+            request.META.get("HTTP_LAST_EVENT_ID", request.GET.get("line", 0))
+        )
+    except ValueError:
+        first_line = 0
+    first_line = max(0, first_line)
+
+    job_file_size = logs_instance.size(job)
+    if job_file_size is not None and job_file_size >= job.size_limit:
+        response = HttpResponse(
+            "event: size-warning\ndata: \n\n", content_type="text/event-stream"
+        )
+    else:
+        response = StreamingHttpResponse(
+            _stream_log_lines(job, first_line), content_type="text/event-stream"
+        )
+    response["Cache-Control"] = "no-cache"
+    # Do not buffer the events in the reverse proxies
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @transaction.atomic
 def job_cancel(request, pk):
     job = get_restricted_job(request.user, pk, request=request, for_update=True)
@@ -27,6 +27,7 @@ import logging.handlers
 import os
 import pwd
 import signal
+import struct
 
 from django.core.management.base import BaseCommand
 
@@ -158,5 +159,32 @@ def watch_directory(directory):
     # create the inotify file descriptor
     inotify_fd = libc.inotify_init()
     # watch the "test" directory
+    if inotify_fd == -1:
+        return None
     ret = libc.inotify_add_watch(inotify_fd, directory.encode("utf-8"), IN_EVENTS)
-    return None if ret == -1 else inotify_fd
+    if ret == -1:
+        os.close(inotify_fd)
+        return None
+    return inotify_fd
+
+
+def read_inotify_events(inotify_fd):
+    # Read the pending inotify events and return the name of the modified
+    # files. The name is None for events on the directory itself or when some
+    # events were lost.
+    IN_Q_OVERFLOW = 0x00004000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    names = []
+    data = os.read(inotify_fd, 65536)
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        (_, mask, _, length) = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = data[offset : offset + length].rstrip(b"\0").decode("utf-8", "replace")
+        offset += length
+        if mask & IN_Q_OVERFLOW or not name:
+            names.append(None)
+        else:
+            names.append(name)
+    return names
@@ -35,6 +35,7 @@ from django.utils import timezone
 
 from lava_common.compat import yaml_safe_load
 from lava_common.schemas import validate
+from lava_scheduler_app.logutils import TIMING_FILENAME, logs_instance, read_timing
 from lava_scheduler_app.models import TestJob
 from lava_server.compat import get_sub_parser_class
 
@@ -178,6 +179,45 @@ class Command(BaseCommand):
             help="Be nice with the system by sleeping regularly",
         )
 
+        timing = sub.add_parser(
+            "timing", help="Create the action timing files of the corresponding jobs"
+        )
+        timing.add_argument(
+            "--newer-than",
+            default=None,
+            type=str,
+            help="Only jobs newer than this. The time is of the "
+            "form: 1h (one hour) or 2d (two days). ",
+        )
+        timing.add_argument(
+            "--older-than",
+            default=None,
+            type=str,
+            help="Only jobs older than this. The time is of the "
+            "form: 1h (one hour) or 2d (two days). ",
+        )
+        timing.add_argument(
+            "--submitter", default=None, type=str, help="Filter jobs by submitter"
+        )
+        timing.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Recreate the existing timing files",
+        )
+        timing.add_argument(
+            "--dry-run",
+            default=False,
+            action="store_true",
+            help="Do not create any file, simulate the output",
+        )
+        timing.add_argument(
+            "--slow",
+            default=False,
+            action="store_true",
+            help="Be nice with the system by sleeping regularly",
+        )
+
     def handle(self, *_, **options):
         """ forward to the right sub-handler """
         if options["sub_command"] == "rm":
@@ -205,6 +245,15 @@ class Command(BaseCommand):
                 options["dry_run"],
                 options["slow"],
             )
+        elif options["sub_command"] == "timing":
+            self.handle_timing(
+                options["older_than"],
+                options["newer_than"],
+                options["submitter"],
+                options["force"],
+                options["dry_run"],
+                options["slow"],
+            )
 
     def handle_fail(self, job_id):
         try:
@@ -391,9 +440,8 @@ class Command(BaseCommand):
                     # Save the uncompressed size for later use
                     _create_output_size(base, len(data))
                     # Compresse the logs
-                    with lzma.open(str(base / "output.yaml.xz"), "wb") as f_out:
-                        f_out.write(data)
-                    chown(str(base / "output.yaml.xz"), "lavaserver", "lavaserver")
+                    for filename in logs_instance.compress(job, data):
+                        chown(str(base / filename), "lavaserver", "lavaserver")
                     # Remove the original file
                     (base / "output.yaml").unlink()
             except OSError as exc:
@@ -402,3 +450,63 @@ class Command(BaseCommand):
             if slow and index % 100 == 99:
                 self.stdout.write("sleeping 2s...")
                 time.sleep(2)
+
+    def handle_timing(self, older_than, newer_than, submitter, force, simulate, slow):
+        jobs = TestJob.objects.all().order_by("id").filter(state=TestJob.STATE_FINISHED)
+        if older_than is not None:
+            pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
+            match = pattern.match(older_than)
+            if match is None:
+                raise CommandError("Invalid older-than format")
+
+            if match.groupdict()["unit"] == "d":
+                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
+            else:
+                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
+            jobs = jobs.filter(end_time__lt=(timezone.now() - delta))
+
+        if newer_than is not None:
+            pattern = re.compile(r"^(?P<time>\d+)(?P<unit>(h|d))$")
+            match = pattern.match(newer_than)
+            if match is None:
+                raise CommandError("Invalid newer-than format")
+
+            if match.groupdict()["unit"] == "d":
+                delta = datetime.timedelta(days=int(match.groupdict()["time"]))
+            else:
+                delta = datetime.timedelta(hours=int(match.groupdict()["time"]))
+            jobs = jobs.filter(end_time__gt=(timezone.now() - delta))
+
+        if submitter is not None:
+            try:
+                user = User.objects.get(username=submitter)
+            except User.DoesNotExist:
+                raise CommandError("Unable to find submitter '%s'" % submitter)
+            jobs = jobs.filter(submitter=user)
+
+        self.stdout.write("Creating the timing files of %d jobs:" % jobs.count())
+        for (index, job) in enumerate(jobs):
+            filename = pathlib.Path(job.output_dir) / TIMING_FILENAME
+            if filename.exists() and not force:
+                self.stdout.write(
+                    "* %d (%s): %s [SKIP]" % (job.id, job.end_time, job.output_dir)
+                )
+                continue
+
+            self.stdout.write("* %d (%s): %s" % (job.id, job.end_time, job.output_dir))
+            try:
+                if not simulate:
+                    with contextlib.suppress(FileNotFoundError):
+                        filename.unlink()
+                    read_timing(job, save=True)
+                    if not filename.exists():
+                        raise OSError("can't write to %s" % filename)
+                    chown(str(filename), "lavaserver", "lavaserver")
+            except OSError as exc:
+                self.stderr.write(
+                    "  -> Unable to create the timing file: %s" % str(exc)
+                )
+
+            if slow and index % 100 == 99:
+                self.stdout.write("sleeping 2s...")
+                time.sleep(2)
@@ -19,10 +19,15 @@
 
 
 import contextlib
+import json
 import logging
 import os
+import shutil
+import signal
+import tempfile
 import time
 import yaml
+import zlib
 import zmq
 import zmq.auth
 from zmq.utils.strtypes import u
@@ -32,13 +37,14 @@ from django.db import connection, transaction
 from django.db.utils import DatabaseError, InterfaceError, OperationalError
 
 from lava_common.compat import yaml_load, yaml_dump
+from lava_common.log import json_to_yaml
 from lava_common.version import __version__
-from lava_results_app.models import TestCase
+from lava_results_app.models import TestCase, TestSuiteSummary
 from lava_server.cmdutils import LAVADaemonCommand, watch_directory
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.signals import send_event
 from lava_scheduler_app.utils import mkdir, get_encryption_settings
-from lava_scheduler_app.logutils import logs_instance
+from lava_scheduler_app.logutils import TIMING_FILENAME, logs_instance, timing_entry
 from lava_results_app.dbutils import map_scanned_results, create_metadata_store
 
 
@@ -47,27 +53,117 @@ FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
 TIMEOUT = 10
 BULK_CREATE_TIMEOUT = 10
 FD_TIMEOUT = 60
+STATS_INTERVAL = 1
+# Size of the write buffers when buffering is enabled
+BUFFER_SIZE = 64 * 1024
 
 
 class JobHandler:
-    def __init__(self, job):
+    def __init__(self, job, buffered=False):
         self.job = job
-        self.output = open(os.path.join(job.output_dir, "output.yaml"), "ab")
-        self.index = open(os.path.join(job.output_dir, "output.idx"), "ab")
+        # When buffered, the data is only written when calling flush() or when
+        # BUFFER_SIZE bytes are pending.
+        self.buffered = buffered
+        buffering = BUFFER_SIZE if buffered else -1
+        self.output = open(
+            os.path.join(job.output_dir, "output.yaml"), "ab", buffering=buffering
+        )
+        self.index = open(
+            os.path.join(job.output_dir, "output.idx"), "ab", buffering=buffering
+        )
         self.last_usage = time.time()
+        self.pending = 0
+        # Number of lines, including the buffered ones
+        self.lines = logs_instance.line_count(job)
+        # Markers are saved on disk in case of restart
         self.markers = {}
+        self.markers_filename = os.path.join(job.output_dir, "output.markers")
+        self.load_markers()
+        # The timing file is only created along with the logs: for the jobs
+        # started before lava-logs stored the timings, the file would miss the
+        # first actions and the timings are extracted from the logs instead.
+        self.timing_filename = os.path.join(job.output_dir, TIMING_FILENAME)
+        if self.lines == 0:
+            open(self.timing_filename, "a").close()
+        self.timing_enabled = os.path.exists(self.timing_filename)
 
     def write(self, message):
+        data = (message + "\n").encode("utf-8")
         logs_instance.write(
-            self.job, (message + "\n").encode("utf-8"), self.output, self.index
+            self.job, data, self.output, self.index, flush=not self.buffered
         )
+        self.lines += 1
+        if self.buffered:
+            self.pending += len(data)
+            # Every index entry is smaller than the corresponding line, so the
+            # index buffer is never written before the logs one.
+            if self.pending >= BUFFER_SIZE:
+                self.flush()
+
+    def flush(self, sync=False):
+        if self.pending or sync:
+            logs_instance.flush(self.job, self.output, self.index, sync)
+            self.pending = 0
 
     def line_count(self):
-        return logs_instance.line_count(self.job)
+        return self.lines
+
+    def load_markers(self):
+        with contextlib.suppress(FileNotFoundError):
+            with open(self.markers_filename, "r") as f_markers:
+                for data in f_markers:
+                    # Skip lines that were partially written
+                    with contextlib.suppress(TypeError, ValueError):
+                        (case, m_type, line) = json.loads(data)
+                        self.markers.setdefault(case, {})[m_type] = line
+
+    def marker(self, case, m_type):
+        # This is in fact the previous line
+        line = self.lines - 1
+        self.markers.setdefault(case, {})[m_type] = line
+        with open(self.markers_filename, "a") as f_markers:
+            f_markers.write(json.dumps([case, m_type, line]) + "\n")
+
+    def timing(self, value):
+        # Save the start and end of the actions, for the timing page
+        if not self.timing_enabled:
+            return
+        entry = timing_entry(self.lines - 1, value)
+        if entry is not None:
+            with open(self.timing_filename, "a") as f_timing:
+                f_timing.write(json.dumps(entry) + "\n")
 
     def close(self):
-        self.index.close()
+        # Close the logs before the index (see LogsFilesystem.flush)
         self.output.close()
+        self.index.close()
+
+
+class Shard:
+    """
+    A worker process as seen by the front process.
+    """
+
+    def __init__(self, index, pid, endpoint):
+        self.index = index
+        self.pid = pid
+        self.endpoint = endpoint
+        self.socket = None
+        # Messages forwarded to and handled by the worker
+        self.forwarded = 0
+        self.handled = 0
+        # Number of opened job logs
+        self.jobs = 0
+
+    def stats(self):
+        return {
+            "shard": self.index,
+            "pid": self.pid,
+            "forwarded": self.forwarded,
+            "handled": self.handled,
+            "lag": self.forwarded - self.handled,
+            "jobs": self.jobs,
+        }
 
 
 class Command(LAVADaemonCommand):
@@ -92,6 +188,17 @@ class Command(LAVADaemonCommand):
         # Master status
         self.last_ping = 0
         self.ping_interval = TIMEOUT
+        # Housekeeping
+        self.last_gc = 0
+        self.last_bulk_create = 0
+        self.last_flush = 0
+        # Write buffering
+        self.flush_interval = 0
+        self.poll_timeout = TIMEOUT
+        # Sharded mode
+        self.shards = []
+        self.shards_dir = None
+        self.stats_socket = None
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -127,6 +234,22 @@ class Command(LAVADaemonCommand):
             help="Directory for slaves certificates",
         )
 
+        logs = parser.add_argument_group("logs")
+        logs.add_argument(
+            "--shards",
+            default=1,
+            type=int,
+            help="Number of worker processes handling the logs. "
+            "The messages are dispatched by job id. Default: 1",
+        )
+        logs.add_argument(
+            "--flush-interval",
+            default=0,
+            type=float,
+            help="Buffer the job logs and write them at least every "
+            "FLUSH_INTERVAL seconds. Default: 0 (write every line)",
+        )
+
     def handle(self, *args, **options):
         # Initialize logging.
         self.setup_logging("lava-logs", options["level"], options["log_file"], FORMAT)
@@ -144,8 +267,33 @@ class Command(LAVADaemonCommand):
         with open(filename, "w") as output:
             yaml_dump(options, output)
 
+        if options["flush_interval"] > 0:
+            self.logger.info(
+                "[INIT] Buffering the job logs for %.2fs", options["flush_interval"]
+            )
+            self.flush_interval = options["flush_interval"]
+            self.poll_timeout = min(TIMEOUT, self.flush_interval)
+
+        # Remove the statistics of a previous run
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.stats_filename())
+
+        # Start the workers before creating any zmq context or thread
+        if options["shards"] > 1:
+            self.logger.info("[INIT] Starting %d shards", options["shards"])
+            self.start_shards(options["shards"])
+
         # Create the sockets
         context = zmq.Context()
+        if self.shards:
+            self.stats_socket = context.socket(zmq.PULL)
+            self.stats_socket.bind("ipc://%s/stats" % self.shards_dir)
+            for shard in self.shards:
+                shard.socket = context.socket(zmq.PUSH)
+                # Never block the front process because of a slow shard: the
+                # lag is reported in the statistics.
+                shard.socket.setsockopt(zmq.SNDHWM, 0)
+                shard.socket.bind(shard.endpoint)
         self.log_socket = context.socket(zmq.PULL)
         self.controler = context.socket(zmq.ROUTER)
         self.controler.setsockopt(zmq.IDENTITY, b"lava-logs")
@@ -205,6 +353,8 @@ class Command(LAVADaemonCommand):
         self.poller = zmq.Poller()
         self.poller.register(self.log_socket, zmq.POLLIN)
         self.poller.register(self.controler, zmq.POLLIN)
+        if self.stats_socket is not None:
+            self.poller.register(self.stats_socket, zmq.POLLIN)
         if self.inotify_fd is not None:
             self.poller.register(os.fdopen(self.inotify_fd), zmq.POLLIN)
 
@@ -232,6 +382,9 @@ class Command(LAVADaemonCommand):
         endpoint = u(self.log_socket.getsockopt(zmq.LAST_ENDPOINT))
         self.logger.debug("[EXIT] unbinding from '%s'", endpoint)
         self.log_socket.unbind(endpoint)
+        # Wait for the messages as long as without buffering. The buffered logs
+        # will be written when closing the files.
+        self.poll_timeout = TIMEOUT
 
         # Empty the queue
         try:
@@ -245,8 +398,11 @@ class Command(LAVADaemonCommand):
         finally:
             # Last flush
             self.flush_test_cases()
+            self.close_jobs()
             self.logger.info("[EXIT] Closing the logging socket: the queue is empty")
             self.log_socket.close()
+            if self.shards:
+                self.stop_shards()
             if encryption_settings["encrypt"]:
                 self.auth.stop()
             context.term()
@@ -255,61 +411,208 @@ class Command(LAVADaemonCommand):
         if not self.test_cases:
             return
 
-        # Try to save into the database
-        try:
-            TestCase.objects.bulk_create(self.test_cases)
-            self.logger.info("Saving %d test cases", len(self.test_cases))
-            self.test_cases = []
-        except DatabaseError as exc:
-            self.logger.error("Unable to flush the test cases")
-            self.logger.exception(exc)
-            self.logger.warning(
-                "Saving test cases one by one and dropping the faulty ones"
-            )
-            saved = 0
-            for tc in self.test_cases:
-                with contextlib.suppress(DatabaseError):
-                    tc.save()
-                    saved += 1
-            self.logger.info(
-                "%d test cases saved, %d dropped", saved, len(self.test_cases) - saved
-            )
+        # The test cases and the suite summaries are saved in the same
+        # transaction, so concurrent summaries do not count them twice.
+        with transaction.atomic():
+            # Try to save into the database
+            try:
+                with transaction.atomic():
+                    TestCase.objects.bulk_create(self.test_cases)
+                self.logger.info("Saving %d test cases", len(self.test_cases))
+                saved = self.test_cases
+            except DatabaseError as exc:
+                self.logger.error("Unable to flush the test cases")
+                self.logger.exception(exc)
+                self.logger.warning(
+                    "Saving test cases one by one and dropping the faulty ones"
+                )
+                saved = []
+                for tc in self.test_cases:
+                    with contextlib.suppress(DatabaseError), transaction.atomic():
+                        tc.save()
+                        saved.append(tc)
+                self.logger.info(
+                    "%d test cases saved, %d dropped",
+                    len(saved),
+                    len(self.test_cases) - len(saved),
+                )
             self.test_cases = []
 
+            # Update the suite summaries used by the charts
+            try:
+                with transaction.atomic():
+                    TestSuiteSummary.add(saved)
+            except DatabaseError as exc:
+                self.logger.error("Unable to update the test suite summaries")
+                self.logger.exception(exc)
+
+    def close_jobs(self):
+        for job in self.jobs.values():
+            job.close()
+        self.jobs = {}
+
+    def housekeeping(self, now):
+        # Write the buffered logs
+        if self.flush_interval and now - self.last_flush >= self.flush_interval:
+            self.last_flush = now
+            for job in self.jobs.values():
+                job.flush()
+
+        # Dump TestCase into the database
+        if now - self.last_bulk_create > BULK_CREATE_TIMEOUT:
+            self.last_bulk_create = now
+            self.flush_test_cases()
+
+        # Close old file handlers
+        if now - self.last_gc > FD_TIMEOUT:
+            self.last_gc = now
+            # Iterate while removing keys is not compatible with iterator
+            for job_id in list(self.jobs.keys()):
+                if now - self.jobs[job_id].last_usage > FD_TIMEOUT:
+                    self.logger.info("[%s] closing log file", job_id)
+                    self.jobs[job_id].close()
+                    del self.jobs[job_id]
+
     def main_loop(self):
-        last_gc = time.time()
-        last_bulk_create = time.time()
+        self.last_gc = time.time()
+        self.last_bulk_create = time.time()
 
         # Wait for messages
         # TODO: fix timeout computation
         while self.wait_for_messages(False):
             now = time.time()
 
-            # Dump TestCase into the database
-            if now - last_bulk_create > BULK_CREATE_TIMEOUT:
-                last_bulk_create = now
-                self.flush_test_cases()
-
-            # Close old file handlers
-            if now - last_gc > FD_TIMEOUT:
-                last_gc = now
-                # Iterate while removing keys is not compatible with iterator
-                for job_id in list(self.jobs.keys()):
-                    if now - self.jobs[job_id].last_usage > FD_TIMEOUT:
-                        self.logger.info("[%s] closing log file", job_id)
-                        self.jobs[job_id].close()
-                        del self.jobs[job_id]
+            self.housekeeping(now)
 
             # Ping the master
             if now - self.last_ping > self.ping_interval:
                 self.logger.debug("PING => master")
                 self.last_ping = now
                 self.controler.send_multipart([b"master", b"PING"])
+                if self.shards:
+                    self.dump_stats()
+                    if not self.check_shards():
+                        return
+
+    def stats_filename(self):
+        return os.path.join(settings.MEDIA_ROOT, "lava-logs-stats.yaml")
+
+    def dump_stats(self):
+        stats = [shard.stats() for shard in self.shards]
+        for data in stats:
+            self.logger.debug(
+                "[STATS] shard %d: lag=%d jobs=%d",
+                data["shard"],
+                data["lag"],
+                data["jobs"],
+            )
+        filename = self.stats_filename()
+        try:
+            with open(filename + ".tmp", "w") as output:
+                yaml_dump({"time": time.time(), "shards": stats}, output)
+            os.replace(filename + ".tmp", filename)
+        except OSError as exc:
+            self.logger.error("[STATS] Unable to dump the statistics: %s", exc)
+
+    def start_shards(self, count):
+        self.shards_dir = tempfile.mkdtemp(prefix="lava-logs-")
+        # The database connection should not be shared with the workers
+        connection.close()
+        for index in range(count):
+            endpoint = "ipc://%s/shard-%d" % (self.shards_dir, index)
+            pid = os.fork()
+            if pid == 0:
+                ret = 0
+                try:
+                    self.shard_loop(index, endpoint)
+                except BaseException as exc:
+                    self.logger.error("[SHARD %d] Unknown exception raised", index)
+                    self.logger.exception(exc)
+                    ret = 1
+                finally:
+                    # Do not run the code of the front process
+                    os._exit(ret)
+            self.logger.debug("[INIT] Shard %d: pid %d", index, pid)
+            self.shards.append(Shard(index, pid, endpoint))
+
+    def check_shards(self):
+        for shard in self.shards:
+            if shard.pid is None:
+                continue
+            (pid, _) = os.waitpid(shard.pid, os.WNOHANG)
+            if pid:
+                self.logger.error("[SHARD %d] Process died, leaving!", shard.index)
+                shard.pid = None
+                return False
+        return True
+
+    def stop_shards(self):
+        self.logger.info("[EXIT] Stopping the shards")
+        # The messages are handled in order so every forwarded message will be
+        # handled before STOP.
+        for shard in self.shards:
+            shard.socket.send_multipart([b"STOP"])
+        for shard in self.shards:
+            if shard.pid is not None:
+                os.waitpid(shard.pid, 0)
+            shard.socket.close(linger=0)
+            self.logger.debug("[EXIT] Shard %d stopped", shard.index)
+        self.stats_socket.close(linger=0)
+        shutil.rmtree(self.shards_dir, ignore_errors=True)
+
+    def shard_loop(self, index, endpoint):
+        # The front process is responsible for leaving cleanly: it will send
+        # STOP when every message has been forwarded.
+        for sig in [signal.SIGINT, signal.SIGTERM, signal.SIGQUIT]:
+            signal.signal(sig, signal.SIG_IGN)
+        front = os.getppid()
+
+        context = zmq.Context()
+        self.log_socket = context.socket(zmq.PULL)
+        self.log_socket.connect(endpoint)
+        stats = context.socket(zmq.PUSH)
+        stats.connect("ipc://%s/stats" % self.shards_dir)
+
+        handled = 0
+        last_stats = 0
+        # Only send the statistics when they change, so the front process can
+        # detect that the shards are idle.
+        sent = None
+        self.last_gc = time.time()
+        self.last_bulk_create = time.time()
+        while True:
+            if self.log_socket.poll(min(STATS_INTERVAL, self.poll_timeout) * 1000):
+                msg = self.log_socket.recv_multipart()
+                if msg == [b"STOP"]:
+                    break
+                try:
+                    self.log_message(msg)
+                except (OperationalError, InterfaceError):
+                    self.logger.info("[SHARD %d] database connection reset", index)
+                    connection.close()
+                handled += 1
+            elif os.getppid() != front:
+                self.logger.error("[SHARD %d] front process died, leaving", index)
+                break
+
+            now = time.time()
+            self.housekeeping(now)
+            current = [index, handled, len(self.jobs)]
+            if now - last_stats >= STATS_INTERVAL and current != sent:
+                last_stats = now
+                sent = current
+                stats.send_multipart([str(i).encode("utf-8") for i in current])
+
+        self.flush_test_cases()
+        self.close_jobs()
+        stats.close(linger=0)
+        self.log_socket.close(linger=0)
+        context.term()
 
     def wait_for_messages(self, leaving):
         try:
             try:
-                sockets = dict(self.poller.poll(TIMEOUT * 1000))
+                sockets = dict(self.poller.poll(self.poll_timeout * 1000))
             except zmq.error.ZMQError as exc:
                 self.logger.error("[POLL] zmq error: %s", str(exc))
                 return True
@@ -338,6 +641,11 @@ class Command(LAVADaemonCommand):
                 self.controler_socket()
                 return True
 
+            # Statistics from the shards
+            elif sockets.get(self.stats_socket) == zmq.POLLIN:
+                self.stats_socket_handler()
+                return True
+
             # Inotify socket
             if sockets.get(self.inotify_fd) == zmq.POLLIN:
                 os.read(self.inotify_fd, 4096)
@@ -363,8 +671,38 @@ class Command(LAVADaemonCommand):
 
     def logging_socket(self):
         msg = self.log_socket.recv_multipart()
+        if self.shards:
+            # Every message of a given job is handled by the same shard, in
+            # order.
+            try:
+                key = int(msg[0])
+            except ValueError:
+                key = zlib.crc32(msg[0])
+            shard = self.shards[key % len(self.shards)]
+            shard.socket.send_multipart(msg)
+            shard.forwarded += 1
+            return
+        self.log_message(msg)
+
+    def stats_socket_handler(self):
+        msg = self.stats_socket.recv_multipart()
+        try:
+            (index, handled, jobs) = (int(m) for m in msg)
+            shard = self.shards[index]
+        except (IndexError, ValueError):
+            self.logger.error("[STATS] Invalid message '%s'", msg)
+            return
+        shard.handled = handled
+        shard.jobs = jobs
+
+    def log_message(self, msg):
         try:
-            (job_id, message) = (u(m) for m in msg)
+            if len(msg) == 2:
+                (job_id, message) = (u(m) for m in msg)
+                (version, messages) = ("1", [message])
+            else:
+                (job_id, version) = (u(m) for m in msg[:2])
+                messages = [u(m) for m in msg[2:]]
         except UnicodeDecodeError:
             self.logger.error("[POLL] Invalid log message: can't be decoded")
             return
@@ -373,12 +711,31 @@ class Command(LAVADaemonCommand):
             self.logger.error("[POLL] failed to parse log message, skipping: %s", msg)
             return
 
-        try:
-            scanned = yaml_load(message)
-        except yaml.YAMLError:
-            self.logger.error("[%s] data are not valid YAML, dropping", job_id)
+        if version not in ["1", "2", "3"] or not messages:
+            self.logger.error(
+                "[%s] unknown log format version '%s', dropping", job_id, version
+            )
             return
 
+        # With version 3, the message is a batch of lines, in order
+        for message in messages:
+            if version == "1":
+                try:
+                    scanned = yaml_load(message)
+                except yaml.YAMLError:
+                    self.logger.error("[%s] data are not valid YAML, dropping", job_id)
+                    continue
+            else:
+                try:
+                    scanned = json.loads(message)
+                    # The logs are always stored as YAML
+                    message = json_to_yaml(scanned)
+                except ValueError:
+                    self.logger.error("[%s] data are not valid JSON, dropping", job_id)
+                    continue
+            self.log_line(job_id, message, scanned)
+
+    def log_line(self, job_id, message, scanned):
         # Look for "results" level
         try:
             message_lvl = scanned["lvl"]
@@ -406,7 +763,7 @@ class Command(LAVADaemonCommand):
             self.logger.info("[%s] receiving logs from a new job", job_id)
             # Create the sub directories (if needed)
             mkdir(job.output_dir)
-            self.jobs[job_id] = JobHandler(job)
+            self.jobs[job_id] = JobHandler(job, buffered=bool(self.flush_interval))
 
         # For 'event', send an event and log as 'debug'
         if message_lvl == "event":
@@ -415,23 +772,23 @@ class Command(LAVADaemonCommand):
             message_lvl = "debug"
         # For 'marker', save in the database and log as 'debug'
         elif message_lvl == "marker":
-            # TODO: save on the file system in case of lava-logs restart
             m_type = message_msg.get("type")
             case = message_msg.get("case")
             if m_type is None or case is None:
                 self.logger.error("[%s] invalid marker: %s", job_id, message_msg)
                 return
-            # This is in fact the previous line
-            line = self.jobs[job_id].line_count() - 1
-            self.jobs[job_id].markers.setdefault(case, {})[m_type] = line
+            self.jobs[job_id].flush()
+            self.jobs[job_id].marker(case, m_type)
             return
 
         # Mark the file handler as used
         self.jobs[job_id].last_usage = time.time()
         # The format is a list of dictionaries
         self.jobs[job_id].write("- %s" % message)
+        self.jobs[job_id].timing(scanned)
 
         if message_lvl == "results":
+            self.jobs[job_id].flush()
             try:
                 job = TestJob.objects.get(pk=job_id)
             except TestJob.DoesNotExist:
@@ -457,8 +814,9 @@ class Command(LAVADaemonCommand):
                 message_msg.get("definition") == "lava"
                 and message_msg.get("case") == "job"
             ):
-                # Flush cached test cases
+                # Flush cached test cases and sync the logs
                 self.flush_test_cases()
+                self.jobs[job_id].flush(sync=True)
 
                 if message_msg.get("result") == "pass":
                     health = TestJob.HEALTH_COMPLETE
@@ -36,14 +36,20 @@ from django.db.utils import OperationalError, InterfaceError
 from django.utils import timezone
 
 from lava_common.compat import yaml_dump, yaml_safe_dump, yaml_safe_load
+from lava_common.log import LOG_PROTOCOL_VERSION
 from lava_common.version import __version__
-from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.models import TestCase, TestSuite, TestSuiteSummary
 from lava_server.files import File
+from lava_scheduler_app.cache import device_cache
 from lava_scheduler_app.dbutils import parse_job_description
 from lava_scheduler_app.models import TestJob, Worker
-from lava_scheduler_app.scheduler import schedule
+from lava_scheduler_app.scheduler import schedule, SchedulerState
 from lava_scheduler_app.utils import mkdir, get_encryption_settings
-from lava_server.cmdutils import LAVADaemonCommand, watch_directory
+from lava_server.cmdutils import (
+    LAVADaemonCommand,
+    read_inotify_events,
+    watch_directory,
+)
 
 
 # Current version of the protocol
@@ -56,6 +62,8 @@ PROTOCOL_VERSION = 3
 PING_INTERVAL = 20
 DISPATCHER_TIMEOUT = 3 * PING_INTERVAL
 SCHEDULE_INTERVAL = 20
+# Full reload of the scheduler state from the database
+RECONCILE_INTERVAL = 300
 
 # Log format
 FORMAT = "%(asctime)-15s %(levelname)7s %(message)s"
@@ -140,11 +148,15 @@ class Command(LAVADaemonCommand):
         self.poller = None
         self.pipe_r = None
         self.inotify_fd = None
+        # Inotify file descriptors watching the device templates
+        self.templates_fds = {}
         # List of logs
         # List of known dispatchers. At startup do not load this from the
         # database. This will help to know if the slave as restarted or not.
         self.dispatchers = {"lava-logs": SlaveDispatcher("lava-logs", online=False)}
         self.events = {"canceling": set(), "available_dt": set()}
+        # In-memory index of devices, workers and queued jobs
+        self.scheduler_state = SchedulerState()
 
     def add_arguments(self, parser):
         super().add_arguments(parser)
@@ -262,12 +274,14 @@ class Command(LAVADaemonCommand):
             return True
 
         if topic.endswith(".testjob"):
+            self.scheduler_state.job_changed(int(data["job"]))
             if data["state"] == "Canceling":
                 self.events["canceling"].add(int(data["job"]))
             elif data["state"] == "Submitted":
                 if "device_type" in data:
                     self.events["available_dt"].add(data["device_type"])
         elif topic.endswith(".device"):
+            self.scheduler_state.device_changed(data["device"])
             if data["state"] == "Idle" and data["health"] in [
                 "Good",
                 "Unknown",
@@ -358,7 +372,11 @@ class Command(LAVADaemonCommand):
             )
             return
 
-        send_multipart_u(self.controler, [hostname, "HELLO_OK"])
+        # Announce the log format supported by lava-logs. Older slaves will
+        # ignore it and keep sending YAML.
+        send_multipart_u(
+            self.controler, [hostname, "HELLO_OK", str(LOG_PROTOCOL_VERSION)]
+        )
         # If the dispatcher is known and sent an HELLO, means that
         # the slave has restarted
         if hostname in self.dispatchers:
@@ -572,12 +590,13 @@ class Command(LAVADaemonCommand):
                     "result": "fail",
                 }
                 suite, _ = TestSuite.objects.get_or_create(name="lava", job=job)
-                TestCase.objects.create(
+                test_case = TestCase.objects.create(
                     name="job",
                     suite=suite,
                     result=TestCase.RESULT_FAIL,
-                    metadata=yaml_safe_dump(metadata),
+                    metadata=metadata,
                 )
+                TestSuiteSummary.add([test_case])
                 job.go_state_finished(TestJob.HEALTH_INCOMPLETE, True)
                 job.save()
 
@@ -603,6 +622,25 @@ class Command(LAVADaemonCommand):
             self.logger.info("[%d] CANCEL => %s", job.id, worker.hostname)
             send_multipart_u(self.controler, [worker.hostname, "CANCEL", str(job.id)])
 
+    def reconcile_scheduler_state(self):
+        """
+        Reload the scheduler state from the database when it's too old.
+        Without events, the state can only be kept up-to-date by reloading it.
+        """
+        last_reconcile = self.scheduler_state.last_reconcile
+        if (
+            last_reconcile is None
+            or not settings.EVENT_NOTIFICATION
+            or time.monotonic() - last_reconcile > RECONCILE_INTERVAL
+        ):
+            self.logger.debug("[STATE] Reconciling the scheduler state")
+            self.scheduler_state.reconcile()
+            self.logger.debug(
+                "[STATE] Device cache: %(entries)d entries, "
+                "%(hits)d hits, %(misses)d misses",
+                device_cache.stats(),
+            )
+
     def handle(self, *args, **options):
         # Initialize logging.
         self.setup_logging("lava-master", options["level"], options["log_file"], FORMAT)
@@ -690,10 +728,28 @@ class Command(LAVADaemonCommand):
         if self.inotify_fd is not None:
             self.poller.register(os.fdopen(self.inotify_fd), zmq.POLLIN)
 
+        # Watch the device templates to invalidate the device cache. When
+        # watching fails, the cache will check the files on every access.
+        directories = [settings.DEVICES_PATH, settings.HEALTH_CHECKS_PATH]
+        directories.extend(settings.DEVICE_TYPES_PATHS)
+        for directory in directories:
+            self.logger.debug("[INIT] Watching %s", directory)
+            fd = watch_directory(directory)
+            if fd is None:
+                self.logger.warning("[INIT] Unable to watch %s", directory)
+                continue
+            self.templates_fds[fd] = directory
+            self.poller.register(fd, zmq.POLLIN)
+        device_cache.watched = len(self.templates_fds) == len(directories)
+
         # Translate signals into zmq messages
         (self.pipe_r, _) = self.setup_zmq_signal_handler()
         self.poller.register(self.pipe_r, zmq.POLLIN)
 
+        # Keep the scheduler state up-to-date with the objects saved by
+        # lava-master itself. Other processes are tracked through the events.
+        self.scheduler_state.connect()
+
         self.logger.info("[INIT] Starting main loop")
         try:
             self.main_loop(options)
@@ -774,6 +830,17 @@ class Command(LAVADaemonCommand):
                             encryption_settings["slaves_certs"],
                         )
 
+                # Device templates
+                for (fd, directory) in self.templates_fds.items():
+                    if sockets.get(fd) == zmq.POLLIN:
+                        names = read_inotify_events(fd)
+                        if None in names:
+                            device_cache.clear()
+                        else:
+                            device_cache.invalidate(
+                                os.path.join(directory, name) for name in names
+                            )
+
                 # Check dispatchers status
                 now = time.time()
                 if now - last_dispatcher_check > PING_INTERVAL:
@@ -795,7 +862,8 @@ class Command(LAVADaemonCommand):
                 # CANCEL and START messages
                 if time.time() - last_schedule > SCHEDULE_INTERVAL:
                     if self.dispatchers["lava-logs"].online:
-                        schedule(self.logger)
+                        self.reconcile_scheduler_state()
+                        schedule(self.logger, state=self.scheduler_state)
 
                         # Dispatch scheduled jobs
                         with transaction.atomic():
@@ -817,7 +885,12 @@ class Command(LAVADaemonCommand):
                         self.events["canceling"] = set()
                     # Schedule for available device-types
                     if self.events["available_dt"]:
-                        jobs = schedule(self.logger, self.events["available_dt"])
+                        self.reconcile_scheduler_state()
+                        jobs = schedule(
+                            self.logger,
+                            self.events["available_dt"],
+                            state=self.scheduler_state,
+                        )
                         self.events["available_dt"] = set()
                         # Dispatch scheduled jobs
                         with transaction.atomic():
@@ -828,4 +901,6 @@ class Command(LAVADaemonCommand):
                 # Closing the database connection will force Django to reopen
                 # the connection
                 connection.close()
+                # Changes could have been missed: reload the state
+                self.scheduler_state.last_reconcile = None
                 time.sleep(2)
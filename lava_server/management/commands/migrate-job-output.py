@@ -18,12 +18,16 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
+from lava_scheduler_app.logutils import logs_instance, LogsBlockCompressed
 from lava_scheduler_app.models import TestJob
 from lava_scheduler_app.utils import mkdir
 
+import lzma
 import os
+import pathlib
+from shutil import chown
 import time
 
 
@@ -43,8 +47,18 @@ class Command(BaseCommand):
             action="store_true",
             help="Be nice with the system by sleeping regularly",
         )
+        parser.add_argument(
+            "--compressed-logs",
+            default=False,
+            action="store_true",
+            help="Convert the compressed logs to blocks, see LogsBlockCompressed",
+        )
 
     def handle(self, *_, **options):
+        if options["compressed_logs"]:
+            self.handle_compressed_logs(options["dry_run"], options["slow"])
+            return
+
         base_dir = "/var/lib/lava-server/default/media/job-output/"
         len_base_dir = len(base_dir)
         jobs = TestJob.objects.all().order_by("id")
@@ -86,3 +100,39 @@ class Command(BaseCommand):
             if options["slow"]:
                 self.stdout.write("sleeping 2s...")
                 time.sleep(2)
+
+    def handle_compressed_logs(self, dry_run, slow):
+        if not isinstance(logs_instance, LogsBlockCompressed):
+            raise CommandError(
+                "LAVA_LOG_BACKEND should be 'lava_scheduler_app.logutils.LogsBlockCompressed'"
+            )
+        jobs = (
+            TestJob.objects.filter(state=TestJob.STATE_FINISHED)
+            .only("id", "submit_time")
+            .order_by("id")
+        )
+
+        self.stdout.write("Converting compressed logs")
+        for (index, job) in enumerate(jobs.iterator()):
+            base = pathlib.Path(job.output_dir)
+            if not (base / logs_instance.compressed_log_filename).exists():
+                continue
+            if (base / logs_instance.blocks_filename).exists():
+                self.stdout.write("* %d skip" % job.id)
+                continue
+
+            self.stdout.write("* %d" % job.id)
+            if not dry_run:
+                try:
+                    with lzma.open(
+                        str(base / logs_instance.compressed_log_filename), "rb"
+                    ) as f_in:
+                        data = f_in.read()
+                    for filename in logs_instance.compress(job, data):
+                        chown(str(base / filename), "lavaserver", "lavaserver")
+                except (OSError, lzma.LZMAError) as exc:
+                    self.stderr.write("  -> Unable to convert the logs: %s" % str(exc))
+
+            if slow and index % 100 == 99:
+                self.stdout.write("sleeping 2s...")
+                time.sleep(2)
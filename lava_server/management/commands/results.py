@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from lava_results_app.models import TestSuite, TestSuiteSummary
+from lava_scheduler_app.models import TestJob
+from lava_server.compat import get_sub_parser_class
+
+
+class Command(BaseCommand):
+    help = "Manage test results"
+
+    def add_arguments(self, parser):
+        SubParser = get_sub_parser_class(self)
+
+        sub = parser.add_subparsers(
+            dest="sub_command", help="Sub commands", parser_class=SubParser
+        )
+        sub.required = True
+
+        summaries = sub.add_parser(
+            "summaries",
+            help="Create the test suite summaries of the finished jobs. "
+            "The summaries of the running jobs are created by lava-logs.",
+        )
+        summaries.add_argument(
+            "--force",
+            default=False,
+            action="store_true",
+            help="Recompute the existing summaries",
+        )
+        summaries.add_argument(
+            "--batch-size",
+            default=1000,
+            type=int,
+            help="Number of test suites summarized at once",
+        )
+        summaries.add_argument(
+            "--slow",
+            default=False,
+            action="store_true",
+            help="Be nice with the system by sleeping regularly",
+        )
+
+    def handle(self, *_, **options):
+        """ forward to the right sub-handler """
+        if options["sub_command"] == "summaries":
+            self.handle_summaries(
+                options["force"], options["batch_size"], options["slow"]
+            )
+
+    def handle_summaries(self, force, batch_size, slow):
+        suites = TestSuite.objects.filter(job__state=TestJob.STATE_FINISHED)
+        if not force:
+            suites = suites.filter(summary__isnull=True)
+        suites = suites.order_by("id").values_list("id", flat=True)
+
+        self.stdout.write("Summarizing %d test suites" % suites.count())
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(suites.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                if force:
+                    TestSuiteSummary.objects.filter(suite_id__in=batch).delete()
+                TestSuiteSummary.create(batch)
+            last_id = batch[-1]
+            total += len(batch)
+            self.stdout.write("* %d test suites summarized" % total)
+
+            if slow:
+                self.stdout.write("sleeping 2s...")
+                time.sleep(2)
@@ -70,6 +70,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "lava_scheduler_app.auth.PermissionCacheMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -129,9 +130,19 @@ MEDIA_ROOT = "/var/lib/lava-server/default/media/"
 # LOG_SIZE_LIMIT in megabytes
 LOG_SIZE_LIMIT = 5
 
-# When rendering the logs, above this limit, the testcase urls won't be
-# resolved.
-TESTCASE_COUNT_LIMIT = 10000
+# Push the new log lines to the browsers (server-sent events) instead of
+# polling. Every viewer of a running job holds a connection: gunicorn should
+# use threads.
+LOG_STREAMING = False
+# Maximum duration of a log stream connection in seconds, the browsers then
+# reconnect.
+LOG_STREAM_DURATION = 20
+# Number of threads compressing the logs by blocks (LogsBlockCompressed), the
+# number of cpus by default.
+LOG_COMPRESSION_THREADS = None
+
+# Number of query views refreshed in parallel by refresh_all_queries
+QUERY_REFRESH_WORKERS = 4
 
 # Default URL after login
 LOGIN_REDIRECT_URL = "/"
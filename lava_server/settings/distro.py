@@ -199,4 +199,6 @@ if "SENTRY_DSN" in globals():
         release=f"lava@{__version__}",
     )
 
-LAVA_LOG_BACKEND = "lava_scheduler_app.logutils.LogsFilesystem"
+LAVA_LOG_BACKEND = globals().get(
+    "LAVA_LOG_BACKEND", "lava_scheduler_app.logutils.LogsFilesystem"
+)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Charts benchmark
+#
+# Measure the duration and the number of queries needed to build the data of
+# the pass/fail and measurement charts over a large number of jobs, with and
+# without the test suite summaries.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_charts.py
+#
+# The number of jobs can be set with BENCH_JOBS (10000 by default).
+
+import os
+import time
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+
+from lava_results_app.models import ChartQuery, TestCase, TestSuite
+from lava_scheduler_app.models import DeviceType, TestJob
+
+JOBS = int(os.environ.get("BENCH_JOBS", "10000"))
+SUITES = ["lava", "smoke", "ltp"]
+CASES = 10
+
+
+@pytest.fixture
+def jobs(db):
+    dt = DeviceType.objects.create(name="qemu")
+    user = User.objects.create(username="benchmark")
+    TestJob.objects.bulk_create(
+        [
+            TestJob(
+                requested_device_type=dt,
+                submitter=user,
+                definition="{}",
+                state=TestJob.STATE_FINISHED,
+            )
+            for _ in range(JOBS)
+        ]
+    )
+    TestSuite.objects.bulk_create(
+        [
+            TestSuite(job_id=pk, name=name)
+            for pk in TestJob.objects.values_list("id", flat=True)
+            for name in SUITES
+        ]
+    )
+    TestCase.objects.bulk_create(
+        [
+            TestCase(suite_id=pk, name="case-%d" % i, result=i % 4, measurement=i * 1.5)
+            for pk in TestSuite.objects.values_list("id", flat=True)
+            for i in range(CASES)
+        ],
+        batch_size=10000,
+    )
+
+
+class QueryCounter:
+    # The queries log of the connection is limited to 9000 queries
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def run(name, func):
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        start = time.monotonic()
+        data = func(None, TestJob.objects.order_by("end_time"))
+        duration = time.monotonic() - start
+    assert len(data) == JOBS * len(SUITES)  # nosec - benchmark
+    print("%-30s %6d jobs: %8.3fs, %6d queries" % (name, JOBS, duration, counter.count))
+
+
+def test_charts(jobs):
+    chart_query = ChartQuery()
+    print()
+    run("pass/fail", chart_query.get_chart_passfail_data)
+    run("measurement", chart_query.get_chart_measurement_data)
+
+    call_command("results", "summaries", stdout=open(os.devnull, "w"))
+    run("pass/fail (summaries)", chart_query.get_chart_passfail_data)
+    run("measurement (summaries)", chart_query.get_chart_measurement_data)
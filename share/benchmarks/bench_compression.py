@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compression benchmark
+#
+# Measure the duration of the dispatcher compression (used for the overlays
+# and the ramdisks) for each compression type, with one thread and with every
+# cpu, using the multithreaded commands when installed and the python
+# fallback.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_compression.py
+#
+# The size of the file can be set with BENCH_COMPRESSION_SIZE, in MB (128 by
+# default).
+
+import os
+import shutil
+import time
+
+import pytest
+
+from lava_dispatcher.utils.compression import compress_command_map, compress_file
+
+SIZE = int(os.environ.get("BENCH_COMPRESSION_SIZE", "128"))
+
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    # Half random, half text: compressible but not too much
+    filename = str(tmpdir_factory.mktemp("data") / "ramdisk.cpio")
+    with open(filename, "wb") as f_out:
+        for _ in range(SIZE * 2):
+            f_out.write(os.urandom(256 * 1024))
+            f_out.write(b"".join(b"line %08d\n" % i for i in range(256 * 1024 // 14)))
+    return filename
+
+
+@pytest.mark.parametrize("method", ["command", "python"])
+@pytest.mark.parametrize("threads", [1, os.cpu_count()])
+@pytest.mark.parametrize("compression", ["gz", "bz2", "xz"])
+def test_compression(mocker, tmpdir, data, compression, threads, method):
+    if method == "python":
+        mocker.patch("shutil.which", return_value=None)
+    elif shutil.which(compress_command_map[compression][0]) is None:
+        pytest.skip("%s is not installed" % compress_command_map[compression][0])
+    filename = str(tmpdir / "ramdisk.cpio")
+    shutil.copyfile(data, filename)
+
+    start = time.monotonic()
+    output = compress_file(filename, compression, threads)
+    duration = time.monotonic() - start
+    print(
+        "\n%-4s %-7s %3d threads %6dMB: %8.3fs, %6.2f%%"
+        % (
+            compression,
+            method,
+            threads,
+            os.stat(data).st_size / (1024 * 1024),
+            duration,
+            100 * os.stat(output).st_size / os.stat(data).st_size,
+        )
+    )
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Download benchmark
+#
+# Measure the throughput (MB/s) of the dispatcher download action for each
+# compression type, with the default checksum (sha256) and with the three
+# checksums (md5, sha256 and sha512) given in the job definition. The file is
+# read from the local filesystem so the network is not measured.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_download.py
+#
+# The size of the file can be set with BENCH_DOWNLOAD_SIZE, in MB (256 by
+# default).
+
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import shutil
+import subprocess  # nosec - benchmark
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+from lava_dispatcher.actions.deploy.download import FileDownloadAction
+from lava_dispatcher.job import Job
+
+SIZE = int(os.environ.get("BENCH_DOWNLOAD_SIZE", "256"))
+
+
+@pytest.fixture(scope="module")
+def data(tmpdir_factory):
+    # Half random, half zeros: compressible but not too much
+    filename = str(tmpdir_factory.mktemp("data") / "rootfs")
+    with open(filename, "wb") as f_out:
+        for _ in range(SIZE * 2):
+            f_out.write(os.urandom(256 * 1024))
+            f_out.write(bytes(256 * 1024))
+    return filename
+
+
+def compress(filename, compression):
+    if compression is None:
+        return filename
+    output = "%s.%s" % (filename, compression)
+    if os.path.exists(output):
+        return output
+    if compression == "zstd":
+        if shutil.which("zstd") is None:
+            pytest.skip("zstd is not installed")
+        subprocess.check_call(  # nosec - benchmark
+            ["zstd", "-q", "-T0", filename, "-o", output]
+        )
+        return output
+    module = {"gz": gzip, "bz2": bz2, "xz": lzma}[compression]
+    with open(filename, "rb") as f_in, module.open(output, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+    return output
+
+
+@pytest.mark.parametrize("checksums", ["default", "all"])
+@pytest.mark.parametrize("compression", [None, "gz", "bz2", "xz", "zstd"])
+def test_download(tmpdir, data, compression, checksums):
+    filename = compress(data, compression)
+    params = {"url": "file://" + filename}
+    if compression is not None:
+        params["compression"] = compression
+    if checksums == "all":
+        for algorithm in ["md5", "sha256", "sha512"]:
+            with open(filename, "rb") as f_in:
+                hashobj = hashlib.new(algorithm)  # nosec - benchmark
+                for buff in iter(lambda: f_in.read(1024 * 1024), b""):
+                    hashobj.update(buff)
+            params["%ssum" % algorithm] = hashobj.hexdigest()
+
+    action = FileDownloadAction("rootfs", str(tmpdir), urlparse(params["url"]))
+    action.job = Job(1234, {"dispatcher": {}}, None)
+    action.parameters = {"to": "download", "namespace": "common"}
+    action.params = params
+    action.fname = str(tmpdir / "rootfs" / "rootfs")
+    action.size = os.stat(filename).st_size
+
+    start = time.monotonic()
+    action.run(None, None)
+    duration = time.monotonic() - start
+    print(
+        "\n%-5s %-8s %6dMB: %8.3fs, %8.2fMB/s"
+        % (
+            compression or "none",
+            checksums,
+            action.size / (1024 * 1024),
+            duration,
+            action.size / (1024 * 1024 * duration),
+        )
+    )
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Export benchmark
+#
+# Measure the duration and the peak of memory allocated by the export of the
+# test cases of one job in CSV, YAML, JUnit and TAP13.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_export.py
+#
+# The number of test cases can be set with BENCH_EXPORT_CASES (100000 by
+# default).
+
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from django.contrib.auth.models import User
+
+from lava_results_app.export import (
+    export_csv,
+    export_junit,
+    export_tap13,
+    export_yaml,
+    job_testcases,
+)
+from lava_results_app.models import TestCase, TestSuite
+from lava_scheduler_app.models import DeviceType, TestJob
+
+CASES = int(os.environ.get("BENCH_EXPORT_CASES", "100000"))
+SUITES = ["lava", "smoke", "ltp"]
+
+
+@pytest.fixture
+def job(db):
+    dt = DeviceType.objects.create(name="qemu")
+    user = User.objects.create(username="benchmark")
+    job = TestJob.objects.create(
+        requested_device_type=dt,
+        submitter=user,
+        definition="{}",
+        state=TestJob.STATE_FINISHED,
+    )
+    for name in SUITES:
+        suite = TestSuite.objects.create(job=job, name=name)
+        TestCase.objects.bulk_create(
+            [
+                TestCase(
+                    suite=suite,
+                    name="case-%d" % i,
+                    result=i % 3,
+                    metadata={"case": "case-%d" % i, "level": "1.%d" % i},
+                )
+                for i in range(CASES // len(SUITES))
+            ],
+            batch_size=10000,
+        )
+    return job
+
+
+@pytest.mark.parametrize("fmt", ["csv", "yaml", "junit", "tap13"])
+def test_export(job, fmt):
+    func = {
+        "csv": lambda: export_csv(job_testcases(job)),
+        "yaml": lambda: export_yaml(job_testcases(job)),
+        "junit": lambda: export_junit(job),
+        "tap13": lambda: export_tap13(job),
+    }[fmt]
+
+    tracemalloc.start()
+    start = time.monotonic()
+    size = sum(len(chunk) for chunk in func())
+    duration = time.monotonic() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        "\n%-5s %7d cases: %8.3fs, %8.2fMB output, %8.2fMB peak"
+        % (fmt, CASES, duration, size / (1024 * 1024), peak / (1024 * 1024))
+    )
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Log writes benchmark
+#
+# Count the number of write syscalls done by lava-logs to store the job logs
+# (output.yaml and output.idx), with and without buffering, and measure the
+# number of lines written per second.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_log_writes.py
+#
+# The number of lines can be set with BENCH_LINES (100000 by default).
+
+import io
+import os
+import time
+from importlib import import_module
+
+import pytest
+
+LINES = int(os.environ.get("BENCH_LINES", "100000"))
+
+lava_logs = import_module("lava_server.management.commands.lava-logs")
+
+
+class CountingFileIO(io.FileIO):
+    # Every call to write() on the raw file is a write syscall
+    writes = 0
+
+    def write(self, data):
+        CountingFileIO.writes += 1
+        return super().write(data)
+
+
+def counting_open(filename, mode, buffering=-1):
+    if buffering < 0:
+        buffering = io.DEFAULT_BUFFER_SIZE
+    return io.BufferedWriter(CountingFileIO(filename, mode), buffering)
+
+
+class Job:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+
+def kernel_line(index):
+    return (
+        '- {"dt": "2020-04-01T00:00:00.000000", "lvl": "target", "msg": "[%8.6f] usb 1-1: new high-speed USB device number %d using ehci-pci"}'
+        % (index / 1000, index)
+    )
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+def test_log_writes(monkeypatch, tmpdir, buffered):
+    monkeypatch.setattr(lava_logs, "open", counting_open, raising=False)
+    CountingFileIO.writes = 0
+
+    handler = lava_logs.JobHandler(Job(str(tmpdir)), buffered=buffered)
+    lines = [kernel_line(i) for i in range(LINES)]
+    start = time.monotonic()
+    for (index, line) in enumerate(lines):
+        handler.write(line)
+        # lava-logs flushes the buffers every FLUSH_INTERVAL: simulate a flush
+        # every 1000 lines
+        if buffered and index % 1000 == 999:
+            handler.flush()
+    handler.close()
+    duration = time.monotonic() - start
+
+    assert (tmpdir / "output.yaml").size() == sum(len(l) + 1 for l in lines)
+    assert (tmpdir / "output.idx").size() == LINES * 8
+    print(
+        "\nbuffered=%s: %d lines, %d write syscalls (%.2f per line), %d lines/s"
+        % (
+            buffered,
+            LINES,
+            CountingFileIO.writes,
+            CountingFileIO.writes / LINES,
+            LINES / duration,
+        )
+    )
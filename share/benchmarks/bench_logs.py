@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Log format benchmark
+#
+# Measure the number of log lines per second that can be encoded by the
+# dispatcher and decoded (and converted to the on-disk YAML format) by
+# lava-logs, for every version of the log format.
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_logs.py
+#
+# The number of lines can be set with BENCH_LINES (100000 by default).
+
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+from lava_common.compat import yaml_load
+from lava_common.log import json_to_yaml, LogMessage
+
+LINES = int(os.environ.get("BENCH_LINES", "100000"))
+
+
+def kernel_line(index):
+    return "[%8.6f] usb 1-1: new high-speed USB device number %d using ehci-pci" % (
+        index / 1000,
+        index,
+    )
+
+
+def encode_v1(data):
+    return str(LogMessage(data))
+
+
+def decode_v1(message):
+    return (yaml_load(message), message)
+
+
+def encode_v2(data):
+    return LogMessage(data).json()
+
+
+def decode_v2(message):
+    scanned = json.loads(message)
+    return (scanned, json_to_yaml(scanned))
+
+
+@pytest.mark.parametrize(
+    "version,encode,decode", [(1, encode_v1, decode_v1), (2, encode_v2, decode_v2)]
+)
+def test_log_format(version, encode, decode):
+    now = datetime.datetime.utcnow().isoformat()
+    lines = [{"dt": now, "lvl": "target", "msg": kernel_line(i)} for i in range(LINES)]
+
+    start = time.monotonic()
+    messages = [encode(data) for data in lines]
+    encoding = time.monotonic() - start
+
+    start = time.monotonic()
+    decoded = [decode(message) for message in messages]
+    decoding = time.monotonic() - start
+
+    assert [d[0] for d in decoded[:10]] == lines[:10]  # nosec - benchmark
+    print(
+        "v%d: encoding %9.0f lines/s, decoding %9.0f lines/s"
+        % (version, LINES / encoding, LINES / decoding)
+    )
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020 Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+# Scheduler benchmark
+#
+# Measure the duration of a scheduling pass with a large queue of jobs that
+# cannot be scheduled (requesting a tag that no device has).
+#
+# Run with:
+#   python3 -m pytest -s share/benchmarks/bench_scheduler.py
+#
+# The queue size can be set with BENCH_JOBS (10000 by default).
+
+import os
+import time
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from lava_scheduler_app.models import Device, DeviceType, Tag, TestJob, Worker
+from lava_scheduler_app.scheduler import schedule, SchedulerState
+
+JOBS = int(os.environ.get("BENCH_JOBS", "10000"))
+DEVICES = 20
+
+DEFINITION = """
+device_type: qemu
+job_name: benchmark
+timeouts:
+  job:
+    minutes: 10
+  action:
+    minutes: 5
+actions: []
+"""
+
+
+class Logger:
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+@pytest.fixture
+def queue(db, monkeypatch):
+    monkeypatch.setattr(Device, "get_health_check", lambda self: None)
+    monkeypatch.setattr(Device, "is_valid", lambda self: True)
+    worker = Worker.objects.create(hostname="worker-01", state=Worker.STATE_ONLINE)
+    dt = DeviceType.objects.create(name="qemu")
+    for i in range(DEVICES):
+        Device.objects.create(
+            hostname="qemu-%02d" % i,
+            device_type=dt,
+            worker_host=worker,
+            health=Device.HEALTH_GOOD,
+        )
+    tag = Tag.objects.create(name="missing")
+    user = User.objects.create(username="benchmark")
+    TestJob.objects.bulk_create(
+        [
+            TestJob(requested_device_type=dt, submitter=user, definition=DEFINITION)
+            for _ in range(JOBS)
+        ]
+    )
+    through = TestJob.tags.through
+    through.objects.bulk_create(
+        [
+            through(testjob_id=pk, tag_id=tag.id)
+            for pk in TestJob.objects.values_list("id", flat=True)
+        ]
+    )
+
+
+def run(name, state=None):
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.monotonic()
+        assert schedule(Logger(), state=state) == []  # nosec - benchmark
+        duration = time.monotonic() - start
+    print("%-20s %6d jobs: %8.3fs, %5d queries" % (name, JOBS, duration, len(ctx)))
+
+
+def test_schedule(queue):
+    run("without state")
+
+
+def test_schedule_state(queue):
+    state = SchedulerState()
+    state.reconcile()
+    run("with state (first)", state)
+    run("with state (next)", state)
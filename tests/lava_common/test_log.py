@@ -0,0 +1,157 @@
+import json
+import logging
+import math
+import pytest
+import time
+
+from lava_common.compat import yaml_load
+from lava_common.log import json_to_yaml, LogMessage, YAMLLogger, ZMQPushHandler
+
+
+MESSAGES = [
+    "hello world",
+    "tab\tnew line\ncarriage return\r",
+    'quote " and backslash \\ and \\u0041 and \\ud83d\\ude00',
+    "control \x00\x01\x1b[0m and DEL \x7f",
+    "non ascii: é ü ß 日本 \u0085 \u2028 \u2029 \ufeff",
+    "astral: 😀 𝄞 \\😀",
+    {"case": "test", "definition": "lava", "result": "pass", "measurement": 1.5},
+    {"extra": {"list": [1, 2, None, True]}, "level": "1.2"},
+]
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_log_message(message):
+    data = {"dt": "2020-04-01T00:00:00.000000", "lvl": "target", "msg": message}
+    msg = LogMessage(data)
+    assert yaml_load(str(msg)) == data
+    assert "\n" not in str(msg)
+    assert json.loads(msg.json()) == data
+    line = json_to_yaml(json.loads(msg.json()))
+    assert "\n" not in line
+    assert yaml_load(line) == data
+    assert yaml_load("- %s" % line) == [data]
+
+
+@pytest.mark.parametrize(
+    "message,expected",
+    [
+        ("lone \ud83d surrogate", "lone \\ud83d surrogate"),
+        ("\udcff\\\udcff", "\\udcff\\\\udcff"),
+        ("\\ud83d\ude00", "\\ud83d\\ude00"),
+        ({"measurement": 1e-05}, {"measurement": 1e-05}),
+        ({"measurement": -1e20}, {"measurement": -1e20}),
+        ({"measurement": 1.5e-07}, {"measurement": 1.5e-07}),
+        ({"measurement": "1e-05 NaN"}, {"measurement": "1e-05 NaN"}),
+    ],
+)
+def test_json_to_yaml(message, expected):
+    line = json_to_yaml({"lvl": "target", "msg": message})
+    assert "\n" not in line
+    assert yaml_load(line) == {"lvl": "target", "msg": expected}
+
+
+def test_json_to_yaml_special_floats():
+    line = json_to_yaml({"msg": [float("nan"), float("inf"), -float("inf")]})
+    assert line == '{"msg": [.nan, .inf, -.inf]}'
+    values = yaml_load(line)["msg"]
+    assert math.isnan(values[0])
+    assert values[1:] == [float("inf"), -float("inf")]
+
+
+def test_log_message_too_long():
+    msg = LogMessage({"dt": "now", "lvl": "target", "msg": "a" * 10 ** 6})
+    assert yaml_load(str(msg))["msg"] == "<line way too long ...>"
+    assert json.loads(msg.json())["msg"] == "<line way too long ...>"
+    msg = LogMessage({"dt": "now", "lvl": "results", "msg": {"a": "a" * 10 ** 6}})
+    assert yaml_load(str(msg))["msg"] == {"skip": "line way too long ..."}
+    assert json.loads(msg.json())["msg"] == {"skip": "line way too long ..."}
+
+
+@pytest.mark.parametrize("version", [1, 2])
+def test_zmq_push_handler(mocker, version):
+    mocker.patch("zmq.Context")
+    logger = YAMLLogger("test_zmq_push_handler")
+    handler = logger.addZMQHandler(
+        "tcp://localhost:5555", None, None, 1234, None, False, version
+    )
+    assert isinstance(handler, ZMQPushHandler)
+    logger.setLevel(logging.DEBUG)
+    logger.info("hello %s", "world")
+
+    send_multipart = handler.socket.send_multipart
+    assert send_multipart.call_count == 1
+    msg = send_multipart.call_args[0][0]
+    assert msg[0] == b"1234"
+    if version == 1:
+        assert len(msg) == 2
+        data = yaml_load(msg[1].decode("utf-8"))
+    else:
+        assert len(msg) == 3
+        assert msg[1] == b"2"
+        data = json.loads(msg[2].decode("utf-8"))
+    assert data["lvl"] == "info"
+    assert data["msg"] == "hello world"
+
+
+def test_zmq_push_handler_batch(mocker):
+    mocker.patch("zmq.Context")
+    mocker.patch("lava_common.log.ZMQPushHandler.BATCH_TIMEOUT", 3600)
+    logger = YAMLLogger("test_zmq_push_handler_batch")
+    handler = logger.addZMQHandler(
+        "tcp://localhost:5555", None, None, 1234, None, False, 3, True
+    )
+    logger.setLevel(logging.DEBUG)
+    send_multipart = handler.socket.send_multipart
+
+    def sent():
+        ret = []
+        for call in send_multipart.call_args_list:
+            msg = call[0][0]
+            assert msg[:2] == [b"1234", b"3"]
+            ret.append([json.loads(m.decode("utf-8"))["msg"] for m in msg[2:]])
+        send_multipart.reset_mock()
+        return ret
+
+    # Buffered
+    logger.info("line 1")
+    logger.target("line 2")
+    assert sent() == []
+    # Flushed by results
+    logger.results({"definition": "lava", "case": "test", "result": "pass"})
+    assert sent() == [
+        ["line 1", "line 2", {"definition": "lava", "case": "test", "result": "pass"}]
+    ]
+    # Flushed by markers
+    logger.target("line 3")
+    logger.marker({"case": "test", "type": "start_test_case"})
+    assert sent() == [["line 3", {"case": "test", "type": "start_test_case"}]]
+    # Flushed by size
+    mocker.patch("lava_common.log.ZMQPushHandler.BATCH_SIZE", 200)
+    logger.target("a" * 50)
+    assert sent() == []
+    logger.target("b" * 50)
+    assert sent() == [["a" * 50, "b" * 50]]
+    # Flushed when closing
+    logger.target("line 4")
+    logger.close()
+    assert sent() == [["line 4"]]
+
+
+def test_zmq_push_handler_batch_timeout(mocker):
+    mocker.patch("zmq.Context")
+    mocker.patch("lava_common.log.ZMQPushHandler.BATCH_TIMEOUT", 0.01)
+    logger = YAMLLogger("test_zmq_push_handler_batch_timeout")
+    handler = logger.addZMQHandler(
+        "tcp://localhost:5555", None, None, 1234, None, False, 3, True
+    )
+    logger.setLevel(logging.DEBUG)
+    send_multipart = handler.socket.send_multipart
+    logger.target("line 1")
+    for _ in range(100):
+        if send_multipart.call_count:
+            break
+        time.sleep(0.01)
+    assert send_multipart.call_count == 1
+    logger.close()
+    assert send_multipart.call_count == 1
@@ -93,6 +93,7 @@ def test_append_overlays_update_cpio(caplog, mocker, tmpdir):
                 "path": "/",
             }
         },
+        "append_overlay": False,
     }
 
     action = AppendOverlays("rootfs", params)
@@ -132,7 +133,7 @@ def test_append_overlays_update_cpio(caplog, mocker, tmpdir):
     unlink.assert_called_once_with(decompress_file())
     untar_file.assert_called_once_with(str(tmpdir / "modules.tar"), str(tmpdir) + "/")
     cpio.assert_called_once_with(str(tmpdir), decompress_file())
-    compress_file.assert_called_once_with(decompress_file(), "gz")
+    compress_file.assert_called_once_with(decompress_file(), "gz", None)
 
     assert caplog.record_tuples == [
         ("dispatcher", 20, f"Modifying '{tmpdir}/rootfs.cpio.gz'"),
@@ -228,32 +229,28 @@ def test_append_lava_overlay_update_cpio(caplog, mocker, tmpdir):
         "lava_dispatcher.actions.deploy.apply_overlay.decompress_file"
     )
     uncpio = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.uncpio")
-    unlink = mocker.patch("os.unlink")
     untar_file = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.untar_file")
-    cpio = mocker.patch("lava_dispatcher.actions.deploy.apply_overlay.cpio")
-    compress_file = mocker.patch(
-        "lava_dispatcher.actions.deploy.apply_overlay.compress_file"
+    cpio_append = mocker.patch(
+        "lava_dispatcher.actions.deploy.apply_overlay.cpio_append"
     )
 
     action.update_cpio()
 
-    decompress_file.assert_called_once_with(str(tmpdir / "rootfs.cpio.gz"), "gz")
-    uncpio.assert_called_once_with(decompress_file(), str(tmpdir))
-    unlink.assert_called_once_with(decompress_file())
+    # The image is neither extracted nor recompressed
+    decompress_file.assert_not_called()
+    uncpio.assert_not_called()
     untar_file.assert_called_once_with(
         str(tmpdir / "overlay.tar.gz"), str(tmpdir) + "/"
     )
-    cpio.assert_called_once_with(str(tmpdir), decompress_file())
-    compress_file.assert_called_once_with(decompress_file(), "gz")
+    cpio_append.assert_called_once_with(
+        str(tmpdir), str(tmpdir / "rootfs.cpio.gz"), "gz", None
+    )
 
     assert caplog.record_tuples == [
         ("dispatcher", 20, f"Modifying '{tmpdir}/rootfs.cpio.gz'"),
-        ("dispatcher", 10, "* decompressing (gz)"),
-        ("dispatcher", 10, f"* extracting {decompress_file()}"),
         ("dispatcher", 10, "Overlays:"),
         ("dispatcher", 10, f"- rootfs.lava: '{tmpdir}/overlay.tar.gz' to '{tmpdir}/'"),
-        ("dispatcher", 10, f"* archiving {decompress_file()}"),
-        ("dispatcher", 10, "* compressing (gz)"),
+        ("dispatcher", 10, f"* appending to '{tmpdir}/rootfs.cpio.gz'"),
     ]
 
 
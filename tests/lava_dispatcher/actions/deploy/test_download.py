@@ -785,3 +785,70 @@ def test_copy_to_lxc_without_lxc_should_do_nothing():
     action = CopyToLxcAction()
     action.job = Job(1234, {}, None)
     action.run(None, 4242)  # no crash = success
+
+
+def test_http_download_run_cache(tmpdir):
+    calls = []
+
+    def reader():
+        calls.append(1)
+        yield b"hello"
+        yield b"world"
+
+    def run(job_dir, params, validators):
+        action = HttpDownloadAction(
+            "dtb", str(tmpdir / job_dir), urlparse("https://example.com/dtb")
+        )
+        action.job = Job(
+            1234, {"dispatcher": {"download_cache_path": str(tmpdir / "cache")}}, None
+        )
+        action.url = urlparse("https://example.com/dtb")
+        action.parameters = {"to": "download", "namespace": "common"}
+        action.params = dict(params, url="https://example.com/dtb")
+        action.reader = reader
+        action.validators = validators
+        action.fname = str(tmpdir / job_dir / "dtb/dtb")
+        action.run(None, 4212)
+        assert Path(action.fname).read_text() == "helloworld"
+        assert action.results["size"] == 10
+        # Only the requested checksums are computed, sha256 by default
+        checksum = "md5sum" if "md5sum" in params else "sha256sum"
+        assert [k for k in action.results if k.endswith("sum")] == [checksum]
+        assert (
+            action.results[checksum]
+            == {
+                "md5sum": "fc5e038d38a57032085441e7fe7010b0",
+                "sha256sum": "936a185caaa266bb9cbe981e9e05cb78cd732b0b3280eb944412bb6f8f8f07af",
+            }[checksum]
+        )
+        return action.results.get("download-cache")
+
+    # Without checksum and validators, the file is not cached
+    assert run("job1", {}, {}) is None
+    assert run("job2", {}, {}) is None
+    assert len(calls) == 2
+
+    # Keyed by the url and the validators
+    validators = {"etag": '"1234"', "size": 10}
+    assert run("job3", {}, validators) == "miss"
+    assert run("job4", {}, validators) == "hit"
+    assert run("job5", {}, dict(validators, etag='"5678"')) == "miss"
+    assert len(calls) == 4
+
+    # Keyed by the checksum, whatever the url
+    params = {"md5sum": "fc5e038d38a57032085441e7fe7010b0"}
+    assert run("job6", params, {}) == "miss"
+    assert run("job7", params, {}) == "hit"
+    assert len(calls) == 5
+
+    # Modifying the job file does not modify the cache
+    (tmpdir / "job7" / "dtb" / "dtb").write_text("modified", encoding="utf-8")
+    assert run("job8", params, {}) == "hit"
+
+    # Files not matching the checksum are not cached
+    params = {"md5sum": "fc5e038d38a57032085441e7fe7010b1"}
+    with pytest.raises(JobError):
+        run("job9", params, {})
+    with pytest.raises(JobError):
+        run("job10", params, {})
+    assert len(calls) == 7
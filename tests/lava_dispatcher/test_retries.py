@@ -18,10 +18,17 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import pytest
+import threading
 import time
 from lava_dispatcher.action import Action, Pipeline
 from lava_common.timeout import Timeout
-from lava_common.exceptions import JobError, LAVABug, InfrastructureError
+from lava_common.exceptions import (
+    JobCanceled,
+    JobError,
+    LAVABug,
+    InfrastructureError,
+)
 from lava_dispatcher.logical import RetryAction, DiagnosticAction
 from lava_dispatcher.power import FinalizeAction
 from lava_dispatcher.job import Job
@@ -531,3 +538,84 @@ class TestTimeout(StdoutTestCase):
         self.fakejob.pipeline = pipeline
         self.fakejob.device = TestTimeout.FakeDevice()
         self.fakejob.run()
+
+
+class ParallelAction(Action):
+    name = "parallel-action"
+    description = "fake parallel action"
+    summary = "fake parallel action"
+    parallel = True
+
+    def __init__(self, barrier=None, error=None, loop=False):
+        super().__init__()
+        self.parameters["namespace"] = "common"
+        self.barrier = barrier
+        self.error = error
+        self.loop = loop
+        self.exception = None
+
+    def run(self, connection, max_end_time):
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        if self.error is not None:
+            raise self.error
+        try:
+            while self.loop:
+                Timeout.check()
+                time.sleep(0.01)
+        except Exception as exc:
+            self.exception = exc
+            raise
+        return connection
+
+
+def test_pipeline_parallel():
+    job = Job(4212, {"dispatcher": {"parallel_downloads": 3}}, None)
+    pipeline = Pipeline(job=job)
+    # The three actions wait for each other
+    barrier = threading.Barrier(3)
+    actions = [ParallelAction(barrier) for _ in range(3)]
+    for action in actions[:2]:
+        pipeline.add_action(action)
+    pipeline.add_action(TestTimeout.SafeAction())
+    pipeline.add_action(actions[2])
+    (groups, workers) = pipeline._groups()
+    assert workers == 3
+    assert [len(group) for group in groups] == [2, 1, 1]
+
+    pipeline = Pipeline(job=job)
+    for action in actions:
+        pipeline.add_action(action)
+    pipeline.run_actions(None, None)
+
+    # Sequential by default
+    pipeline = Pipeline(job=Job(4212, {"dispatcher": {}}, None))
+    for _ in range(3):
+        pipeline.add_action(ParallelAction())
+    (groups, _) = pipeline._groups()
+    assert [len(group) for group in groups] == [1, 1, 1]
+
+
+def test_pipeline_parallel_failure():
+    job = Job(4212, {"dispatcher": {"parallel_downloads": 2}}, None)
+    pipeline = Pipeline(job=job)
+    looping = ParallelAction(loop=True)
+    pipeline.add_action(looping)
+    pipeline.add_action(ParallelAction(error=InfrastructureError("failure")))
+    with pytest.raises(InfrastructureError, match="failure"):
+        pipeline.run_actions(None, None)
+    # The other actions are cancelled
+    assert isinstance(looping.exception, JobCanceled)
+
+
+def test_pipeline_parallel_timeout():
+    job = Job(4212, {"dispatcher": {"parallel_downloads": 2}}, None)
+    pipeline = Pipeline(job=job)
+    looping = ParallelAction(loop=True)
+    looping.timeout = Timeout(looping.name, duration=1)
+    pipeline.add_action(looping)
+    pipeline.add_action(ParallelAction())
+    start = time.time()
+    with pytest.raises(JobError, match="timed out"):
+        pipeline.run_actions(None, None)
+    assert time.time() - start < 5
@@ -18,8 +18,13 @@
 # along
 # with this program; if not, see <http://www.gnu.org/licenses>.
 
+import bz2
+import gzip
+import lzma
 import os
 import pytest
+import shutil
+import stat
 import subprocess  # nosec - unit test support.
 import unittest
 
@@ -27,6 +32,8 @@ from tests.utils import infrastructure_error
 from lava_common.exceptions import InfrastructureError, JobError
 from lava_common.utils import debian_filename_version
 from lava_dispatcher.action import Action
+from lava_dispatcher.actions.deploy.testdef import GitRepoAction
+from lava_dispatcher.job import Job
 from lava_dispatcher.actions.deploy import (  # pylint: disable=unused-import
     strategies as deploy_strategies,
 )
@@ -37,6 +44,14 @@ from lava_dispatcher.actions.test import (  # pylint: disable=unused-import
     strategies as test_strategies,
 )
 from lava_dispatcher.utils import vcs, installers
+from lava_dispatcher.utils.cache import DownloadCache, OverlayCache
+from lava_dispatcher.utils import compression
+from lava_dispatcher.utils.compression import (
+    compress_file,
+    cpio_append,
+    cpio_newc,
+    cpio_symlinks,
+)
 from lava_dispatcher.utils.decorator import replace_exception
 from lava_dispatcher.utils.shell import which
 
@@ -169,6 +184,383 @@ def test_no_history(setup, tmpdir):
     assert not (tmpdir / "git.clone1" / ".git").exists()
 
 
+def test_clone_cache(setup, tmpdir):
+    cache = vcs.GitCache(str(tmpdir / "cache"))
+    git = vcs.GitHelper("git", cache=cache)
+    assert git.clone("git.clone1") == "a7af835862da0e0592eeeac901b90e8de2cf5b67"
+    assert git.cache_hit is False
+    mirrors = [p for p in (tmpdir / "cache").listdir() if p.ext == ".git"]
+    assert len(mirrors) == 1
+
+    # The mirror is updated before each clone
+    with open(str(tmpdir / "git" / "fourth.txt"), "w") as f_data:
+        f_data.write("4444")
+    subprocess.check_output(  # nosec - unit test support.
+        ["git", "-C", "git", "add", "fourth.txt"]
+    )
+    subprocess.check_output(  # nosec - unit test support.
+        ["git", "-C", "git", "commit", "-q", "-m", "Fourth commit"],
+        env={
+            "GIT_AUTHOR_NAME": "Foo Bar",
+            "GIT_AUTHOR_EMAIL": "foo@example.com",
+            "GIT_COMMITTER_NAME": "Foo Bar",
+            "GIT_COMMITTER_EMAIL": "foo@example.com",
+        },
+    )
+    head = (
+        subprocess.check_output(  # nosec - unit test support.
+            ["git", "-C", "git", "log", "-1", "--pretty=%H"]
+        )
+        .decode()
+        .strip()
+    )
+    git = vcs.GitHelper("git", cache=cache)
+    assert git.clone("git.clone2", shallow=True) == head
+    assert git.cache_hit is True
+    assert (
+        subprocess.check_output(  # nosec - unit test support.
+            ["git", "-C", "git.clone2", "rev-list", "--count", "HEAD"]
+        ).strip()
+        == b"1"
+    )
+    # The clone points to the original repository
+    assert (
+        subprocess.check_output(  # nosec - unit test support.
+            ["git", "-C", "git.clone2", "remote", "get-url", "origin"]
+        ).strip()
+        == b"git"
+    )
+    assert (
+        git.clone("git.clone3", branch="testing")
+        == "f2589a1b7f0cfc30ad6303433ba4d5db1a542c2d"
+    )
+
+    with pytest.raises(InfrastructureError):
+        vcs.GitHelper("does_not_exists", cache=cache).clone("foo.bar")
+
+
+def test_clone_cache_eviction(setup, tmpdir):
+    subprocess.check_output(  # nosec - unit test support.
+        ["git", "clone", "-q", "git", "git2"]
+    )
+    cache = vcs.GitCache(str(tmpdir / "cache"), size_limit=0)
+    assert vcs.GitHelper("git", cache=cache).clone("git.clone1")
+    assert vcs.GitHelper("git2", cache=cache).clone("git.clone2")
+    # The mirrors are removed when over the limit
+    assert [p for p in (tmpdir / "cache").listdir() if p.ext == ".git"] == []
+
+    cache.size_limit = 10 * 1024 * 1024
+    assert vcs.GitHelper("git", cache=cache).clone("git.clone3")
+    assert vcs.GitHelper("git2", cache=cache).clone("git.clone4")
+    mirrors = sorted(p for p in (tmpdir / "cache").listdir() if p.ext == ".git")
+    assert len(mirrors) == 2
+    # Least recently used first
+    os.utime(str(mirrors[0]), (0, 0))
+    cache.size_limit = cache._size(str(mirrors[1]))
+    cache.evict()
+    assert [p for p in (tmpdir / "cache").listdir() if p.ext == ".git"] == [mirrors[1]]
+
+
+def test_git_cache_config():
+    assert vcs.GitCache.from_config({}) is None
+    cache = vcs.GitCache.from_config({"git_cache_path": "/var/cache/git"})
+    assert cache.path == "/var/cache/git"
+    assert cache.size_limit == 10 * 1024 * 1024 * 1024
+
+
+def test_download_cache(tmpdir):
+    assert DownloadCache.from_config({}) is None
+    cache = DownloadCache.from_config({"download_cache_path": str(tmpdir / "cache")})
+    assert cache.size_limit == 50 * 1024 * 1024 * 1024
+
+    # Files without checksum nor validators are not cached
+    assert cache.key("http://example.com/a", {"size": 4}, {}) is None
+    key1 = cache.key("http://example.com/a", {"etag": "1"}, {})
+    assert key1 != cache.key("http://example.com/a", {"etag": "2"}, {})
+    assert key1 != cache.key("http://example.com/a", {"etag": "1"}, {}, "unxz")
+    key2 = cache.key("http://example.com/b", {}, {"sha256sum": None, "md5": "AB"})
+    assert key2 == cache.key("http://example.com/c", {"etag": "1"}, {"md5": "ab"})
+
+    for (key, data) in [(key1, "hello"), (key2, "world!")]:
+        (tmpdir / key).write_text(data, encoding="utf-8")
+        with cache.lock(key) as entry:
+            assert cache.get(entry) is None
+            cache.add(entry, str(tmpdir / key), {"url": key, "size": 12})
+            assert cache.get(entry) == {
+                "url": key,
+                "size": 12,
+                "stored_size": len(data),
+            }
+            assert cache.retrieve(entry, str(tmpdir / "copy")) in [True, False]
+            assert (tmpdir / "copy").read_text(encoding="utf-8") == data
+
+    # Least recently used first
+    os.utime(str(tmpdir / "cache" / key2 + ".data"), (0, 0))
+    assert [e["key"] for e in cache.entries()] == [key2, key1]
+    cache.size_limit = 10
+    cache.evict()
+    assert [e["key"] for e in cache.entries()] == [key1]
+
+    # The entries used by running jobs are kept
+    with cache.lock(key1):
+        assert cache.purge() == 0
+    assert cache.purge() == 1
+    assert cache.entries() == []
+
+
+def test_overlay_cache(tmpdir):
+    assert OverlayCache.from_config({"download_cache_path": "/cache"}) is None
+    cache = OverlayCache.from_config({"overlay_cache_path": str(tmpdir / "cache")})
+    assert cache.size_limit == 10 * 1024 * 1024 * 1024
+
+    key = cache.key("https://example.com/tests.git", "a" * 40, {"history": True})
+    assert key != cache.key("https://example.com/tests.git", "b" * 40, {})
+    assert key != cache.key(
+        "https://example.com/tests.git", "a" * 40, {"history": False}
+    )
+
+    (tmpdir / "checkout" / "smoke").ensure(dir=True)
+    (tmpdir / "checkout" / "smoke" / "smoke.yaml").write_text("run", encoding="utf-8")
+    with cache.lock(key) as entry:
+        assert cache.get(entry) is None
+        cache.store(entry, str(tmpdir / "checkout"), {"url": "tests.git@aaaa"})
+        assert cache.get(entry)["url"] == "tests.git@aaaa"
+        cache.extract(entry, str(tmpdir / "copy"))
+    assert (tmpdir / "copy" / "smoke" / "smoke.yaml").read_text("utf-8") == "run"
+    assert [e["key"] for e in cache.entries()] == [key]
+    assert cache.purge() == 1
+
+    with cache.lock(key) as entry:
+        with pytest.raises(InfrastructureError):
+            cache.extract(entry, str(tmpdir / "copy"))
+
+
+def test_overlay_cache_git_repo(mocker, tmpdir):
+    mocker.patch("lava_dispatcher.actions.deploy.testdef.RepoAction.run")
+    store_testdef = mocker.patch(
+        "lava_dispatcher.actions.deploy.testdef.RepoAction.store_testdef"
+    )
+
+    def clone(path, **kwargs):
+        os.makedirs(path)
+        with open(os.path.join(path, "smoke.yaml"), "w") as f_out:
+            f_out.write("metadata:\n  name: smoke\n")
+        return kwargs["revision"]
+
+    def run(revision):
+        action = GitRepoAction()
+        action.job = Job(
+            1234, {"dispatcher": {"overlay_cache_path": str(tmpdir / "cache")}}, None
+        )
+        action.parameters = {
+            "repository": "https://example.com/tests.git",
+            "path": "smoke.yaml",
+            "revision": revision,
+            "test_name": "0_smoke",
+            "namespace": "common",
+        }
+        action.vcs = mocker.Mock(cache_hit=None)
+        action.vcs.clone.side_effect = clone
+        action.set_namespace_data(
+            action="uuid",
+            label="overlay_path",
+            key="0_smoke",
+            value=str(tmpdir / "overlay" / "0_smoke"),
+        )
+        action.run(None, None)
+        return (action.results, action.vcs.clone.call_count)
+
+    sha1 = "0123456789abcdef0123456789abcdef01234567"
+    assert run(sha1) == (
+        {
+            "commit": sha1,
+            "repository": "https://example.com/tests.git",
+            "path": "smoke.yaml",
+            "overlay-cache": "miss",
+        },
+        1,
+    )
+    assert run(sha1)[0]["overlay-cache"] == "hit"
+    assert run(sha1)[1] == 0
+    assert (tmpdir / "overlay" / "0_smoke" / "smoke.yaml").exists()
+    store_testdef.assert_called_with({"metadata": {"name": "smoke"}}, "git", sha1)
+
+    # Branches and tags are not cached
+    assert "overlay-cache" not in run("master")[0]
+    assert len(OverlayCache(str(tmpdir / "cache")).entries()) == 1
+
+    # Failing to store the checkout does not fail the job
+    mocker.patch(
+        "lava_dispatcher.utils.cache.OverlayCache.store",
+        side_effect=OSError("No space left on device"),
+    )
+    sha1 = "1" * 40
+    assert run(sha1) == (
+        {
+            "commit": sha1,
+            "repository": "https://example.com/tests.git",
+            "path": "smoke.yaml",
+            "overlay-cache": "miss",
+        },
+        1,
+    )
+    assert len(OverlayCache(str(tmpdir / "cache")).entries()) == 1
+
+
+def read_newc(data):
+    # Return the (name, mode, content) of the entries of concatenated archives
+    entries = []
+    offset = 0
+    while offset < len(data):
+        if data[offset] == 0:
+            offset += 1
+            continue
+        assert offset % 4 == 0
+        header = data[offset : offset + 110]
+        assert header[:6] == b"070701"
+        (mode, size, namesize) = [
+            int(header[start : start + 8], 16) for start in [14, 54, 94]
+        ]
+        name = data[offset + 110 : offset + 110 + namesize - 1].decode("utf-8")
+        offset += 110 + namesize + (-(110 + namesize) % 4)
+        entries.append((name, mode, data[offset : offset + size]))
+        offset += size + (-size % 4)
+    return entries
+
+
+def test_cpio_newc(tmpdir):
+    (tmpdir / "root" / "lib" / "modules").ensure(dir=True)
+    (tmpdir / "root" / "lib" / "modules" / "mod.ko").write_binary(b"12345")
+    (tmpdir / "root" / "version").write_binary(b"1.0\n")
+    os.symlink("lib", str(tmpdir / "root" / "link"))
+
+    cpio_newc(str(tmpdir / "root"), str(tmpdir / "root.cpio"))
+    entries = read_newc((tmpdir / "root.cpio").read_binary())
+    assert [(e[0], stat.S_IFMT(e[1]), e[2]) for e in entries] == [
+        ("lib", stat.S_IFDIR, b""),
+        ("link", stat.S_IFLNK, b"lib"),
+        ("version", stat.S_IFREG, b"1.0\n"),
+        ("lib/modules", stat.S_IFDIR, b""),
+        ("lib/modules/mod.ko", stat.S_IFREG, b"12345"),
+        ("TRAILER!!!", 0, b""),
+    ]
+    assert cpio_symlinks(str(tmpdir / "root.cpio"), None) == {"link"}
+    assert cpio_symlinks(str(tmpdir / "root.cpio"), None, {"lib", "link"}) == {"link"}
+    assert cpio_symlinks(str(tmpdir / "root.cpio"), None, {"lib"}) == set()
+
+
+def test_cpio_symlinks_wanted(mocker, tmpdir):
+    (tmpdir / "root" / "lib").ensure(dir=True)
+    os.symlink("lib", str(tmpdir / "root" / "link"))
+    (tmpdir / "root" / "version").write_binary(b"1.0\n")
+    cpio_newc(str(tmpdir / "root"), str(tmpdir / "root.cpio"))
+
+    # The archive is only read until the wanted entries are found
+    skip = mocker.patch(
+        "lava_dispatcher.utils.compression._skip", side_effect=compression._skip,
+    )
+    assert cpio_symlinks(str(tmpdir / "root.cpio"), None, {"link"}) == {"link"}
+    assert skip.call_count == 2
+    assert cpio_symlinks(str(tmpdir / "root.cpio"), None, set()) == set()
+    assert skip.call_count == 2
+
+    # Truncated archive
+    data = (tmpdir / "root.cpio").read_binary()
+    (tmpdir / "truncated.cpio").write_binary(data[:200])
+    with pytest.raises(InfrastructureError):
+        cpio_symlinks(str(tmpdir / "truncated.cpio"), None)
+
+
+@pytest.mark.parametrize("algorithm", ["xz", "zstd"])
+def test_cpio_symlinks_command(tmpdir, algorithm):
+    if shutil.which(algorithm) is None:
+        pytest.skip("%s is not installed" % algorithm)
+    (tmpdir / "root" / "lib").ensure(dir=True)
+    (tmpdir / "root" / "data").write_binary(os.urandom(3 * 1024 * 1024))
+    os.symlink("lib", str(tmpdir / "root" / "link"))
+    cpio_newc(str(tmpdir / "root"), str(tmpdir / "root.cpio"))
+    filename = compress_file(str(tmpdir / "root.cpio"), algorithm, threads=2)
+
+    assert cpio_symlinks(filename, algorithm) == {"link"}
+    assert cpio_symlinks(filename, algorithm, {"lib"}) == set()
+
+    (tmpdir / "invalid").write_binary(b"invalid")
+    with pytest.raises(InfrastructureError):
+        cpio_symlinks(str(tmpdir / "invalid"), algorithm)
+
+
+def test_cpio_append(tmpdir):
+    (tmpdir / "ramdisk" / "usr" / "lib").ensure(dir=True)
+    os.symlink("usr/lib", str(tmpdir / "ramdisk" / "lib"))
+    cpio_newc(str(tmpdir / "ramdisk"), str(tmpdir / "ramdisk.cpio"))
+    with open(str(tmpdir / "ramdisk.cpio"), "rb") as f_in:
+        with gzip.open(str(tmpdir / "ramdisk.cpio.gz"), "wb") as f_out:
+            f_out.write(f_in.read())
+    original = (tmpdir / "ramdisk.cpio.gz").read_binary()
+
+    (tmpdir / "overlay" / "lib" / "modules").ensure(dir=True)
+    (tmpdir / "overlay" / "lib" / "modules" / "mod.ko").write_binary(b"12345")
+    (tmpdir / "overlay" / "lava-1234").ensure(dir=True)
+    cpio_append(str(tmpdir / "overlay"), str(tmpdir / "ramdisk.cpio.gz"), "gz")
+
+    # The original archive is kept as-is
+    data = (tmpdir / "ramdisk.cpio.gz").read_binary()
+    assert data.startswith(original)
+    assert sorted(os.listdir(str(tmpdir))) == [
+        "overlay",
+        "ramdisk",
+        "ramdisk.cpio",
+        "ramdisk.cpio.gz",
+    ]
+    # The lib directory is not archived as it's a symlink in the ramdisk
+    with gzip.open(str(tmpdir / "ramdisk.cpio.gz"), "rb") as f_in:
+        names = [e[0] for e in read_newc(f_in.read())]
+    assert names == [
+        "lib",
+        "usr",
+        "usr/lib",
+        "TRAILER!!!",
+        "lava-1234",
+        "lib/modules",
+        "lib/modules/mod.ko",
+        "TRAILER!!!",
+    ]
+
+
+@pytest.mark.parametrize("algorithm,module", [("gz", gzip), ("bz2", bz2), ("xz", lzma)])
+def test_compress_file_python(mocker, tmpdir, algorithm, module):
+    mocker.patch.dict(compression.parallel_compress_block_size, {algorithm: 1000})
+    mocker.patch("shutil.which", return_value=None)
+    data = b"".join(b"%d\n" % i for i in range(10000)) + os.urandom(5000)
+    (tmpdir / "data").write_binary(data)
+
+    filename = compress_file(str(tmpdir / "data"), algorithm, threads=3)
+    assert filename == str(tmpdir / "data") + "." + algorithm
+    assert not (tmpdir / "data").exists()
+    with module.open(filename, "rb") as f_in:
+        assert f_in.read() == data
+
+    # Empty file
+    (tmpdir / "empty").write_binary(b"")
+    filename = compress_file(str(tmpdir / "empty"), algorithm, threads=3)
+    with module.open(filename, "rb") as f_in:
+        assert f_in.read() == b""
+
+
+def test_compress_file_command(tmpdir):
+    if shutil.which("xz") is None:
+        pytest.skip("xz is not installed")
+    (tmpdir / "data").write_binary(b"hello world\n" * 1000)
+    filename = compress_file(str(tmpdir / "data"), "xz", threads=2)
+    assert filename == str(tmpdir / "data.xz")
+    assert not (tmpdir / "data").exists()
+    with lzma.open(filename, "rb") as f_in:
+        assert f_in.read() == b"hello world\n" * 1000
+
+    with pytest.raises(JobError):
+        compress_file(str(tmpdir / "data"), "zip")
+
+
 ALLOWED = ["commands", "deploy", "test"]
 
 
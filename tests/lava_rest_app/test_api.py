@@ -31,7 +31,7 @@ from django.utils import timezone
 from rest_framework.test import APIClient
 
 from lava_common.version import __version__
-from lava_common.compat import yaml_load
+from lava_common.compat import yaml_dump, yaml_load
 from lava_scheduler_app.models import (
     Alias,
     Device,
@@ -228,6 +228,8 @@ class TestRestApi:
     def hit(self, client, url):
         response = client.get(url)
         assert response.status_code == 200  # nosec - unit test support
+        if response.streaming:
+            return b"".join(response.streaming_content).decode("utf-8")
         if hasattr(response, "content"):
             text = response.content.decode("utf-8")
             if response["Content-Type"] == "application/json":
@@ -332,6 +334,34 @@ class TestRestApi:
         )
         assert response.status_code == 404  # nosec - unit test support
 
+    def test_testjob_timing(self, monkeypatch, tmpdir):
+        (tmpdir / "output.timing").write_text(
+            '["start", "1", "tftp-deploy", 600.0, 2]\n'
+            '["end", "1", "tftp-deploy", 90.0, 6]\n',
+            encoding="utf-8",
+        )
+        monkeypatch.setattr(TestJob, "output_dir", str(tmpdir))
+
+        data = self.hit(
+            self.userclient,
+            reverse("api-root", args=[self.version])
+            + "jobs/%s/timing/" % self.public_testjob1.id,
+        )
+        assert data == {  # nosec - unit test support
+            "pipeline": [
+                {
+                    "level": "1",
+                    "name": "tftp-deploy",
+                    "duration": 90.0,
+                    "timeout": 600.0,
+                    "near_timeout": False,
+                    "line": 2,
+                }
+            ],
+            "total_duration": 90.0,
+            "max_duration": 90.0,
+        }
+
     def test_testjob_nologs(self):
         response = self.userclient.get(
             reverse("api-root", args=[self.version])
@@ -1591,6 +1621,32 @@ ok 2 bar
         )
         assert response.status_code == 403  # nosec
 
+    def test_system_logs_stats(self, monkeypatch, tmpdir):
+        monkeypatch.setattr(settings, "MEDIA_ROOT", str(tmpdir))
+        url = reverse("api-root", args=[self.version]) + "system/logs_stats/"
+        response = self.hit(self.userclient, url)
+        assert response == {"time": None, "shards": []}  # nosec
+
+        stats = {
+            "time": 1586217600.0,
+            "shards": [
+                {
+                    "shard": 0,
+                    "pid": 1234,
+                    "forwarded": 100,
+                    "handled": 90,
+                    "lag": 10,
+                    "jobs": 2,
+                }
+            ],
+        }
+        (tmpdir / "lava-logs-stats.yaml").write_text(yaml_dump(stats), encoding="utf-8")
+        response = self.hit(self.userclient, url)
+        assert response == stats  # nosec
+
+        response = self.userclient_no_token.get(url)
+        assert response.status_code == 403  # nosec
+
 
 def test_view_root(client):
     ret = client.get(reverse("api-root", args=[versions.versions[-1]]) + "?format=api")
@@ -0,0 +1,124 @@
+import csv
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+import tap
+
+from django.contrib.auth.models import User
+
+from lava_common.compat import yaml_safe_load
+from lava_results_app.export import (
+    export_csv,
+    export_junit,
+    export_tap13,
+    export_yaml,
+    job_testcases,
+)
+from lava_results_app.models import TestCase, TestSuite
+from lava_results_app.utils import export_testcase, get_testcases_with_limit
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+@pytest.fixture
+def job(db):
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    dt = DeviceType.objects.create(name="qemu")
+    job = TestJob.objects.create(
+        definition="{}",
+        submitter=user,
+        requested_device_type=dt,
+        state=TestJob.STATE_FINISHED,
+    )
+    for name in ["lava", "empty", "smoke"]:
+        suite = TestSuite.objects.create(job=job, name=name)
+        if name == "empty":
+            continue
+        TestCase.objects.bulk_create(
+            [
+                TestCase(
+                    suite=suite,
+                    name="case-%d" % i,
+                    result=i % 3,
+                    metadata={"case": "case-%d" % i, "duration": "%d.5" % i}
+                    if name == "lava"
+                    else None,
+                )
+                for i in range(5)
+            ]
+        )
+    return job
+
+
+def test_export_csv_yaml(job, django_assert_num_queries):
+    expected = [
+        export_testcase(test_case)
+        for suite in job.testsuite_set.order_by("id")
+        for test_case in suite.testcase_set.order_by("id")
+    ]
+    # One query, whatever the number of suites
+    with django_assert_num_queries(1):
+        data = "".join(export_csv(job_testcases(job)))
+    rows = list(csv.DictReader(data.splitlines()))
+    assert [r["id"] for r in rows] == [e["id"] for e in expected]  # nosec
+    for (row, case) in zip(rows, expected):
+        for (key, value) in case.items():
+            assert row[key] == str(value)  # nosec
+
+    with django_assert_num_queries(1):
+        data = "".join(export_yaml(job_testcases(job)))
+    assert yaml_safe_load(data) == expected  # nosec
+    assert yaml_safe_load("".join(export_yaml(TestCase.objects.none()))) == []  # nosec
+
+
+def test_export_limit(job):
+    suite = job.testsuite_set.get(name="smoke")
+    names = [tc.name for tc in get_testcases_with_limit(suite, "2", "1")]
+    assert names == ["case-1", "case-2"]  # nosec
+    assert len(get_testcases_with_limit(suite, 0, 3)) == 5  # nosec
+    assert len(get_testcases_with_limit(suite, "a")) == 0  # nosec
+    assert len(get_testcases_with_limit(suite, 2, -1)) == 0  # nosec
+
+
+def test_export_junit(job):
+    tree = ET.fromstring("".join(export_junit(job)))
+    assert tree.tag == "testsuites"  # nosec
+    assert tree.attrib == {  # nosec
+        "disabled": "0",
+        "errors": "4",
+        "failures": "0",
+        "tests": "10",
+        "time": "12.5",
+    }
+    assert [s.attrib["name"] for s in tree] == ["lava", "empty", "smoke"]  # nosec
+    assert tree[0].attrib == {  # nosec
+        "name": "lava",
+        "disabled": "0",
+        "errors": "2",
+        "failures": "0",
+        "skipped": "1",
+        "time": "12.5",
+        "tests": "5",
+    }
+    assert len(tree[1]) == 0  # nosec
+    assert tree[2].attrib["time"] == "0"  # nosec
+
+    cases = list(tree[0])
+    assert [c.attrib["name"] for c in cases] == ["case-%d" % i for i in range(5)]
+    assert cases[1].attrib["time"] == "1.500000"  # nosec
+    assert [e.tag for e in cases[1]] == ["error"]  # nosec
+    assert [e.tag for e in cases[2]] == ["skipped"]  # nosec
+
+
+def test_export_tap13(job):
+    # Same output as the tap tracker
+    stream = io.StringIO()
+    tracker = tap.tracker.Tracker(plan=10, streaming=True, stream=stream)
+    for case in job_testcases(job).select_related("suite"):
+        if case.result == TestCase.RESULT_FAIL:
+            tracker.add_not_ok(case.suite.name, case.name)
+        elif case.result == TestCase.RESULT_SKIP:
+            tracker.add_skip(case.suite.name, case.name, "test skipped")
+        else:
+            tracker.add_ok(case.suite.name, case.name)
+    assert "".join(export_tap13(job)) == stream.getvalue()  # nosec
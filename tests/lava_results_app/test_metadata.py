@@ -17,7 +17,11 @@ from lava_results_app.dbutils import (
     _get_action_metadata,
 )
 from lava_results_app.models import ActionData, MetaType, TestData, TestCase, TestSuite
-from lava_results_app.utils import export_testcase, testcase_export_fields
+from lava_results_app.utils import (
+    export_testcase,
+    load_extra_metadata,
+    testcase_export_fields,
+)
 from lava_dispatcher.parser import JobParser
 from lava_dispatcher.device import PipelineDevice
 from tests.lava_dispatcher.test_defs import allow_missing_path
@@ -127,7 +131,44 @@ class TestMetaTypes(TestCaseWithFactory):
             "result": "pass",
         }
         test_case = map_scanned_results(test_dict, job, {}, None)
-        self.assertEqual(yaml_load(test_case.metadata)["measurement"], "1234.5")
+        test_case.save()
+        test_case.refresh_from_db()
+        self.assertEqual(test_case.metadata["measurement"], "1234.5")
+
+    def test_metadata_json(self):
+        job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
+        test_dict = {
+            "definition": "unit-test",
+            "case": "unit-test",
+            "level": "1.3.5",
+            "result": "pass",
+        }
+        map_scanned_results(test_dict, job, {}, None).save()
+        # The metadata can be queried
+        test_case = TestCase.objects.get(suite__job=job, metadata__level="1.3.5")
+        self.assertEqual(test_case.action_metadata, test_dict)
+
+        # Metadata too long is dropped
+        test_dict["case"] = "too-long"
+        test_dict["error_msg"] = "x" * TestCase.METADATA_MAX_LENGTH
+        test_case = map_scanned_results(test_dict, job, {}, None)
+        self.assertIsNone(test_case.metadata)
+        self.assertIsNone(test_case.action_metadata)
+
+        # Metadata that cannot be encoded in JSON is dropped
+        for value in [b"bytes", {"a", "set"}]:
+            test_dict = {
+                "definition": "unit-test",
+                "case": "not-json",
+                "value": value,
+                "result": "pass",
+            }
+            test_case = map_scanned_results(test_dict, job, {}, None)
+            self.assertIsNotNone(test_case)
+            self.assertIsNone(test_case.metadata)
+            test_case.save()
+        job.refresh_from_db()
+        self.assertIn("Unable to store the result metadata", job.failure_comment)
 
     def test_case_as_url(self):
         job = TestJob.from_yaml_and_user(self.factory.make_job_yaml(), self.user)
@@ -165,7 +206,6 @@ class TestMetaTypes(TestCaseWithFactory):
         )
 
     def test_metastore(self):
-        field = TestCase._meta.get_field("metadata")
         level = "1.3.5.1"
         # artificially inflate results to represent a set of kernel messages
         results = {
@@ -173,7 +213,7 @@ class TestMetaTypes(TestCaseWithFactory):
             "case": "unit-test",
             "level": level,
             # list of numbers, generates a much longer YAML string than just the count
-            "extra": list(range(int(field.max_length / 2))),
+            "extra": list(range(int(TestCase.METADATA_MAX_LENGTH / 2))),
             "result": "pass",
         }
         stub = "%s-%s-%s.yaml" % (results["definition"], results["case"], level)
@@ -196,12 +236,17 @@ class TestMetaTypes(TestCaseWithFactory):
         self.assertIsNotNone(ret)
         ret.save()
         self.assertEqual(TestCase.objects.filter(name="unit-test").count(), 1)
-        test_data = yaml_load(TestCase.objects.filter(name="unit-test")[0].metadata)
+        test_data = TestCase.objects.filter(name="unit-test")[0].metadata
         self.assertEqual(test_data["extra"], meta_filename)
         self.assertTrue(os.path.exists(meta_filename))
         with open(test_data["extra"], "r") as extra_file:
             data = yaml_load(extra_file)
         self.assertIsNotNone(data)
+        # The cached content is not shared with the callers
+        extra = load_extra_metadata(meta_filename)
+        self.assertEqual(extra, data)
+        extra.append("modified")
+        self.assertEqual(load_extra_metadata(meta_filename), data)
         os.unlink(meta_filename)
         shutil.rmtree(job.output_dir)
 
@@ -10,7 +10,6 @@ from lava_results_app.models import TestCase, TestSuite
 from lava_results_app.dbutils import map_scanned_results
 from lava_scheduler_app.models import TestJob, Device, DeviceType
 
-from six import string_types
 
 # note: when creating extensions, ensure a urls.py and views.py exist
 
@@ -166,7 +165,7 @@ class TestTestSuite(TestCaseWithFactory):
         ret.save()
         self.assertEqual(1, TestCase.objects.filter(suite=suite).count())
         testcase = TestCase.objects.get(suite=suite)
-        self.assertTrue(isinstance(testcase.metadata, string_types))
+        self.assertTrue(isinstance(testcase.metadata, dict))
         self.assertEqual(testcase.result, TestCase.RESULT_PASS)
         self.factory.cleanup()
 
@@ -0,0 +1,124 @@
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+
+import pytest
+
+from lava_results_app.models import (
+    Query,
+    QueryCondition,
+    QueryMaterializedView,
+    TestCase,
+    TestSuite,
+)
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+def create_job(user, dt, suite="smoke", count=2):
+    job = TestJob.objects.create(
+        definition="{}",
+        submitter=user,
+        requested_device_type=dt,
+        state=TestJob.STATE_FINISHED,
+    )
+    suite = TestSuite.objects.create(job=job, name=suite)
+    for i in range(count):
+        TestCase.objects.create(
+            suite=suite, name="case-%d" % i, result=TestCase.RESULT_PASS
+        )
+    return job
+
+
+def create_query(user, name):
+    query = Query.objects.create(
+        owner=user, name=name, content_type=ContentType.objects.get_for_model(TestCase),
+    )
+    QueryCondition.objects.create(
+        query=query,
+        table=ContentType.objects.get_for_model(TestSuite),
+        field="name",
+        operator=QueryCondition.EXACT,
+        value="smoke",
+    )
+    return query
+
+
+def view_indexes(query):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s",
+            ["%s%d" % (QueryMaterializedView.QUERY_VIEW_PREFIX, query.id)],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@pytest.fixture
+def setup(db):
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    dt = DeviceType.objects.create(name="qemu")
+    return (user, dt)
+
+
+def test_refresh_view(setup):
+    user, dt = setup
+    create_job(user, dt)
+    query = create_query(user, "smoke")
+
+    assert query.refresh_view() is True  # nosec
+    assert query.has_view()  # nosec
+    assert view_indexes(query) == ["query_%d_id" % query.id]  # nosec
+    assert query.refresh_duration is not None  # nosec
+    assert query.get_results(user).count() == 2  # nosec
+
+    # Nothing changed
+    last_updated = query.last_updated
+    assert query.refresh_view() is False  # nosec
+    assert query.last_updated > last_updated  # nosec
+    # Changes that do not match the conditions
+    create_job(user, dt, suite="ltp")
+    assert query.refresh_view() is False  # nosec
+    # Matching changes
+    create_job(user, dt)
+    assert query.refresh_view() is True  # nosec
+    assert query.get_results(user).count() == 4  # nosec
+    assert query.refresh_view(force=True) is True  # nosec
+
+    # Views created without the unique index are still refreshed concurrently
+    QueryMaterializedView.drop(query.id)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE MATERIALIZED VIEW query_%d AS SELECT * FROM lava_results_app_testcase"
+            % query.id
+        )
+    assert view_indexes(query) == []  # nosec
+    assert query.refresh_view(force=True) is True  # nosec
+    assert view_indexes(query) == ["query_%d_id" % query.id]  # nosec
+
+
+def test_refresh_views(transactional_db):
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    dt = DeviceType.objects.create(name="qemu")
+    create_job(user, dt)
+    queries = [create_query(user, "smoke-%d" % i) for i in range(4)]
+    live = create_query(user, "live")
+    live.is_live = True
+    live.save()
+    try:
+        results = list(Query.refresh_views(queries + [live], workers=3))
+        assert len(results) == 5  # nosec
+        for query, refreshed, exc in results:
+            if query.is_live:
+                assert refreshed is False  # nosec
+                assert exc is not None  # nosec
+            else:
+                assert (refreshed, exc) == (True, None)  # nosec
+        for query in Query.objects.filter(is_live=False):
+            assert query.refresh_duration is not None  # nosec
+            assert query.is_updating is False  # nosec
+            assert query.get_results(user).count() == 2  # nosec
+
+        results = list(Query.refresh_views(queries, workers=3))
+        assert [r[1:] for r in results] == [(False, None)] * 4  # nosec
+    finally:
+        for query in queries:
+            query.delete()
@@ -0,0 +1,143 @@
+import decimal
+
+import pytest
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+
+from lava_results_app.models import ChartQuery, TestCase, TestSuite, TestSuiteSummary
+from lava_scheduler_app.models import DeviceType, TestJob
+
+
+@pytest.fixture
+def jobs(db):
+    user = User.objects.create_user(username="tester", password="tester")  # nosec
+    dt = DeviceType.objects.create(name="qemu")
+    jobs = []
+    for index in range(5):
+        job = TestJob.objects.create(
+            definition="{}",
+            submitter=user,
+            requested_device_type=dt,
+            state=TestJob.STATE_FINISHED,
+        )
+        for name in ["lava", "smoke"]:
+            suite = TestSuite.objects.create(job=job, name=name)
+            TestCase.objects.bulk_create(
+                [
+                    TestCase(
+                        suite=suite,
+                        name="case-%d" % i,
+                        result=i % 4,
+                        measurement=None if i % 2 else index + i,
+                    )
+                    for i in range(index + 3)
+                ]
+            )
+        jobs.append(job)
+    return jobs
+
+
+def test_summaries_add(jobs):
+    suite = TestSuite.objects.get(job=jobs[0], name="smoke")
+    # Computed from the database when missing
+    TestSuiteSummary.add(suite.testcase_set.all()[:1])
+    summary = TestSuiteSummary.objects.get(suite=suite)
+    assert (summary.passes, summary.failures, summary.skips) == (1, 1, 1)  # nosec
+    assert summary.measurement_count == 2  # nosec
+    assert summary.measurement_avg == 1  # nosec
+
+    # Then updated incrementally
+    test_cases = [
+        TestCase(suite=suite, name="new-1", result=TestCase.RESULT_FAIL),
+        TestCase(suite=suite, name="new-2", result=TestCase.RESULT_PASS),
+        TestCase(
+            suite=suite, name="new-3", result=TestCase.RESULT_PASS, measurement=-1
+        ),
+        TestCase(
+            suite=suite, name="new-4", result=TestCase.RESULT_PASS, measurement="9.5"
+        ),
+    ]
+    TestCase.objects.bulk_create(test_cases)
+    TestSuiteSummary.add(test_cases)
+    summary.refresh_from_db()
+    (expected,) = TestSuiteSummary.compute([suite.id])
+    for field in [
+        "passes",
+        "failures",
+        "skips",
+        "unknowns",
+        "measurement_count",
+        "measurement_sum",
+        "measurement_min",
+        "measurement_max",
+    ]:
+        assert getattr(summary, field) == getattr(expected, field)  # nosec
+    assert summary.measurement_min == -1  # nosec
+    assert summary.measurement_max == decimal.Decimal("9.5")  # nosec
+
+
+def test_summaries_add_concurrent(jobs, mocker):
+    suite = TestSuite.objects.get(job=jobs[0], name="smoke")
+    test_case = TestCase.objects.create(
+        suite=suite, name="new", result=TestCase.RESULT_PASS
+    )
+    compute = TestSuiteSummary.compute
+
+    def concurrent_compute(suite_ids):
+        # Another writer creates the summary, without the new test case
+        summaries = compute(suite_ids)
+        for summary in compute(suite_ids):
+            summary.passes -= 1
+            summary.save()
+        return summaries
+
+    mocker.patch.object(TestSuiteSummary, "compute", side_effect=concurrent_compute)
+    TestSuiteSummary.add([test_case])
+    summary = TestSuiteSummary.objects.get(suite=suite)
+    assert summary.passes == suite.testcase_count("pass")  # nosec
+
+
+def test_summaries_charts(jobs, django_assert_max_num_queries):
+    chart_query = ChartQuery()
+    query_results = TestJob.objects.filter(id__in=[j.id for j in jobs]).order_by("id")
+    # Without summaries
+    passfail = chart_query.get_chart_passfail_data(None, query_results)
+    measurement = chart_query.get_chart_measurement_data(None, query_results)
+    assert len(passfail) == 10  # nosec
+
+    call_command("results", "summaries")
+    assert TestSuiteSummary.objects.count() == 10  # nosec
+    # Two queries: one for the summaries and one for the jobs
+    with django_assert_max_num_queries(2):
+        assert (
+            chart_query.get_chart_passfail_data(None, query_results) == passfail
+        )  # nosec
+    with django_assert_max_num_queries(2):
+        assert (
+            chart_query.get_chart_measurement_data(None, query_results) == measurement
+        )  # nosec
+
+    # Test suites
+    query_results = TestSuite.objects.filter(job__in=jobs).order_by("id")
+    passfail = chart_query.get_chart_passfail_data(None, query_results)
+    TestSuiteSummary.objects.filter(suite__job=jobs[0]).delete()
+    assert chart_query.get_chart_passfail_data(None, query_results) == passfail  # nosec
+
+
+def test_summaries_command(jobs):
+    call_command("results", "summaries", "--batch-size", "3")
+    assert TestSuiteSummary.objects.count() == 10  # nosec
+
+    # Only finished jobs are summarized
+    TestSuiteSummary.objects.all().delete()
+    TestJob.objects.filter(id=jobs[0].id).update(state=TestJob.STATE_RUNNING)
+    call_command("results", "summaries")
+    assert TestSuiteSummary.objects.count() == 8  # nosec
+
+    # Recompute the summaries
+    TestSuiteSummary.objects.update(passes=1000)
+    call_command("results", "summaries")
+    assert TestSuiteSummary.objects.filter(passes=1000).count() == 8  # nosec
+    call_command("results", "summaries", "--force")
+    assert TestSuiteSummary.objects.filter(passes=1000).count() == 0  # nosec
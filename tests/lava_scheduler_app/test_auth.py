@@ -23,11 +23,15 @@ from itertools import chain
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission, AnonymousUser
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from lava_common.exceptions import PermissionNameError
-from lava_scheduler_app.auth import PermissionAuth
+from lava_scheduler_app.auth import PermissionAuth, filter_permitted, permission_cache
 from lava_scheduler_app.models import (
+    Device,
+    TestJob,
     GroupObjectPermission,
     GroupDeviceTypePermission,
     GroupDevicePermission,
@@ -223,3 +227,99 @@ class PermissionAuthTest(TestCaseWithFactory):
         group = GroupObjectPermission.ensure_users_group(test_user)
         self.assertEqual(test_user.groups.count(), 1)
         self.assertEqual(group.name, test_user.username)
+
+    def test_permission_cache(self):
+        auth = PermissionAuth(self.user)
+        GroupDevicePermission.objects.assign_perm(
+            "submit_to_device", self.group, self.device
+        )
+        with permission_cache():
+            self.assertEqual(
+                auth.get_group_perms(self.device), {"submit_to_device", "view_device"}
+            )
+            self.assertTrue(
+                self.device.is_permission_restricted(Device.SUBMIT_PERMISSION)
+            )
+            self.assertFalse(
+                self.device.is_permission_restricted(Device.CHANGE_PERMISSION)
+            )
+            # Memoised until the end of the block
+            GroupDevicePermission.objects.assign_perm(
+                "change_device", self.group, self.device
+            )
+            with self.assertNumQueries(0):
+                self.assertEqual(
+                    auth.get_group_perms(self.device),
+                    {"submit_to_device", "view_device"},
+                )
+                self.assertFalse(
+                    self.device.is_permission_restricted(Device.CHANGE_PERMISSION)
+                )
+        self.assertEqual(
+            auth.get_group_perms(self.device),
+            {"change_device", "submit_to_device", "view_device"},
+        )
+        self.assertTrue(self.device.is_permission_restricted(Device.CHANGE_PERMISSION))
+
+    def test_filter_permitted(self):
+        other_group = self.factory.make_group(name="group2")
+        for index in range(10):
+            device = self.factory.make_device(
+                device_type=self.device_type, hostname="qemu-tmp-%02d" % index
+            )
+            if index % 3 == 1:
+                GroupDevicePermission.objects.assign_perm(
+                    "view_device", self.group, device
+                )
+            elif index % 3 == 2:
+                GroupDevicePermission.objects.assign_perm(
+                    "view_device", other_group, device
+                )
+
+        for user in [self.user, self.admin_user, AnonymousUser()]:
+            for (perm, check) in [
+                (Device.VIEW_PERMISSION, Device.can_view),
+                (Device.CHANGE_PERMISSION, Device.can_change),
+                (Device.SUBMIT_PERMISSION, Device.can_submit),
+            ]:
+                devices = Device.objects.order_by("hostname")
+                expected = [d for d in devices if check(d, user)]
+                self.assertEqual(filter_permitted(user, perm, devices), expected)
+
+        # The number of queries does not depend on the number of devices
+        def count_queries(devices):
+            user = User.objects.get(pk=self.user.pk)
+            with CaptureQueriesContext(connection) as ctx:
+                filter_permitted(user, Device.VIEW_PERMISSION, devices)
+            return len(ctx)
+
+        self.assertEqual(
+            count_queries(Device.objects.all()[:3]),
+            count_queries(Device.objects.all()),
+        )
+
+    def test_filter_permitted_jobs(self):
+        other = self.factory.make_user()
+        jobs = [
+            TestJob.objects.create(
+                definition=self.definition,
+                submitter=other,
+                requested_device_type=self.device_type,
+                actual_device=self.device if index % 2 else None,
+                is_public=index != 3,
+            )
+            for index in range(6)
+        ]
+        jobs[4].viewing_groups.add(self.group)
+        jobs[5].viewing_groups.add(self.factory.make_group(name="group2"))
+        GroupDevicePermission.objects.assign_perm(
+            "view_device", self.factory.make_group(name="group3"), self.device
+        )
+
+        user = User.objects.get(pk=self.user.pk)
+        expected = [j for j in jobs if j.can_view(user)]
+        self.assertEqual([j.id for j in expected], [jobs[0].id, jobs[2].id, jobs[4].id])
+        jobs = TestJob.objects.order_by("id")
+        self.assertEqual(
+            filter_permitted(user, TestJob.VIEW_PERMISSION, jobs), expected
+        )
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020-present Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import jinja2
+import pytest
+
+from lava_scheduler_app.cache import DeviceCache, template_paths
+from lava_scheduler_app.models import Device
+from lava_server.files import File
+
+
+@pytest.fixture
+def templates(mocker, settings, tmpdir):
+    (tmpdir / "devices").mkdir()
+    (tmpdir / "device-types").mkdir()
+    (tmpdir / "health-checks").mkdir()
+    settings.HEALTH_CHECKS_PATH = str(tmpdir / "health-checks")
+    mocker.patch(
+        "lava_server.files.File.KINDS",
+        {
+            "device": ([str(tmpdir / "devices")], "{name}.jinja2"),
+            "device-type": ([str(tmpdir / "device-types")], "{name}.jinja2"),
+        },
+    )
+    mocker.patch(
+        "lava_scheduler_app.environment.devices",
+        lambda: jinja2.Environment(
+            loader=File("device").loader(), autoescape=False, trim_blocks=True
+        ),
+    )
+    cache = DeviceCache()
+    mocker.patch("lava_scheduler_app.models.device_cache", cache)
+
+    (tmpdir / "device-types" / "base.jinja2").write("key: {{ key }}\n")
+    (tmpdir / "device-types" / "qemu.jinja2").write("{% extends 'base.jinja2' %}\n")
+    (tmpdir / "devices" / "qemu01.jinja2").write(
+        "{% extends 'qemu.jinja2' %}\n{% set key = 'value' %}\n"
+    )
+    (tmpdir / "health-checks" / "qemu.yaml").write("job_name: hc\n")
+    return cache
+
+
+def test_template_paths(templates, tmpdir):
+    assert template_paths("qemu01.jinja2") == {
+        str(tmpdir / d / t)
+        for d in ["devices", "device-types"]
+        for t in ["qemu01.jinja2", "qemu.jinja2", "base.jinja2"]
+    }
+
+
+def test_device_cache(templates, tmpdir):
+    device = Device(hostname="qemu01")
+    assert device.load_configuration() == {"key": "value"}
+    assert device.load_configuration(output_format="yaml") == "key: value"
+    assert device.get_extends() == "qemu"
+    assert device.get_health_check() == "job_name: hc\n"
+    # get_health_check() is using get_extends()
+    assert templates.stats() == {"entries": 4, "hits": 1, "misses": 4}
+
+    # Cached values
+    assert device.load_configuration() == {"key": "value"}
+    assert device.load_configuration(output_format="yaml") == "key: value"
+    assert device.get_extends() == "qemu"
+    assert device.get_health_check() == "job_name: hc\n"
+    assert templates.stats() == {"entries": 4, "hits": 6, "misses": 4}
+
+    # The cached dictionary is not modified by the caller
+    device.load_configuration()["key"] = "other"
+    assert device.load_configuration() == {"key": "value"}
+
+    # Rendering with a job context is not cached
+    assert device.load_configuration({"key": "ctx"}) == {"key": "value"}
+    assert templates.stats()["misses"] == 4
+
+    # Updating a parent template
+    (tmpdir / "device-types" / "base.jinja2").write("key: {{ key }}-2\n")
+    assert device.load_configuration() == {"key": "value-2"}
+    assert device.get_extends() == "qemu"
+
+    # Overriding a parent template in the device directory
+    (tmpdir / "devices" / "base.jinja2").write("key: {{ key }}-3\n")
+    assert device.load_configuration() == {"key": "value-3"}
+
+    # Updating the health-check
+    (tmpdir / "health-checks" / "qemu.yaml").write("job_name: hc-2\n")
+    assert device.get_health_check() == "job_name: hc-2\n"
+
+
+def test_device_cache_watched(templates, tmpdir):
+    templates.watched = True
+    device = Device(hostname="qemu01")
+    assert device.load_configuration() == {"key": "value"}
+    assert device.get_extends() == "qemu"
+
+    # The files are not checked anymore
+    (tmpdir / "device-types" / "base.jinja2").write("key: {{ key }}-2\n")
+    assert device.load_configuration() == {"key": "value"}
+
+    templates.invalidate([str(tmpdir / "device-types" / "base.jinja2")])
+    assert device.load_configuration() == {"key": "value-2"}
+    assert templates.stats() == {"entries": 2, "hits": 1, "misses": 3}
+
+    # Saving the configuration invalidates the cache
+    assert device.save_configuration(
+        "{% extends 'base.jinja2' %}\n{% set key = 'new' %}\n"
+    )
+    assert device.load_configuration() == {"key": "new-2"}
+    assert device.get_extends() == "base"
@@ -18,9 +18,16 @@
 # along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
 
 import lzma
+import os
 import pytest
 
-from lava_scheduler_app.logutils import LogsFilesystem
+from lava_scheduler_app.logutils import (
+    LogsBlockCompressed,
+    LogsFilesystem,
+    compute_timing,
+    parse_lines,
+    read_timing,
+)
 
 
 @pytest.fixture
@@ -28,6 +35,12 @@ def logs_filesystem():
     return LogsFilesystem()
 
 
+@pytest.fixture
+def logs_blocks(monkeypatch):
+    monkeypatch.setattr(LogsBlockCompressed, "BLOCK_SIZE", 8)
+    return LogsBlockCompressed()
+
+
 def test_read_logs_uncompressed(mocker, tmpdir, logs_filesystem):
     job = mocker.Mock()
     job.output_dir = tmpdir
@@ -48,6 +61,7 @@ def test_read_logs_uncompressed(mocker, tmpdir, logs_filesystem):
     assert logs_filesystem.read(job, start=1, end=3) == "world\nhow\n"  # nosec
     assert logs_filesystem.read(job, start=4, end=5) == "you"  # nosec
     assert logs_filesystem.read(job, start=5, end=50) == ""  # nosec
+    assert logs_filesystem.line_count(job) == 5  # nosec
 
 
 def test_read_logs_compressed(mocker, tmpdir, logs_filesystem):
@@ -91,6 +105,171 @@ def test_write_logs(mocker, tmpdir, logs_filesystem):
             logs_filesystem.write(job, "how are you?\n".encode("utf-8"), f_logs, f_idx)
     assert logs_filesystem.read(job) == "hello world\nhow are you?\n"  # nosec
     assert logs_filesystem.size(job) == 25  # nosec
+    assert logs_filesystem.line_count(job) == 2  # nosec
     with open(str(tmpdir / "output.idx"), "rb") as f_idx:
         assert f_idx.read(8) == b"\x00\x00\x00\x00\x00\x00\x00\x00"  # nosec
         assert f_idx.read(8) == b"\x0c\x00\x00\x00\x00\x00\x00\x00"  # nosec
+
+
+def test_write_logs_buffered(mocker, tmpdir, logs_filesystem):
+    job = mocker.Mock()
+    job.output_dir = tmpdir
+    with open(str(tmpdir / "output.yaml"), "wb") as f_logs:
+        with open(str(tmpdir / "output.idx"), "wb") as f_idx:
+            logs_filesystem.write(
+                job, "hello world\n".encode("utf-8"), f_logs, f_idx, flush=False
+            )
+            logs_filesystem.write(
+                job, "how are you?\n".encode("utf-8"), f_logs, f_idx, flush=False
+            )
+            # Nothing written yet
+            assert logs_filesystem.size(job) == 0  # nosec
+            assert (tmpdir / "output.idx").size() == 0  # nosec
+
+            logs_filesystem.flush(job, f_logs, f_idx)
+            assert logs_filesystem.read(job) == "hello world\nhow are you?\n"  # nosec
+            assert logs_filesystem.read(job, start=1) == "how are you?\n"  # nosec
+
+            mocker.patch("os.fsync")
+            logs_filesystem.flush(job, f_logs, f_idx, sync=True)
+            assert os.fsync.call_count == 2  # nosec
+
+
+def test_compress_logs(mocker, tmpdir, logs_filesystem):
+    job = mocker.Mock()
+    job.output_dir = tmpdir
+    data = "hello\nworld\nhow\nare\nyou\n".encode("utf-8")
+    assert logs_filesystem.compress(job, data) == ["output.yaml.xz"]  # nosec
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "rb") as f_in:
+        assert f_in.read() == data  # nosec
+
+
+def test_compress_logs_blocks(mocker, tmpdir, logs_blocks):
+    job = mocker.Mock()
+    job.output_dir = tmpdir
+    lines = ["line %d with some text\n" % i for i in range(20)]
+    data = "".join(lines).encode("utf-8")
+    assert logs_blocks.compress(job, data) == [  # nosec
+        "output.yaml.xz",
+        "output.yaml.xz.idx",
+    ]
+    # The file is still a valid xz file
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "rb") as f_in:
+        assert f_in.read() == data  # nosec
+    assert len(logs_blocks._get_blocks(job)) == len(data) // 8 + 2  # nosec
+
+    assert logs_blocks.read(job) == "".join(lines)  # nosec
+    assert logs_blocks.read(job, start=1) == "".join(lines[1:])  # nosec
+    assert (tmpdir / "output.idx").exists()  # nosec
+    assert logs_blocks.read(job, start=1, end=2) == lines[1]  # nosec
+    assert logs_blocks.read(job, start=5, end=12) == "".join(lines[5:12])  # nosec
+    assert logs_blocks.read(job, start=19, end=50) == lines[19]  # nosec
+    assert logs_blocks.read(job, start=20, end=50) == ""  # nosec
+    assert logs_blocks.read(job, start=3, end=3) == ""  # nosec
+
+    # Only the needed blocks are decompressed
+    decompress = mocker.spy(lzma, "decompress")
+    assert logs_blocks.read(job, start=5, end=6) == lines[5]  # nosec
+    assert decompress.call_count <= 4  # nosec
+
+    # Empty logs
+    assert logs_blocks.compress(job, b"")  # nosec
+    (tmpdir / "output.idx").remove()
+    assert logs_blocks.read(job, start=1) == ""  # nosec
+
+
+def test_compress_logs_blocks_threads(mocker, tmpdir, logs_blocks, settings):
+    settings.LOG_COMPRESSION_THREADS = 3
+    job = mocker.Mock()
+    job.output_dir = tmpdir
+    data = "".join("line %d\n" % i for i in range(100)).encode("utf-8")
+    logs_blocks.compress(job, data)
+    # The blocks are kept in order
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "rb") as f_in:
+        assert f_in.read() == data  # nosec
+    blocks = logs_blocks._get_blocks(job)
+    assert [b[0] for b in blocks] == list(range(0, len(data), 8)) + [len(data)]  # nosec
+    assert logs_blocks.read(job, start=50, end=51) == "line 50\n"  # nosec
+
+
+def test_read_logs_blocks_uncompressed(mocker, tmpdir, logs_blocks):
+    job = mocker.Mock()
+    job.output_dir = tmpdir
+    (tmpdir / "output.yaml").write_text("hello\nworld\n", encoding="utf-8")
+    assert logs_blocks.read(job, start=1) == "world\n"  # nosec
+    (tmpdir / "output.yaml").remove()
+    # Without the blocks index, the whole stream is decompressed
+    with lzma.open(str(tmpdir / "output.yaml.xz"), "wb") as f_logs:
+        f_logs.write("compressed\nor\nnot".encode("utf-8"))
+    (tmpdir / "output.idx").remove()
+    assert logs_blocks.read(job, start=1, end=2) == "or\n"  # nosec
+
+
+def test_parse_lines():
+    data = """- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "json"}
+- {dt: "2020-04-01T00:00:00.000000", lvl: info, msg: yaml}
+- {"dt": invalid
+not a log line
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "partial"""
+    lines = list(parse_lines(data))
+    assert lines == [  # nosec
+        (
+            '- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "json"}',
+            {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "json"},
+        ),
+        (
+            '- {dt: "2020-04-01T00:00:00.000000", lvl: info, msg: yaml}',
+            {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "yaml"},
+        ),
+        ('- {"dt": invalid', None),
+        ("not a log line", None),
+    ]
+    assert list(parse_lines("")) == []  # nosec
+
+
+TIMING_LOGS = """- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "start: 0 validate"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "end: 0 validate (duration 00:00:01) [common]"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "start: 1 tftp-deploy (timeout 00:10:00) [common]"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "debug", "msg": "start: 1.1 download-retry (timeout 00:10:00) [common]"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "target", "msg": "start: 1.2 not an action (timeout 00:10:00)"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "debug", "msg": "end: 1.1 download-retry (duration 00:09:00) [common]"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "end: 1 tftp-deploy (duration 00:01:30) [common]"}
+- {"dt": "2020-04-01T00:00:00.000000", "lvl": "info", "msg": "end: 2 boot (duration 00:00:30) [common]"}
+"""
+
+
+def test_timing(mocker, tmpdir):
+    job = mocker.Mock()
+    job.output_dir = str(tmpdir)
+    (tmpdir / "output.yaml").write_text(TIMING_LOGS, encoding="utf-8")
+
+    entries = [
+        ["end", "0", "validate", 1.0, 1],
+        ["start", "1", "tftp-deploy", 600.0, 2],
+        ["start", "1.1", "download-retry", 600.0, 3],
+        ["end", "1.1", "download-retry", 540.0, 5],
+        ["end", "1", "tftp-deploy", 90.0, 6],
+        ["end", "2", "boot", 30.0, 7],
+    ]
+    # Extracted from the logs
+    assert read_timing(job) == entries  # nosec
+    assert not (tmpdir / "output.timing").exists()  # nosec
+    assert read_timing(job, save=True) == entries  # nosec
+    assert (tmpdir / "output.timing").exists()  # nosec
+
+    # Read from the timing file, skipping partial lines
+    (tmpdir / "output.yaml").remove()
+    with open(str(tmpdir / "output.timing"), "a") as f_timing:
+        f_timing.write('["start", "3", "lava-test')
+    assert read_timing(job) == entries  # nosec
+
+    assert compute_timing(entries) == {  # nosec
+        "pipeline": [
+            ("1", "tftp-deploy", 90.0, 600.0, False, 2),
+            ("1.1", "download-retry", 540.0, 600.0, True, 3),
+            ("2", "???", 30.0, 0.0, True, None),
+        ],
+        "summary": [["tftp-deploy", 90.0, 75.0], ["boot", 30.0, 25.0]],
+        "total_duration": 120.0,
+        "max_duration": 540.0,
+    }
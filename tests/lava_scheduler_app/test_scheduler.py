@@ -22,12 +22,22 @@
 from datetime import timedelta
 
 from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models.signals import post_save
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from tests.utils import DummyLogger
-from lava_scheduler_app.models import Device, DeviceType, TestJob, Worker
-from lava_scheduler_app.scheduler import schedule, schedule_health_checks
+from lava_scheduler_app.models import Device, DeviceType, Tag, TestJob, Worker
+from lava_scheduler_app.scheduler import (
+    PendingJobs,
+    schedule,
+    schedule_health_checks,
+    schedule_jobs_for_device,
+    SubmitPermissions,
+    SchedulerState,
+)
 
 
 def _minimal_valid_job(self):
@@ -102,9 +112,11 @@ class TestHealthCheckScheduling(TestCase):
         self.device03.save()
 
         self.original_health_check = Device.get_health_check
+        self.original_is_valid = Device.is_valid
 
     def tearDown(self):
         Device.get_health_check = self.original_health_check
+        Device.is_valid = self.original_is_valid
 
     def _check_hc_scheduled(self, device):
         device.refresh_from_db()
@@ -342,6 +354,69 @@ class TestHealthCheckScheduling(TestCase):
         self.assertTrue(current_hc.health_check)
         self.assertEqual(current_hc.state, TestJob.STATE_SCHEDULED)
 
+    def test_health_frequency_jobs_queries(self):
+        self.device_type01.health_denominator = DeviceType.HEALTH_PER_JOB
+        self.device_type01.health_frequency = 2
+        self.device_type01.save()
+        Device.get_health_check = _minimal_valid_job
+        Device.is_valid = lambda cls: True
+
+        def add_devices(count):
+            for _ in range(count):
+                index = Device.objects.count()
+                device = Device.objects.create(
+                    hostname="panda-%02d" % index,
+                    device_type=self.device_type01,
+                    worker_host=self.worker01,
+                    health=Device.HEALTH_GOOD,
+                )
+                device.last_health_report_job = TestJob.objects.create(
+                    health_check=True,
+                    actual_device=device,
+                    submitter=self.user,
+                    state=TestJob.STATE_FINISHED,
+                    health=TestJob.HEALTH_COMPLETE,
+                )
+                device.save()
+                TestJob.objects.create(
+                    actual_device=device,
+                    submitter=self.user,
+                    start_time=timezone.now(),
+                    state=TestJob.STATE_FINISHED,
+                    health=TestJob.HEALTH_COMPLETE,
+                )
+
+        self.device01.health = Device.HEALTH_BAD
+        self.device01.save()
+        self.device03.health = Device.HEALTH_BAD
+        self.device03.save()
+
+        add_devices(2)
+        with CaptureQueriesContext(connection) as ctx_2:
+            (available, jobs) = schedule_health_checks(DummyLogger())
+        self.assertEqual(available["panda"], ["panda-04", "panda-05"])
+        self.assertEqual(jobs, [])
+
+        add_devices(8)
+        with CaptureQueriesContext(connection) as ctx_10:
+            (available, jobs) = schedule_health_checks(DummyLogger())
+        self.assertEqual(len(available["panda"]), 10)
+        self.assertEqual(jobs, [])
+        self.assertEqual(len(ctx_2), len(ctx_10))
+
+        # One more job on panda-04: an health-check is needed
+        TestJob.objects.create(
+            actual_device=Device.objects.get(hostname="panda-04"),
+            submitter=self.user,
+            start_time=timezone.now(),
+            state=TestJob.STATE_FINISHED,
+            health=TestJob.HEALTH_COMPLETE,
+        )
+        (available, jobs) = schedule_health_checks(DummyLogger())
+        self.assertEqual(len(available["panda"]), 9)
+        self.assertEqual(len(jobs), 1)
+        self._check_hc_scheduled(Device.objects.get(hostname="panda-04"))
+
 
 class TestVisibility(TestCase):
     def setUp(self):
@@ -879,3 +954,221 @@ class TestJobLimit(TestCase):
                 job.actual_device.state = Device.STATE_IDLE
                 job.actual_device.save()
                 job.save()
+
+
+class TestSchedulerState(TestCase):
+    def setUp(self):
+        self.worker01 = Worker.objects.create(
+            hostname="worker-01", state=Worker.STATE_ONLINE, job_limit=1
+        )
+        self.worker02 = Worker.objects.create(
+            hostname="worker-02", state=Worker.STATE_OFFLINE
+        )
+        self.device_type01 = DeviceType.objects.create(name="panda")
+        self.device01 = Device.objects.create(
+            hostname="panda01",
+            device_type=self.device_type01,
+            worker_host=self.worker01,
+            health=Device.HEALTH_GOOD,
+        )
+        self.device02 = Device.objects.create(
+            hostname="panda02",
+            device_type=self.device_type01,
+            worker_host=self.worker01,
+            health=Device.HEALTH_GOOD,
+        )
+        self.device03 = Device.objects.create(
+            hostname="panda03",
+            device_type=self.device_type01,
+            worker_host=self.worker02,
+            health=Device.HEALTH_GOOD,
+        )
+        self.user = User.objects.create(username="user-01")
+        self.original_health_check = Device.get_health_check
+        Device.get_health_check = lambda cls: None
+
+    def tearDown(self):
+        Device.get_health_check = self.original_health_check
+
+    def _create_job(self, priority=TestJob.MEDIUM):
+        return TestJob.objects.create(
+            requested_device_type=self.device_type01,
+            submitter=self.user,
+            definition=_minimal_valid_job(None),
+            priority=priority,
+        )
+
+    def test_reconcile(self):
+        j01 = self._create_job(TestJob.LOW)
+        j02 = self._create_job(TestJob.HIGH)
+        j03 = self._create_job(TestJob.MEDIUM)
+
+        state = SchedulerState()
+        state.reconcile()
+        self.assertEqual(state.device_types(), {"panda"})
+        self.assertEqual(state.available_devices("panda"), ["panda01", "panda02"])
+        workers = state.worker_summary()
+        self.assertEqual(workers["worker-01"], {"max": 1, "busy": 0})
+        self.assertEqual(workers["worker-02"], {"max": 0, "busy": 0})
+        self.assertTrue(state.has_pending_jobs("panda"))
+        self.assertEqual(list(state.pending_jobs("panda")), [j02, j03, j01])
+
+    def test_refresh(self):
+        state = SchedulerState()
+        state.reconcile()
+        self.assertFalse(state.has_pending_jobs("panda"))
+
+        # New jobs are only visible once marked as changed
+        j01 = self._create_job()
+        state.refresh()
+        self.assertFalse(state.has_pending_jobs("panda"))
+        state.job_changed(j01.id)
+        state.refresh()
+        self.assertEqual(list(state.pending_jobs("panda")), [j01])
+
+        # Workers are always reloaded
+        self.worker02.go_state_online()
+        self.worker02.save()
+        Worker.objects.filter(hostname="worker-01").update(job_limit=2)
+        state.refresh()
+        self.assertEqual(
+            state.available_devices("panda"), ["panda01", "panda02", "panda03"]
+        )
+        self.assertEqual(state.worker_summary()["worker-01"], {"max": 2, "busy": 0})
+
+        # Device going to maintenance
+        self.device02.health = Device.HEALTH_MAINTENANCE
+        self.device02.save()
+        state.device_changed(self.device02.hostname)
+        state.refresh()
+        self.assertEqual(state.available_devices("panda"), ["panda01", "panda03"])
+
+        # Canceled job
+        j01.go_state_canceling()
+        j01.save()
+        state.job_changed(j01.id)
+        state.refresh()
+        self.assertFalse(state.has_pending_jobs("panda"))
+
+    def test_schedule(self):
+        j01 = self._create_job(TestJob.LOW)
+        j02 = self._create_job(TestJob.HIGH)
+
+        state = SchedulerState()
+        state.reconcile()
+        # worker-01 only accepts one job at a time
+        self.assertEqual(schedule(DummyLogger(), state=state), [j02.id])
+        j02.refresh_from_db()
+        self.assertEqual(j02.state, TestJob.STATE_SCHEDULED)
+
+        # The scheduled job and device are updated by the next pass
+        self.assertEqual(schedule(DummyLogger(), state=state), [])
+        self.assertEqual(state.worker_summary()["worker-01"]["busy"], 1)
+        self.assertEqual(list(state.pending_jobs("panda")), [j01])
+
+        # Changes made by other processes are tracked through events
+        j02.go_state_finished(TestJob.HEALTH_COMPLETE)
+        j02.save()
+        state.device_changed(j02.actual_device.hostname)
+        state.job_changed(j02.id)
+        self.assertEqual(schedule(DummyLogger(), state=state), [j01.id])
+
+    def test_connect(self):
+        state = SchedulerState()
+        state.reconcile()
+        state.connect()
+        try:
+            j01 = self._create_job()
+            self.assertEqual(state.dirty_jobs, {j01.id})
+            state.refresh()
+            self.assertEqual(list(state.pending_jobs("panda")), [j01])
+        finally:
+            post_save.disconnect(sender=Device, dispatch_uid="scheduler_state_device")
+            post_save.disconnect(sender=TestJob, dispatch_uid="scheduler_state_testjob")
+
+
+class TestEligibility(TestCase):
+    def setUp(self):
+        self.worker01 = Worker.objects.create(
+            hostname="worker-01", state=Worker.STATE_ONLINE
+        )
+        self.device_type01 = DeviceType.objects.create(name="panda")
+        self.device01 = Device.objects.create(
+            hostname="panda01",
+            device_type=self.device_type01,
+            worker_host=self.worker01,
+            health=Device.HEALTH_GOOD,
+        )
+        self.tag01 = Tag.objects.create(name="usb")
+        self.tag02 = Tag.objects.create(name="sata")
+        self.device01.tags.add(self.tag01)
+        self.user = User.objects.create(username="user-01")
+        self.original_health_check = Device.get_health_check
+        Device.get_health_check = lambda cls: None
+
+    def tearDown(self):
+        Device.get_health_check = self.original_health_check
+
+    def _create_job(self, tags):
+        job = TestJob.objects.create(
+            requested_device_type=self.device_type01,
+            submitter=self.user,
+            definition=_minimal_valid_job(None),
+        )
+        job.tags.add(*tags)
+        return job
+
+    def test_tags(self):
+        j01 = self._create_job([self.tag01, self.tag02])
+        j02 = self._create_job([self.tag01])
+        self.assertEqual(schedule(DummyLogger()), [j02.id])
+        j01.refresh_from_db()
+        self.assertEqual(j01.state, TestJob.STATE_SUBMITTED)
+
+    def test_queries(self):
+        # The number of queries does not depend on the number of jobs
+        for _ in range(10):
+            self._create_job([self.tag02])
+        with CaptureQueriesContext(connection) as ctx_10:
+            self.assertEqual(schedule(DummyLogger()), [])
+        for _ in range(10):
+            self._create_job([self.tag02])
+        with CaptureQueriesContext(connection) as ctx_20:
+            self.assertEqual(schedule(DummyLogger()), [])
+        self.assertEqual(len(ctx_10), len(ctx_20))
+
+    def test_permissions_cache(self):
+        j01 = self._create_job([self.tag02])
+        j02 = self._create_job([self.tag02])
+        j03 = self._create_job([])
+        device02 = Device.objects.create(
+            hostname="panda02",
+            device_type=self.device_type01,
+            worker_host=self.worker01,
+            health=Device.HEALTH_GOOD,
+        )
+        permissions = SubmitPermissions([self.device01, device02])
+        pending_jobs = PendingJobs([j01, j02, j03])
+        original_can_submit = Device.can_submit
+        calls = []
+
+        def can_submit(device, user):
+            calls.append((device.hostname, user))
+            return original_can_submit(device, user)
+
+        Device.can_submit = can_submit
+        try:
+            self.assertEqual(
+                schedule_jobs_for_device(
+                    DummyLogger(), self.device01, pending_jobs, permissions
+                ),
+                j03.id,
+            )
+            # Every device was checked at once
+            self.assertTrue(permissions.can_submit(device02, self.user))
+        finally:
+            Device.can_submit = original_can_submit
+        self.assertEqual(calls, [("panda01", self.user), ("panda02", self.user)])
+        self.assertEqual(permissions.permitted, {self.user.id: {"panda01", "panda02"}})
+        self.assertEqual(pending_jobs.scheduled, {j03.id})
+        self.assertEqual(list(pending_jobs), [j01, j02])
@@ -26,6 +26,7 @@ from django.http import Http404
 from django.urls import reverse
 from django.utils import timezone
 
+from lava_results_app.models import TestCase, TestSuite
 from lava_scheduler_app.models import (
     Alias,
     Device,
@@ -431,6 +432,31 @@ def test_job_timing(client, monkeypatch, setup):
     job_1 = TestJob.objects.get(description="test job 01")
     ret = client.post(reverse("lava.scheduler.job.timing", args=[job_1.pk]))
     assert ret.status_code == 200  # nosec
+    assert simplejson.loads(ret.content)["graph"] == [  # nosec
+        ["1.1", "deploy-device-env", 10.0, 232.0, False, 0]
+    ]
+
+
+@pytest.mark.django_db
+def test_job_timing_file(client, monkeypatch, tmpdir, setup):
+    monkeypatch.setattr(TestJob, "output_dir", str(tmpdir))
+    (tmpdir / "output.yaml").write_text(
+        """- {"dt": "2019-11-05T09:06:14.952630", "lvl": "debug", "msg": "start: 1.1 deploy-device-env (timeout 00:03:52) [common]"}
+- {"dt": "2019-11-05T09:06:14.953059", "lvl": "debug", "msg": "end: 1.1 deploy-device-env (duration 00:00:10) [common]"}
+""",
+        encoding="utf-8",
+    )
+    job_1 = TestJob.objects.get(description="test job 01")
+    ret = client.post(reverse("lava.scheduler.job.timing", args=[job_1.pk]))
+    assert ret.status_code == 200  # nosec
+    # The timing of finished jobs is saved
+    assert (tmpdir / "output.timing").exists()  # nosec
+    (tmpdir / "output.yaml").remove()
+    ret = client.post(reverse("lava.scheduler.job.timing", args=[job_1.pk]))
+    assert ret.status_code == 200  # nosec
+    assert simplejson.loads(ret.content)["graph"] == [  # nosec
+        ["1.1", "deploy-device-env", 10.0, 232.0, False, 0]
+    ]
 
 
 @pytest.mark.django_db
@@ -485,7 +511,7 @@ def test_job_log_incremental(client, monkeypatch, setup):
     )
     monkeypatch.setattr(
         "lava_scheduler_app.logutils.logs_instance.read",
-        lambda dir_name, first_line: """
+        lambda dir_name, first_line, last_line: """
 - {"dt": "2019-11-04T15:39:52.345099", "lvl": "results", "msg": {"case": "validate", "definition": "lava", "result": "pass"}}
 - {"dt": "2019-11-04T15:39:52.345794", "lvl": "info", "msg": "start: 1 lxc-deploy (timeout 00:05:00) [tlxc]"}
 """,
@@ -839,6 +865,112 @@ def test_job_detail(client, setup):
     assert ret.context["log_data"] == []  # nosec
 
 
+@pytest.mark.django_db
+def test_job_detail_log_window(client, monkeypatch, tmpdir, setup):
+    job = TestJob.objects.get(description="test job 01")
+    suite = TestSuite.objects.create(job=job, name="lava")
+    case = TestCase.objects.create(suite=suite, name="validate", result=0)
+    (tmpdir / "output.yaml").write_text(
+        """- {"dt": "2019-11-04T15:39:52.345099", "lvl": "info", "msg": "line 0"}
+- {"dt": "2019-11-04T15:39:52.345100", "lvl": "info", "msg": "line 1"}
+- {dt: 2019-11-04T15:39:52.345101, lvl: target, msg: "line 2"}
+- {"dt": "2019-11-04T15:39:52.345102", "lvl": "results", "msg": {"case": "validate", "definition": "lava", "result": "pass"}}
+- {"dt": "2019-11-04T15:39:52.345103", "lvl": "info", "msg": "line 4\\U0001f600"}
+- {"dt": invalid
+""",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(TestJob, "output_dir", str(tmpdir))
+    monkeypatch.setattr("lava_scheduler_app.views.LOG_WINDOW", 3)
+
+    # Only the first lines are rendered
+    ret = client.get(reverse("lava.scheduler.job.detail", args=[job.pk]))
+    assert ret.status_code == 200  # nosec
+    assert [l["msg"] for l in ret.context["log_data"]] == [  # nosec
+        "line 0",
+        "line 1",
+        "line 2",
+    ]
+    assert ret.context["log_lines"] == 6  # nosec
+    assert ret.context["invalid_log_data"] is False  # nosec
+
+    # The next lines are loaded by windows
+    ret = client.get(
+        reverse("lava.scheduler.job.log_incremental", args=[job.pk]) + "?line=3"
+    )
+    assert ret.status_code == 200  # nosec
+    data = ret.json()
+    assert len(data) == 3  # nosec
+    assert data[0]["msg"]["case_id"] == case.id  # nosec
+    assert data[1]["msg"] == "line 4\U0001f600"  # nosec
+    assert data[2]["lvl"] == "error"  # nosec
+    assert data[2]["msg"] == '- {"dt": invalid'  # nosec
+
+    ret = client.get(
+        reverse("lava.scheduler.job.log_incremental", args=[job.pk]) + "?line=6"
+    )
+    assert ret.json() == []  # nosec
+    assert ret["X-Is-Finished"] == "1"  # nosec
+
+
+@pytest.mark.django_db
+def test_job_log_stream(client, monkeypatch, settings, tmpdir, setup):
+    job = TestJob.objects.get(description="test job 01")
+    (tmpdir / "output.yaml").write_text(
+        """- {"dt": "2019-11-04T15:39:52.345099", "lvl": "info", "msg": "line 0"}
+- {"dt": "2019-11-04T15:39:52.345100", "lvl": "info", "msg": "line 1"}
+- {"dt": "2019-11-04T15:39:52.345101", "lvl": "info", "msg": "line 2"}
+""",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr(TestJob, "output_dir", str(tmpdir))
+    monkeypatch.setattr("lava_scheduler_app.views.LOG_WINDOW", 2)
+    url = reverse("lava.scheduler.job.log_stream", args=[job.pk])
+
+    def events(ret):
+        assert ret["Content-Type"] == "text/event-stream"  # nosec
+        data = b"".join(ret.streaming_content).decode("utf-8")
+        assert data.startswith("retry: 1000\n\n")  # nosec
+        ret = []
+        for event in data.split("\n\n")[1:-1]:
+            fields = dict(l.split(": ", 1) for l in event.split("\n"))
+            if fields["event"] == "lines":
+                fields["data"] = [l["msg"] for l in simplejson.loads(fields["data"])]
+            ret.append(fields)
+        return ret
+
+    # Finished job: every line is sent by windows
+    assert events(client.get(url + "?line=1")) == [  # nosec
+        {"id": "3", "event": "lines", "data": ["line 1", "line 2"]},
+        {"event": "finished", "data": ""},
+    ]
+    # Resume after the last event
+    assert events(client.get(url, HTTP_LAST_EVENT_ID="2")) == [  # nosec
+        {"id": "3", "event": "lines", "data": ["line 2"]},
+        {"event": "finished", "data": ""},
+    ]
+    # Negative lines start at the beginning
+    assert events(client.get(url, HTTP_LAST_EVENT_ID="-2"))[0] == {  # nosec
+        "id": "2",
+        "event": "lines",
+        "data": ["line 0", "line 1"],
+    }
+
+    # Running job: the stream is closed after LOG_STREAM_DURATION
+    settings.LOG_STREAM_DURATION = 0
+    job.state = TestJob.STATE_RUNNING
+    job.save()
+    assert events(client.get(url)) == [  # nosec
+        {"id": "2", "event": "lines", "data": ["line 0", "line 1"]},
+        {"id": "3", "event": "lines", "data": ["line 2"]},
+    ]
+
+    # Too large
+    settings.LOG_SIZE_LIMIT = 0
+    ret = client.get(url)
+    assert ret.content == b"event: size-warning\ndata: \n\n"  # nosec
+
+
 @pytest.mark.django_db
 def test_job_definition(client, setup):
     ret = client.get(
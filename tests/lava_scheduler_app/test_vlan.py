@@ -105,6 +105,7 @@ class TestVlandDevices(TestCaseWithFactory):
         vlan_job = TestJob.from_yaml_and_user(yaml_safe_dump(data), user)
         assignments = {}
         for job in vlan_job:
+            self.assertTrue(job.requires_vland)
             self.assertFalse(
                 match_vlan_interface(self.bbb3, yaml_safe_load(job.definition))
             )
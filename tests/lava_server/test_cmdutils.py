@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020-present Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+from lava_server.cmdutils import read_inotify_events, watch_directory
+
+
+def test_inotify(tmpdir):
+    fd = watch_directory(str(tmpdir))
+    assert fd is not None
+    try:
+        (tmpdir / "qemu01.jinja2").write("hello")
+        (tmpdir / "qemu02.jinja2").write("world")
+        names = read_inotify_events(fd)
+        assert set(names) == {"qemu01.jinja2", "qemu02.jinja2"}
+    finally:
+        os.close(fd)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2020-present Linaro Limited
+#
+# This file is part of LAVA.
+#
+# LAVA is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License version 3
+# as published by the Free Software Foundation
+#
+# LAVA is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with LAVA.  If not, see <http://www.gnu.org/licenses/>.
+
+from importlib import import_module
+
+import pytest
+
+lava_logs = import_module("lava_server.management.commands.lava-logs")
+
+
+@pytest.mark.parametrize("buffered", [False, True])
+def test_job_handler(mocker, tmpdir, buffered):
+    job = mocker.Mock()
+    job.output_dir = str(tmpdir)
+
+    handler = lava_logs.JobHandler(job, buffered=buffered)
+    assert handler.line_count() == 0
+    handler.write('- {"lvl": "info", "msg": "hello"}')
+    handler.write('- {"lvl": "info", "msg": "world"}')
+    assert handler.line_count() == 2
+    handler.marker("test", "start_test_case")
+    handler.write('- {"lvl": "target", "msg": "running"}')
+    handler.marker("test", "end_test_case")
+    assert handler.markers == {"test": {"start_test_case": 1, "end_test_case": 2}}
+    handler.close()
+
+    # Reopen the job logs, as after a restart
+    handler = lava_logs.JobHandler(job, buffered=buffered)
+    assert handler.line_count() == 3
+    assert handler.markers == {"test": {"start_test_case": 1, "end_test_case": 2}}
+    handler.write('- {"lvl": "info", "msg": "again"}')
+    handler.marker("test2", "test_case")
+    assert handler.markers["test2"] == {"test_case": 3}
+    handler.close()
+
+    # Partially written markers are skipped
+    with open(str(tmpdir / "output.markers"), "a") as f_markers:
+        f_markers.write('["test3", "start_te')
+    handler = lava_logs.JobHandler(job, buffered=buffered)
+    assert handler.line_count() == 4
+    assert sorted(handler.markers.keys()) == ["test", "test2"]
+    handler.close()
+
+
+def test_job_handler_timing(mocker, tmpdir):
+    job = mocker.Mock()
+    job.output_dir = str(tmpdir)
+
+    handler = lava_logs.JobHandler(job)
+    for msg in [
+        "start: 1 tftp-deploy (timeout 00:10:00) [common]",
+        "downloading",
+        "end: 1 tftp-deploy (duration 00:01:30) [common]",
+    ]:
+        handler.write('- {"lvl": "info", "msg": "%s"}' % msg)
+        handler.timing({"lvl": "info", "msg": msg})
+    handler.close()
+    assert (tmpdir / "output.timing").read_text(encoding="utf-8") == (  # nosec
+        '["start", "1", "tftp-deploy", 600.0, 0]\n'
+        '["end", "1", "tftp-deploy", 90.0, 2]\n'
+    )
+
+    # The timing file is kept up-to-date after a restart
+    handler = lava_logs.JobHandler(job)
+    msg = "start: 2 boot (timeout 00:05:00) [common]"
+    handler.write('- {"lvl": "info", "msg": "%s"}' % msg)
+    handler.timing({"lvl": "info", "msg": msg})
+    handler.close()
+    assert (
+        (tmpdir / "output.timing")
+        .read_text(encoding="utf-8")
+        .endswith('["start", "2", "boot", 300.0, 3]\n')  # nosec
+    )
+
+    # The timing file is not created for the jobs that were running before
+    # the upgrade: it would miss the first actions
+    (tmpdir / "output.timing").remove()
+    handler = lava_logs.JobHandler(job)
+    msg = "end: 2 boot (duration 00:00:30) [common]"
+    handler.write('- {"lvl": "info", "msg": "%s"}' % msg)
+    handler.timing({"lvl": "info", "msg": msg})
+    handler.close()
+    assert not (tmpdir / "output.timing").exists()  # nosec